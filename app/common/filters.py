@@ -0,0 +1,12 @@
+from aiogram.filters import BaseFilter
+from aiogram.types import TelegramObject, User
+from typing import Optional
+
+from app import config
+
+
+class IsAdmin(BaseFilter):
+    """Пропускает только пользователей из config.ADMIN_IDS."""
+
+    async def __call__(self, event: TelegramObject, event_from_user: Optional[User] = None) -> bool:
+        return event_from_user is not None and event_from_user.id in getattr(config, "ADMIN_IDS", ())
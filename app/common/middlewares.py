@@ -1,11 +1,35 @@
-from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject
-from typing import Callable, Dict, Any, Awaitable
+import asyncio
+import logging
+import time
 
+from aiogram import BaseMiddleware, Dispatcher, Router
+from aiogram.dispatcher.event.bases import CancelHandler, SkipHandler
+from aiogram.types import TelegramObject, Update
+from typing import TYPE_CHECKING, Callable, Dict, Any, Awaitable, List, Optional
+
+from app.services.fsm_service import CoalescingStorage
 from app.services.language_service import get_text
+from app.services.metrics_service import SlowUpdateProfiler, UpdateMetrics, update_metrics
+from app.services.user_service import UserCache, make_db_loader, user_cache
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+
+printx = logging.getLogger(__name__)
 
 
 class LanguageMiddleware(BaseMiddleware):
+    """
+    Определяет язык пользователя и передает в хэндлеры функцию перевода `_`.
+    Если задана фабрика сессий, язык берется из профиля пользователя через UserCache:
+    при попадании в кэш БД не запрашивается. Снимок профиля доступен как data['user_record'].
+    """
+
+    def __init__(self, session_factory: Optional["async_sessionmaker"] = None, cache: UserCache = user_cache):
+        self.cache = cache
+        self.loader = make_db_loader(session_factory) if session_factory is not None else None
+
     async def __call__(
         self,
         handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
@@ -14,17 +38,303 @@ class LanguageMiddleware(BaseMiddleware):
     ) -> Any:
         user = data.get('event_from_user')
         user_lang = "ru"
+        user_record = None
 
         if user:
-            # user_lang = await get_user_language_from_db(user.id)
             user_lang = getattr(user, 'language_code', "ru")
-            # state_data = await data['state'].get_data()
-            # user_lang = state_data.get("user_language", "ru")
+            if self.loader is not None:
+                user_record = await self.cache.get(user.id, self.loader)
+                if user_record is not None:
+                    user_lang = user_record.language
 
         def _(text_key: str, **kwargs) -> str:
             return get_text(text_key, lang=user_lang, **kwargs)
 
         data['_'] = _
         data['user_lang'] = user_lang
+        data['user_record'] = user_record
 
         return await handler(event, data)
+
+
+class DatabaseMiddleware(BaseMiddleware):
+    """
+    Передает в хэндлеры data['db'] - SessionProvider.
+    Соединение из пула берется только если хэндлер вызвал `await db.get()`;
+    после хэндлера транзакция фиксируется (или откатывается при ошибке) и сессия закрывается.
+    """
+
+    def __init__(self, factory: "async_sessionmaker"):
+        # SQLAlchemy загружается только с настроенной БД, а не при импорте модуля.
+        from app.database.database import SessionProvider
+
+        self.factory = factory
+        self.provider_class = SessionProvider
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        provider = self.provider_class(self.factory)
+        data['db'] = provider
+        try:
+            result = await handler(event, data)
+        except Exception:
+            await provider.close(commit=False)
+            raise
+        await provider.close(commit=True)
+        return result
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Собирает метрики обработки обновлений в UpdateMetrics.
+    Регистрируется через setup(dp): как outer-middleware на update меряет обновление целиком
+    (в работе, общая задержка, профилировщик медленных обновлений), а как inner-middleware
+    на типах событий - задержку и ошибки конкретного хэндлера и его роутера.
+
+    В main регистрируется после UserLaneMiddleware, то есть внутри воркера полосы: in_flight
+    и задержка обновления не включают ожидание в очереди полосы (его показывают метрики полос
+    lane_queue_depth), зато профилировщик в режиме "stack" видит стек самого хэндлера.
+    """
+
+    def __init__(self, metrics: UpdateMetrics = update_metrics, profiler: Optional[SlowUpdateProfiler] = None):
+        self.metrics = metrics
+        self.profiler = profiler
+        self._handler_names: Dict[Any, str] = {}
+
+    def setup(self, router: Router) -> "MetricsMiddleware":
+        router.update.outer_middleware(self._track_update)
+        for name, observer in router.observers.items():
+            if name not in ("update", "error"):
+                observer.middleware(self)
+        return self
+
+    async def _track_update(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        metrics = self.metrics
+        update_id = event.update_id if isinstance(event, Update) else None
+        token = self.profiler.start(update_id) if self.profiler is not None else None
+        metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.in_flight -= 1
+            metrics.updates.observe(elapsed)
+            if self.profiler is not None:
+                if elapsed >= self.profiler.threshold:
+                    metrics.slow_updates += 1
+                self.profiler.finish(token, update_id, elapsed)
+
+    def _handler_name(self, handler_object: Any) -> str:
+        callback = getattr(handler_object, "callback", None)
+        name = self._handler_names.get(callback)
+        if name is None:
+            name = getattr(callback, "__qualname__", None) or repr(callback)
+            self._handler_names[callback] = name
+        return name
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        event_router = data.get("event_router")
+        router_name = event_router.name if event_router is not None else "unknown"
+        handler_name = self._handler_name(data.get("handler"))
+        error = None
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except (SkipHandler, CancelHandler):
+            raise
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.metrics.observe_handler(router_name, handler_name, time.perf_counter() - started, error)
+
+
+class _Lane:
+    """Очередь одной полосы UserLaneMiddleware и ее воркер."""
+
+    __slots__ = ("queue", "worker", "processed", "max_depth", "blocked")
+
+    def __init__(self, size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self.worker: Optional[asyncio.Task] = None
+        self.processed = 0
+        self.max_depth = 0
+        self.blocked = 0
+
+
+class UserLaneMiddleware(BaseMiddleware):
+    """
+    Строгий порядок обновлений одного пользователя при параллельной обработке разных.
+
+    Пользователь (event_from_user.id, иначе id чата) хэшируется в одну из lanes полос;
+    у каждой полосы своя ограниченная очередь и один воркер, который обрабатывает ее по порядку.
+    Обновления разных полос идут параллельно. Если очередь полосы заполнена, вызывающий
+    (задача polling или вебхука) ждет места - это backpressure, а не рост памяти.
+    Обновления без пользователя и чата обрабатываются сразу.
+
+    Регистрируется через setup(dp) перед FSM-middleware, чтобы состояние следующего обновления
+    читалось уже после обработки предыдущего.
+    """
+
+    def __init__(self, lanes: int = 64, queue_size: int = 100):
+        """
+        :param lanes: Число полос (одновременно обрабатываемых пользователей).
+        :param queue_size: Размер очереди одной полосы.
+        """
+        self.lane_count = lanes
+        self.queue_size = queue_size
+        self._lanes: List[_Lane] = [_Lane(queue_size) for _ in range(lanes)]
+
+    def setup(self, dp: Dispatcher) -> "UserLaneMiddleware":
+        manager = dp.update.outer_middleware
+        fsm_registered = dp.fsm in manager
+        if fsm_registered:
+            manager.unregister(dp.fsm)
+        manager.register(self)
+        if fsm_registered:
+            manager.register(dp.fsm)
+        dp.shutdown.register(self.close)
+        return self
+
+    def lane_of(self, key: int) -> int:
+        return key % self.lane_count
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        chat = data.get('event_chat')
+        key = user.id if user is not None else chat.id if chat is not None else None
+        if key is None:
+            return await handler(event, data)
+
+        lane = self._lanes[self.lane_of(key)]
+        if lane.worker is None or lane.worker.done():
+            lane.worker = asyncio.create_task(self._work(lane))
+
+        future = asyncio.get_running_loop().create_future()
+        item = (handler, event, data, future)
+        if lane.queue.full():
+            lane.blocked += 1
+            await lane.queue.put(item)
+        else:
+            lane.queue.put_nowait(item)
+        depth = lane.queue.qsize()
+        if depth > lane.max_depth:
+            lane.max_depth = depth
+        return await future
+
+    @staticmethod
+    async def _work(lane: _Lane) -> None:
+        while True:
+            handler, event, data, future = await lane.queue.get()
+            if future.done():
+                # Вызывающий уже отменен (например, при остановке вебхука) - обновление не обрабатываем.
+                continue
+            try:
+                result = await handler(event, data)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            lane.processed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        depths = [lane.queue.qsize() for lane in self._lanes]
+        return {
+            "lanes": self.lane_count,
+            "queued": sum(depths),
+            "max_depth": max(lane.max_depth for lane in self._lanes),
+            "blocked": sum(lane.blocked for lane in self._lanes),
+            "processed": sum(lane.processed for lane in self._lanes),
+        }
+
+    def render_prometheus(self, prefix: str) -> List[str]:
+        lines = [
+            f"# HELP {prefix}_lane_queue_depth Updates waiting in a per-user lane.",
+            f"# TYPE {prefix}_lane_queue_depth gauge",
+        ]
+        lines.extend(f'{prefix}_lane_queue_depth{{lane="{index}"}} {lane.queue.qsize()}'
+                     for index, lane in enumerate(self._lanes))
+        stats = self.stats()
+        lines += [
+            f"# HELP {prefix}_lane_queue_depth_max Highest lane queue depth seen.",
+            f"# TYPE {prefix}_lane_queue_depth_max gauge",
+            f"{prefix}_lane_queue_depth_max {stats['max_depth']}",
+            f"# HELP {prefix}_lane_backpressure_total Updates that waited for room in a full lane.",
+            f"# TYPE {prefix}_lane_backpressure_total counter",
+            f"{prefix}_lane_backpressure_total {stats['blocked']}",
+        ]
+        return lines
+
+    def log_summary(self) -> None:
+        stats = self.stats()
+        printx.info(
+            f"Полосы обновлений: {stats['lanes']}, в очередях {stats['queued']}, "
+            f"максимальная глубина {stats['max_depth']}, ожиданий места {stats['blocked']}, "
+            f"обработано {stats['processed']}")
+
+    async def close(self) -> None:
+        """Останавливает воркеры полос (shutdown-хэндлер диспетчера)."""
+        workers = [lane.worker for lane in self._lanes if lane.worker is not None]
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for lane in self._lanes:
+            lane.worker = None
+
+
+class FSMWriteBehindMiddleware(BaseMiddleware):
+    """
+    Объединяет операции FSM одного обновления: CoalescingStorage читает состояние и данные
+    из хранилища один раз, а set_state + update_data хэндлера записывает одним запросом
+    после обработки (в том числе если хэндлер упал).
+
+    Регистрируется через setup(dp) после UserLaneMiddleware (область открывается в воркере
+    полосы) и перед FSM-middleware, которая читает состояние до хэндлеров.
+    """
+
+    def __init__(self, storage: CoalescingStorage):
+        self.storage = storage
+
+    def setup(self, dp: Dispatcher) -> "FSMWriteBehindMiddleware":
+        manager = dp.update.outer_middleware
+        fsm_registered = dp.fsm in manager
+        if fsm_registered:
+            manager.unregister(dp.fsm)
+        manager.register(self)
+        if fsm_registered:
+            manager.register(dp.fsm)
+        return self
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        async with self.storage.update_scope():
+            return await handler(event, data)
@@ -0,0 +1,310 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+from app import config
+
+
+printx = logging.getLogger(__name__)
+
+# Диалекты, для которых в requests есть INSERT IGNORE/upsert; остальные create_engine отклоняет.
+SUPPORTED_DIALECTS = ("mysql", "sqlite")
+
+engine: Optional[AsyncEngine] = None
+session_factory: Optional[async_sessionmaker] = None
+
+
+class PoolMetrics:
+    """
+    Счетчики пула соединений, заполняются событиями пула SQLAlchemy.
+    Ожидание (waits) - время от запроса соединения в SessionProvider.get до его выдачи из пула.
+    """
+
+    def __init__(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        self.waits += 1
+        self.total_wait += seconds
+        if seconds > self.max_wait:
+            self.max_wait = seconds
+
+    def snapshot(self, target_engine: AsyncEngine, reset_wait: bool = False) -> Dict[str, Any]:
+        """
+        Возвращает текущие показатели пула.
+        :param target_engine: Движок, пул которого опрашивается.
+        :param reset_wait: Обнулить статистику ожидания после снимка (для периодических отчетов).
+        """
+        pool = target_engine.pool
+        stats = {
+            "pool": type(pool).__name__,
+            "size": pool.size() if hasattr(pool, "size") else None,
+            "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "invalidations": self.invalidations,
+            "avg_wait_ms": self.total_wait / self.waits * 1000 if self.waits else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+        if reset_wait:
+            self.waits, self.total_wait, self.max_wait = 0, 0.0, 0.0
+        return stats
+
+
+pool_metrics = PoolMetrics()
+
+
+class _CheckoutTiming:
+    """Замер одной выдачи соединения: заводится в SessionProvider.get, заполняется событиями пула."""
+
+    __slots__ = ("started", "metrics", "connected")
+
+    def __init__(self, metrics: PoolMetrics):
+        self.started = time.perf_counter()
+        self.metrics = metrics
+        self.connected = False
+
+
+# События пула выполняются в том же контексте, что и await session.connection(), и видят замер.
+_checkout_timing: ContextVar[Optional[_CheckoutTiming]] = ContextVar("_checkout_timing", default=None)
+
+
+def _is_memory_sqlite(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _attach_pool_events(target_engine: AsyncEngine, metrics: PoolMetrics) -> None:
+    sync_engine = target_engine.sync_engine
+
+    @event.listens_for(sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        metrics.connects += 1
+        timing = _checkout_timing.get()
+        if timing is not None:
+            timing.connected = True
+        if sync_engine.dialect.name == "sqlite":
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.execute("PRAGMA busy_timeout=30000")
+            cursor.close()
+
+    @event.listens_for(sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.checkouts += 1
+        timing = _checkout_timing.get()
+        # Ожидание свободного соединения в пуле (с pre_ping), без BEGIN; выдача с новым
+        # подключением считается в connects, а не в ожидании.
+        if timing is not None and not timing.connected:
+            timing.metrics.record_wait(time.perf_counter() - timing.started)
+
+    @event.listens_for(sync_engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        metrics.checkins += 1
+
+    @event.listens_for(sync_engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.invalidations += 1
+
+
+def create_engine(
+    url: Optional[str] = None,
+    pool_size: Optional[int] = None,
+    max_overflow: Optional[int] = None,
+    pool_timeout: Optional[float] = None,
+    pool_recycle: Optional[int] = None,
+    pool_pre_ping: Optional[bool] = None,
+    echo: bool = False
+) -> AsyncEngine:
+    """
+    Создает асинхронный движок SQLAlchemy с настроенным пулом соединений.
+    Незаданные параметры берутся из config (DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING).
+
+    :param url: Строка подключения, например "mysql+aiomysql://..." или "sqlite+aiosqlite:///bot.db".
+    :param pool_size: Число постоянно открытых соединений.
+    :param max_overflow: Сколько соединений можно открыть сверх pool_size под пиковую нагрузку.
+    :param pool_timeout: Сколько секунд ждать свободное соединение.
+    :param pool_recycle: Через сколько секунд пересоздавать соединение (MySQL рвет простаивающие по wait_timeout).
+    :param pool_pre_ping: Проверять соединение перед выдачей из пула.
+    :param echo: Логировать SQL-запросы.
+    :return: Настроенный AsyncEngine.
+    :raises ValueError: Если СУБД не поддерживается слоем app/database/requests.py.
+    """
+    url = make_url(url or config.DATABASE_URL)
+    if url.get_backend_name() not in SUPPORTED_DIALECTS:
+        raise ValueError(f"СУБД {url.get_backend_name()} не поддерживается: "
+                         f"DATABASE_URL должен указывать на {' или '.join(SUPPORTED_DIALECTS)}")
+    engine_kwargs: Dict[str, Any] = {
+        "echo": echo,
+        "pool_pre_ping": getattr(config, "DB_POOL_PRE_PING", True) if pool_pre_ping is None else pool_pre_ping,
+    }
+    # SQLite в памяти работает через StaticPool с одним соединением, параметры очереди к нему неприменимы.
+    if not _is_memory_sqlite(url):
+        engine_kwargs.update(
+            pool_size=getattr(config, "DB_POOL_SIZE", 10) if pool_size is None else pool_size,
+            max_overflow=getattr(config, "DB_MAX_OVERFLOW", 20) if max_overflow is None else max_overflow,
+            pool_timeout=getattr(config, "DB_POOL_TIMEOUT", 30.0) if pool_timeout is None else pool_timeout,
+            pool_recycle=getattr(config, "DB_POOL_RECYCLE", 1800) if pool_recycle is None else pool_recycle,
+        )
+
+    new_engine = create_async_engine(url, **engine_kwargs)
+    _attach_pool_events(new_engine, pool_metrics)
+    return new_engine
+
+
+def create_session_factory(target_engine: AsyncEngine) -> async_sessionmaker:
+    """Фабрика сессий; expire_on_commit=False, чтобы объекты оставались доступны после commit в хэндлере."""
+    return async_sessionmaker(target_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def init_database(url: Optional[str] = None, **engine_kwargs: Any) -> async_sessionmaker:
+    """
+    Инициализирует глобальные engine и session_factory модуля.
+    :param url: Строка подключения; по умолчанию config.DATABASE_URL.
+    :param engine_kwargs: Параметры пула для create_engine.
+    :return: Фабрика сессий.
+    """
+    global engine, session_factory
+    engine = create_engine(url, **engine_kwargs)
+    session_factory = create_session_factory(engine)
+    printx.info(f"Подключение к БД инициализировано: {engine.url.render_as_string(hide_password=True)}")
+    return session_factory
+
+
+async def create_tables(target_engine: Optional[AsyncEngine] = None) -> None:
+    """Создает таблицы моделей (для SQLite в тестах и бенчмарках; в проде - миграции Alembic)."""
+    from app.database.models import Base
+
+    async with (target_engine or engine).begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+async def dispose_database() -> None:
+    """Закрывает все соединения пула."""
+    if engine is not None:
+        await engine.dispose()
+        printx.info("Соединения с БД закрыты.")
+
+
+async def log_pool_metrics(interval: float = 60.0, target_engine: Optional[AsyncEngine] = None) -> None:
+    """
+    Фоновая задача: раз в interval секунд пишет в лог метрики пула соединений.
+    :param interval: Период в секундах.
+    :param target_engine: Движок; по умолчанию глобальный engine модуля.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        current_engine = target_engine or engine
+        if current_engine is None:
+            continue
+        stats = pool_metrics.snapshot(current_engine, reset_wait=True)
+        printx.info(
+            f"Пул БД ({stats['pool']}): занято {stats['checked_out']}, размер {stats['size']}, "
+            f"overflow {stats['overflow']}, ожидание avg {stats['avg_wait_ms']:.1f} мс / "
+            f"max {stats['max_wait_ms']:.1f} мс, подключений {stats['connects']}, "
+            f"выдач {stats['checkouts']}, инвалидаций {stats['invalidations']}")
+
+
+class QueryCounter:
+    """Считает SQL-запросы, выполненные через движок, пока активен count_queries."""
+
+    def __init__(self):
+        self.count = 0
+        self.statements: List[str] = []
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        self.count += 1
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(target_engine: AsyncEngine) -> Iterator[QueryCounter]:
+    """
+    Контекстный менеджер для подсчета запросов (round trip'ов) к БД.
+
+    Пример:
+        with count_queries(engine) as counter:
+            await list_purchase_history(session, user_id, limit=10)
+        assert counter.count == 3
+    """
+    counter = QueryCounter()
+    event.listen(target_engine.sync_engine, "before_cursor_execute", counter._on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(target_engine.sync_engine, "before_cursor_execute", counter._on_execute)
+
+
+@contextmanager
+def assert_max_queries(target_engine: AsyncEngine, limit: int) -> Iterator[QueryCounter]:
+    """
+    Падает с AssertionError, если внутри блока выполнено больше limit запросов (например, N+1).
+    :param target_engine: Движок, запросы к которому считаются.
+    :param limit: Допустимое число запросов.
+    """
+    with count_queries(target_engine) as counter:
+        yield counter
+    if counter.count > limit:
+        statements = "\n".join(counter.statements)
+        raise AssertionError(f"Выполнено {counter.count} запросов вместо не более {limit}:\n{statements}")
+
+
+class SessionProvider:
+    """
+    Ленивый доступ к сессии БД в рамках одного обновления.
+    Сессия (и соединение из пула) создается только при первом вызове get().
+    """
+
+    def __init__(self, factory: async_sessionmaker, metrics: PoolMetrics = pool_metrics):
+        self._factory = factory
+        self._metrics = metrics
+        self._session: Optional[AsyncSession] = None
+
+    @property
+    def opened(self) -> bool:
+        return self._session is not None
+
+    async def get(self) -> AsyncSession:
+        """Возвращает сессию обновления, при первом вызове берет соединение из пула."""
+        if self._session is None:
+            session = self._factory()
+            token = _checkout_timing.set(_CheckoutTiming(self._metrics))
+            try:
+                await session.connection()
+            except Exception:
+                await session.close()
+                raise
+            finally:
+                _checkout_timing.reset(token)
+            self._session = session
+        return self._session
+
+    async def close(self, commit: bool = True) -> None:
+        """
+        Завершает сессию, если она открывалась.
+        :param commit: True - зафиксировать транзакцию, False - откатить.
+        """
+        session, self._session = self._session, None
+        if session is None:
+            return
+        try:
+            if commit:
+                await session.commit()
+            else:
+                await session.rollback()
+        finally:
+            await session.close()
@@ -0,0 +1,241 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional
+
+from sqlalchemy import (
+    BigInteger, Boolean, DateTime, ForeignKey, Index, Integer, Numeric, String, Text, UniqueConstraint, func
+)
+from sqlalchemy.ext.asyncio import AsyncAttrs
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+
+
+Money = Numeric(12, 2)
+
+
+class Base(AsyncAttrs, DeclarativeBase):
+    """Базовый класс моделей SQLAlchemy."""
+
+
+class User(Base):
+    """
+    Пользователь бота; id совпадает с Telegram user id.
+    referral_count и referral_topup_total - денормализованные агрегаты по его рефералам
+    (число рефералов и сумма их оплаченных пополнений), по ним за O(1) определяется уровень.
+    """
+    __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_referrer", "referrer_id"),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    username: Mapped[Optional[str]] = mapped_column(String(64))
+    language: Mapped[str] = mapped_column(String(8), default="ru")
+    role: Mapped[str] = mapped_column(String(16), default="user")
+    is_banned: Mapped[bool] = mapped_column(Boolean, default=False)
+    balance: Mapped[Decimal] = mapped_column(Money, default=Decimal("0"))
+    referrer_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id"))
+    referral_count: Mapped[int] = mapped_column(Integer, default=0)
+    referral_topup_total: Mapped[Decimal] = mapped_column(Money, default=Decimal("0"))
+    referral_earned: Mapped[Decimal] = mapped_column(Money, default=Decimal("0"))
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+
+class Category(Base):
+    __tablename__ = "categories"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(128), unique=True)
+
+
+class Product(Base):
+    """Товар площадки (seller_id is None) или лот пользователя на маркетплейсе."""
+    __tablename__ = "products"
+    __table_args__ = (
+        Index("ix_products_category_active", "category_id", "is_active", "id"),
+        Index("ix_products_seller", "seller_id", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    category_id: Mapped[int] = mapped_column(ForeignKey("categories.id"))
+    seller_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id"))
+    title: Mapped[str] = mapped_column(String(256))
+    description: Mapped[str] = mapped_column(Text, default="")
+    is_active: Mapped[bool] = mapped_column(Boolean, default=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+    category: Mapped["Category"] = relationship(lazy="raise")
+    seller: Mapped[Optional["User"]] = relationship(lazy="raise")
+    variants: Mapped[List["ProductVariant"]] = relationship(
+        back_populates="product", lazy="raise", order_by="ProductVariant.id")
+
+
+class ProductVariant(Base):
+    """Вариант товара: разовая покупка (duration_days is None) или подписка на срок."""
+    __tablename__ = "product_variants"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    product_id: Mapped[int] = mapped_column(ForeignKey("products.id"), index=True)
+    name: Mapped[str] = mapped_column(String(128))
+    price: Mapped[Decimal] = mapped_column(Money)
+    duration_days: Mapped[Optional[int]] = mapped_column(Integer)
+
+    product: Mapped["Product"] = relationship(back_populates="variants", lazy="raise")
+
+
+class Purchase(Base):
+    __tablename__ = "purchases"
+    __table_args__ = (
+        Index("ix_purchases_user", "user_id", "id"),
+        Index("ix_purchases_seller", "seller_id", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    product_id: Mapped[int] = mapped_column(ForeignKey("products.id"))
+    variant_id: Mapped[Optional[int]] = mapped_column(ForeignKey("product_variants.id"))
+    # Продавец денормализован, чтобы история продаж читалась по индексу без join к products.
+    seller_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id"))
+    price: Mapped[Decimal] = mapped_column(Money)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+    product: Mapped["Product"] = relationship(lazy="raise")
+    variant: Mapped[Optional["ProductVariant"]] = relationship(lazy="raise")
+
+
+class TopUp(Base):
+    """Пополнение баланса; (provider, external_id) - идентификатор платежа у провайдера."""
+    __tablename__ = "top_ups"
+    __table_args__ = (
+        UniqueConstraint("provider", "external_id", name="uq_top_ups_provider_external"),
+        Index("ix_top_ups_user", "user_id", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    provider: Mapped[str] = mapped_column(String(32))
+    external_id: Mapped[str] = mapped_column(String(64))
+    amount: Mapped[Decimal] = mapped_column(Money)
+    status: Mapped[str] = mapped_column(String(16), default="pending")
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+
+class Broadcast(Base):
+    """
+    Рассылка администратора. last_user_id - контрольная точка: всем пользователям
+    с id <= last_user_id сообщение уже отправлено (или попытка завершилась ошибкой).
+    done_ahead - id через запятую, обработанные после контрольной точки не по порядку.
+    """
+    __tablename__ = "broadcasts"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    created_by: Mapped[int] = mapped_column(BigInteger)
+    text: Mapped[str] = mapped_column(Text)
+    status: Mapped[str] = mapped_column(String(16), default="running")
+    last_user_id: Mapped[int] = mapped_column(BigInteger, default=0)
+    done_ahead: Mapped[str] = mapped_column(Text, default="")
+    sent: Mapped[int] = mapped_column(Integer, default=0)
+    failed: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
+
+class FSMRecord(Base):
+    """Состояние FSM aiogram: ключ хранилища, состояние и данные (JSON); expires_at - истечение брошенного диалога."""
+    __tablename__ = "fsm_states"
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    state: Mapped[Optional[str]] = mapped_column(String(255))
+    data: Mapped[str] = mapped_column(Text, default="{}")
+    expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime, index=True)
+
+
+class LedgerEntry(Base):
+    """
+    Журнал движений баланса, только дописывается: amount > 0 - зачисление, < 0 - списание.
+    idempotency_key - ключ операции (из update_id Telegram или id платежа); обе ноги перевода
+    пишутся с одним ключом, повтор операции с тем же ключом ничего не меняет.
+    """
+    __tablename__ = "ledger"
+    __table_args__ = (
+        UniqueConstraint("idempotency_key", "user_id", name="uq_ledger_key_user"),
+        Index("ix_ledger_user", "user_id", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    amount: Mapped[Decimal] = mapped_column(Money)
+    kind: Mapped[str] = mapped_column(String(16))
+    idempotency_key: Mapped[str] = mapped_column(String(64))
+    counterparty_id: Mapped[Optional[int]] = mapped_column(BigInteger)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+
+class BalanceSnapshot(Base):
+    """
+    Свернутый журнал: баланс пользователя по записям ledger с id <= entry_id.
+    Баланс по журналу = balance + сумма записей пользователя с id > entry_id.
+    """
+    __tablename__ = "balance_snapshots"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True, autoincrement=False)
+    balance: Mapped[Decimal] = mapped_column(Money, default=Decimal("0"))
+    entry_id: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class PromoCode(Base):
+    """
+    Промокод. kind: "balance" (value - сумма на баланс), "product" (бесплатный product_id/variant_id),
+    "discount" (value - доля скидки 0..1), "topup_bonus" (value - доля бонуса к пополнению).
+    Скидка действует на товары и категории из promo_targets; нет целей - на все товары.
+    max_uses - общий лимит активаций (None - без лимита), каждый пользователь активирует код один раз.
+    """
+    __tablename__ = "promo_codes"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    code: Mapped[str] = mapped_column(String(32), unique=True)
+    kind: Mapped[str] = mapped_column(String(16))
+    value: Mapped[Decimal] = mapped_column(Money, default=Decimal("0"))
+    product_id: Mapped[Optional[int]] = mapped_column(ForeignKey("products.id"))
+    variant_id: Mapped[Optional[int]] = mapped_column(ForeignKey("product_variants.id"))
+    max_uses: Mapped[Optional[int]] = mapped_column(Integer)
+    expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    is_active: Mapped[bool] = mapped_column(Boolean, default=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+
+class PromoTarget(Base):
+    """Товар или категория, на которые действует скидка промокода."""
+    __tablename__ = "promo_targets"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    promo_id: Mapped[int] = mapped_column(ForeignKey("promo_codes.id"), index=True)
+    product_id: Mapped[Optional[int]] = mapped_column(ForeignKey("products.id"))
+    category_id: Mapped[Optional[int]] = mapped_column(ForeignKey("categories.id"))
+
+
+class PromoCounter(Base):
+    """
+    Шард счетчика активаций: лимит промокода разбит на несколько строк со своими cap,
+    активация увеличивает used одной из них условным UPDATE. Одновременные активации
+    блокируют разные строки, а не одну строку промокода; сумма cap равна max_uses.
+    """
+    __tablename__ = "promo_counters"
+
+    promo_id: Mapped[int] = mapped_column(ForeignKey("promo_codes.id"), primary_key=True, autoincrement=False)
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    used: Mapped[int] = mapped_column(Integer, default=0)
+    cap: Mapped[int] = mapped_column(Integer)
+
+
+class PromoRedemption(Base):
+    """Активация промокода пользователем; (promo_id, user_id) уникальны - один раз на пользователя."""
+    __tablename__ = "promo_redemptions"
+    __table_args__ = (
+        UniqueConstraint("promo_id", "user_id", name="uq_promo_redemptions_promo_user"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    promo_id: Mapped[int] = mapped_column(ForeignKey("promo_codes.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
@@ -0,0 +1,686 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Select, bindparam, delete, func, insert, or_, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, selectinload
+
+from app.database.models import (
+    BalanceSnapshot, Broadcast, Category, FSMRecord, LedgerEntry, Product, PromoCode, PromoCounter, PromoRedemption,
+    PromoTarget, Purchase, TopUp, User
+)
+
+
+# Внутренний API доступа к данным. Функции принимают AsyncSession и не делают commit -
+# транзакцией управляет вызывающий (обычно DatabaseMiddleware). Списки читаются keyset-пагинацией,
+# связи подгружаются через selectinload: число запросов на экран не зависит от размера страницы.
+
+# Полная загрузка товара для карточки: варианты, продавец и категория - три запроса на любую пачку товаров.
+PRODUCT_DETAILS = (
+    selectinload(Product.variants),
+    selectinload(Product.seller),
+    selectinload(Product.category),
+)
+
+
+# INSERT IGNORE/upsert ниже есть для диалектов database.SUPPORTED_DIALECTS. Остальные create_engine отклоняет
+# при запуске, поэтому функции записи не проверяют диалект сами: все, что не MySQL, здесь - SQLite.
+def _insert_ignore(session: AsyncSession, model: Any, values: Any, conflict: Sequence[Any]):
+    """INSERT, пропускающий строки с уже существующим ключом (INSERT IGNORE / ON CONFLICT DO NOTHING)."""
+    if session.bind.dialect.name == "mysql":
+        return mysql_insert(model).values(values).prefix_with("IGNORE")
+    return sqlite_insert(model).values(values).on_conflict_do_nothing(index_elements=conflict)
+
+
+def _upsert(
+    session: AsyncSession, model: Any, values: Any, conflict: Sequence[Any], set_: Callable[[Any], Dict[str, Any]]
+):
+    """
+    INSERT ... ON DUPLICATE KEY UPDATE / ON CONFLICT DO UPDATE.
+    :param set_: По вставляемой строке (inserted/excluded) возвращает колонки для обновления существующей.
+    """
+    if session.bind.dialect.name == "mysql":
+        stmt = mysql_insert(model).values(values)
+        return stmt.on_duplicate_key_update(**set_(stmt.inserted))
+    stmt = sqlite_insert(model).values(values)
+    return stmt.on_conflict_do_update(index_elements=conflict, set_=set_(stmt.excluded))
+
+
+async def _fetch_keyset_page(session: AsyncSession, stmt: Select, limit: int) -> Tuple[List[Any], bool]:
+    """Выполняет запрос с LIMIT limit+1 и возвращает (строки страницы, есть_ли_следующая)."""
+    rows = list((await session.scalars(stmt.limit(limit + 1))).all())
+    return rows[:limit], len(rows) > limit
+
+
+# --- Пользователи ---
+
+async def get_user(session: AsyncSession, user_id: int, refresh: bool = False) -> Optional[User]:
+    """
+    Возвращает пользователя по Telegram id или None.
+    :param refresh: Перечитать строку из БД, даже если объект уже есть в сессии.
+    """
+    return await session.get(User, user_id, populate_existing=refresh)
+
+
+async def ensure_user(session: AsyncSession, user_id: int, **values: Any) -> bool:
+    """
+    Создает строку пользователя, если ее еще нет (INSERT IGNORE / ON CONFLICT DO NOTHING);
+    существующая строка не меняется.
+    :param values: Начальные значения колонок (username, language, ...).
+    :return: True, если пользователь создан сейчас.
+    """
+    result = await session.execute(_insert_ignore(session, User, {"id": user_id, **values}, [User.id]))
+    return result.rowcount > 0
+
+
+async def update_user(session: AsyncSession, user_id: int, **values: Any) -> bool:
+    """
+    Обновляет поля пользователя одним UPDATE без предварительного SELECT.
+    :param values: Новые значения колонок (language, is_banned, role, ...).
+    :return: True, если пользователь найден.
+    """
+    result = await session.execute(update(User).where(User.id == user_id).values(**values))
+    return result.rowcount > 0
+
+
+async def list_recipient_ids(session: AsyncSession, after_id: int, limit: int) -> List[int]:
+    """
+    Очередная пачка id незабаненных пользователей для рассылки, по возрастанию.
+    :param after_id: Id последнего пользователя предыдущей пачки.
+    :param limit: Размер пачки.
+    """
+    stmt = (
+        select(User.id)
+        .where(User.id > after_id, User.is_banned.is_(False))
+        .order_by(User.id)
+        .limit(limit)
+    )
+    return list((await session.scalars(stmt)).all())
+
+
+# --- Рефералы ---
+# Агрегаты по рефералам (referral_count, referral_topup_total) хранятся у пригласившего и меняются
+# атомарными инкрементами в транзакции события; reconcile-функции ниже пересчитывают их пакетно.
+
+async def set_referrer(session: AsyncSession, user_id: int, referrer_id: int) -> bool:
+    """
+    Привязывает пользователя к пригласившему (только один раз и не к самому себе)
+    и увеличивает referral_count пригласившего в той же транзакции.
+    :return: True, если привязка выполнена.
+    """
+    if user_id == referrer_id:
+        return False
+    result = await session.execute(
+        update(User)
+        .where(User.id == user_id, User.referrer_id.is_(None))
+        .values(referrer_id=referrer_id)
+    )
+    if result.rowcount == 0:
+        return False
+    await session.execute(
+        update(User).where(User.id == referrer_id).values(referral_count=User.referral_count + 1))
+    return True
+
+
+async def add_referral_topup(
+    session: AsyncSession, referrer_id: int, amount: Decimal
+) -> Optional[Tuple[int, Decimal]]:
+    """
+    Прибавляет оплаченное пополнение реферала к агрегату пригласившего.
+    UPDATE блокирует строку пригласившего до конца транзакции, поэтому одновременные
+    пополнения его рефералов не теряют инкременты.
+    :return: Новые (referral_count, referral_topup_total) или None, если пригласивший не найден.
+    """
+    result = await session.execute(
+        update(User)
+        .where(User.id == referrer_id)
+        .values(referral_topup_total=User.referral_topup_total + amount)
+    )
+    if result.rowcount == 0:
+        return None
+    row = (await session.execute(
+        select(User.referral_count, User.referral_topup_total).where(User.id == referrer_id))).one()
+    return row.referral_count, row.referral_topup_total
+
+
+async def add_referral_earned(session: AsyncSession, referrer_id: int, bonus: Decimal) -> None:
+    """Учитывает реферальный бонус в статистике пригласившего (сам бонус зачисляется через журнал)."""
+    await session.execute(
+        update(User).where(User.id == referrer_id).values(referral_earned=User.referral_earned + bonus))
+
+
+async def list_referral_aggregates(
+    session: AsyncSession, after_id: int, limit: int
+) -> List[Tuple[int, int, Decimal, int, Decimal]]:
+    """
+    Пачка пользователей по возрастанию id для сверки: сохраненные агрегаты и они же, посчитанные
+    заново (COUNT рефералов и SUM их оплаченных пополнений, по индексам ix_users_referrer и ix_top_ups_user).
+    Оба значения читаются одним запросом - из одного снимка данных, поэтому их разница не зависит
+    от пополнений, зафиксированных параллельно.
+    :return: (id, referral_count, referral_topup_total, пересчитанное число, пересчитанная сумма).
+    """
+    referral = aliased(User)
+    actual_count = (
+        select(func.count()).select_from(referral)
+        .where(referral.referrer_id == User.id)
+        .correlate(User)
+        .scalar_subquery()
+    )
+    actual_total = (
+        select(func.coalesce(func.sum(TopUp.amount), 0))
+        .join(referral, referral.id == TopUp.user_id)
+        .where(referral.referrer_id == User.id, TopUp.status == "paid")
+        .correlate(User)
+        .scalar_subquery()
+    )
+    stmt = (
+        select(User.id, User.referral_count, User.referral_topup_total, actual_count, actual_total)
+        .where(User.id > after_id)
+        .order_by(User.id)
+        .limit(limit)
+    )
+    return [(user_id, count, total, actual, Decimal(actual_sum or 0))
+            for user_id, count, total, actual, actual_sum in (await session.execute(stmt)).all()]
+
+
+async def adjust_referral_aggregates(session: AsyncSession, rows: Sequence[Dict[str, Any]]) -> None:
+    """
+    Исправляет агрегаты на разницу (col = col + delta) одним executemany по первичному ключу.
+    Пополнения, зафиксированные между чтением и записью, не теряются: их инкременты остаются в значении.
+    :param rows: Словари с ключами user_id, count_delta, total_delta.
+    """
+    if rows:
+        users = User.__table__
+        stmt = (
+            update(users)
+            .where(users.c.id == bindparam("user_id"))
+            .values(referral_count=users.c.referral_count + bindparam("count_delta"),
+                    referral_topup_total=users.c.referral_topup_total + bindparam("total_delta"))
+        )
+        await session.execute(stmt, list(rows))
+
+
+# --- Товары ---
+
+async def get_products_with_details(session: AsyncSession, product_ids: Sequence[int]) -> List[Product]:
+    """
+    Загружает товары с вариантами, продавцом и категорией.
+    :param product_ids: Id товаров.
+    :return: Товары в порядке product_ids (отсутствующие пропускаются). Ровно 4 запроса при любом числе id.
+    """
+    if not product_ids:
+        return []
+    stmt = select(Product).where(Product.id.in_(product_ids)).options(*PRODUCT_DETAILS)
+    by_id = {product.id: product for product in (await session.scalars(stmt)).all()}
+    return [by_id[product_id] for product_id in product_ids if product_id in by_id]
+
+
+async def list_catalog_page(
+    session: AsyncSession,
+    limit: int,
+    after_id: Optional[int] = None,
+    category_id: Optional[int] = None,
+    marketplace: bool = False
+) -> Tuple[List[Product], bool]:
+    """
+    Страница каталога (товары площадки) или маркетплейса (лоты пользователей), по возрастанию id.
+    :param limit: Размер страницы.
+    :param after_id: Id последнего товара предыдущей страницы; None - первая страница.
+    :param category_id: Фильтр по категории.
+    :param marketplace: True - лоты пользователей, False - товары площадки.
+    :return: (товары с вариантами, есть ли следующая страница).
+    """
+    stmt = (
+        select(Product)
+        .where(Product.is_active.is_(True))
+        .where(Product.seller_id.is_not(None) if marketplace else Product.seller_id.is_(None))
+        .options(selectinload(Product.variants))
+        .order_by(Product.id)
+    )
+    if category_id is not None:
+        stmt = stmt.where(Product.category_id == category_id)
+    if after_id is not None:
+        stmt = stmt.where(Product.id > after_id)
+    return await _fetch_keyset_page(session, stmt, limit)
+
+
+async def set_product_active(session: AsyncSession, product_id: int, active: bool) -> bool:
+    """Публикует или снимает товар (лот) одним UPDATE. :return: True, если товар найден."""
+    result = await session.execute(update(Product).where(Product.id == product_id).values(is_active=active))
+    return result.rowcount > 0
+
+
+async def list_search_documents(
+    session: AsyncSession, after_id: int, limit: int
+) -> List[Tuple[int, str, str, str, int, Optional[int]]]:
+    """
+    Пачка активных товаров для поискового индекса по возрастанию id, одним запросом с join категорий.
+    :return: Кортежи (id, title, description, название категории, category_id, seller_id).
+    """
+    stmt = (
+        select(Product.id, Product.title, Product.description, Category.name, Product.category_id, Product.seller_id)
+        .join(Category, Category.id == Product.category_id)
+        .where(Product.is_active.is_(True), Product.id > after_id)
+        .order_by(Product.id)
+        .limit(limit)
+    )
+    return [tuple(row) for row in (await session.execute(stmt)).all()]
+
+
+async def list_user_lots(
+    session: AsyncSession, seller_id: int, limit: int, before_id: Optional[int] = None
+) -> Tuple[List[Product], bool]:
+    """Лоты пользователя на маркетплейсе, новые сверху. 2 запроса на страницу."""
+    stmt = (
+        select(Product)
+        .where(Product.seller_id == seller_id)
+        .options(selectinload(Product.variants))
+        .order_by(Product.id.desc())
+    )
+    if before_id is not None:
+        stmt = stmt.where(Product.id < before_id)
+    return await _fetch_keyset_page(session, stmt, limit)
+
+
+# --- Истории профиля ---
+
+async def list_purchase_history(
+    session: AsyncSession, user_id: int, limit: int, before_id: Optional[int] = None
+) -> Tuple[List[Purchase], bool]:
+    """История покупок пользователя, новые сверху. 3 запроса на страницу (покупки, товары, варианты)."""
+    stmt = (
+        select(Purchase)
+        .where(Purchase.user_id == user_id)
+        .options(selectinload(Purchase.product), selectinload(Purchase.variant))
+        .order_by(Purchase.id.desc())
+    )
+    if before_id is not None:
+        stmt = stmt.where(Purchase.id < before_id)
+    return await _fetch_keyset_page(session, stmt, limit)
+
+
+async def list_sale_history(
+    session: AsyncSession, seller_id: int, limit: int, before_id: Optional[int] = None
+) -> Tuple[List[Purchase], bool]:
+    """История продаж лотов пользователя, новые сверху. 3 запроса на страницу."""
+    stmt = (
+        select(Purchase)
+        .where(Purchase.seller_id == seller_id)
+        .options(selectinload(Purchase.product), selectinload(Purchase.variant))
+        .order_by(Purchase.id.desc())
+    )
+    if before_id is not None:
+        stmt = stmt.where(Purchase.id < before_id)
+    return await _fetch_keyset_page(session, stmt, limit)
+
+
+async def list_topup_history(
+    session: AsyncSession, user_id: int, limit: int, before_id: Optional[int] = None
+) -> Tuple[List[TopUp], bool]:
+    """История пополнений пользователя, новые сверху. 1 запрос на страницу."""
+    stmt = select(TopUp).where(TopUp.user_id == user_id).order_by(TopUp.id.desc())
+    if before_id is not None:
+        stmt = stmt.where(TopUp.id < before_id)
+    return await _fetch_keyset_page(session, stmt, limit)
+
+
+# --- Пакетная запись ---
+
+async def bulk_insert_purchases(session: AsyncSession, rows: Sequence[Dict[str, Any]]) -> None:
+    """
+    Вставляет пачку покупок одним executemany.
+    :param rows: Словари с ключами user_id, product_id, variant_id, seller_id, price.
+    """
+    if rows:
+        await session.execute(insert(Purchase), list(rows))
+
+
+async def bulk_upsert_topups(session: AsyncSession, rows: Sequence[Dict[str, Any]]) -> None:
+    """
+    Вставляет или обновляет пачку пополнений одним запросом.
+    Ключ - (provider, external_id); у существующих записей обновляются amount и status.
+    :param rows: Словари с ключами user_id, provider, external_id, amount, status.
+    """
+    if not rows:
+        return
+    await session.execute(_upsert(
+        session, TopUp, list(rows), [TopUp.provider, TopUp.external_id],
+        lambda new: {"amount": new.amount, "status": new.status}))
+
+
+# --- Баланс и журнал ---
+# Баланс меняется только короткими условными UPDATE в паре с записью в ledger в той же транзакции;
+# чтение-изменение-запись users.balance не используется.
+
+async def insert_ledger_entries(session: AsyncSession, rows: Sequence[Dict[str, Any]]) -> List[int]:
+    """
+    Дописывает записи операции в журнал, пропуская уже существующие (idempotency_key, user_id).
+    Записи вставляются по одной: так известен id каждой вставленной, и отмена операции
+    убирает только их, не трогая записи с тем же ключом из других транзакций.
+    :param rows: Словари с ключами user_id, amount, kind, idempotency_key, counterparty_id.
+    :return: Id вставленных записей (пусто - операция с этим ключом уже была).
+    """
+    inserted: List[int] = []
+    for row in rows:
+        result = await session.execute(
+            _insert_ignore(session, LedgerEntry, row, [LedgerEntry.idempotency_key, LedgerEntry.user_id]))
+        if result.rowcount > 0:
+            inserted.append(result.inserted_primary_key[0])
+    return inserted
+
+
+async def delete_ledger_entries(session: AsyncSession, entry_ids: Sequence[int]) -> None:
+    """Убирает записи по id - только вставленные в текущей транзакции, если операцию пришлось отменить."""
+    if entry_ids:
+        await session.execute(delete(LedgerEntry).where(LedgerEntry.id.in_(list(entry_ids))))
+
+
+async def debit_balance(session: AsyncSession, user_id: int, amount: Decimal) -> bool:
+    """
+    Списывает amount одним условным UPDATE (balance = balance - x WHERE balance >= x).
+    :return: False, если средств недостаточно или пользователь не найден.
+    """
+    result = await session.execute(
+        update(User)
+        .where(User.id == user_id, User.balance >= amount)
+        .values(balance=User.balance - amount)
+    )
+    return result.rowcount > 0
+
+
+async def credit_balance(session: AsyncSession, user_id: int, amount: Decimal) -> bool:
+    """Зачисляет amount одним UPDATE. :return: True, если пользователь найден."""
+    result = await session.execute(
+        update(User).where(User.id == user_id).values(balance=User.balance + amount))
+    return result.rowcount > 0
+
+
+async def get_balance(session: AsyncSession, user_id: int) -> Optional[Decimal]:
+    return await session.scalar(select(User.balance).where(User.id == user_id))
+
+
+async def get_snapshot_watermark(session: AsyncSession) -> int:
+    """Id последней записи журнала, свернутой в balance_snapshots (0 - сверток не было)."""
+    return await session.scalar(select(func.coalesce(func.max(BalanceSnapshot.entry_id), 0)))
+
+
+async def get_db_now(session: AsyncSession) -> datetime:
+    """Текущее время по часам БД - в той же зоне, что и server_default=func.now() у created_at."""
+    return await session.scalar(select(func.now()))
+
+
+async def get_last_ledger_id(session: AsyncSession, created_before: datetime) -> int:
+    """Id последней записи журнала, созданной не позже created_before (0 - таких нет)."""
+    return await session.scalar(
+        select(func.coalesce(func.max(LedgerEntry.id), 0)).where(LedgerEntry.created_at <= created_before))
+
+
+async def sum_ledger_range(session: AsyncSession, after_id: int, up_to_id: int) -> List[Tuple[int, Decimal]]:
+    """Суммы записей журнала с after_id < id <= up_to_id по пользователям - один GROUP BY."""
+    stmt = (
+        select(LedgerEntry.user_id, func.sum(LedgerEntry.amount))
+        .where(LedgerEntry.id > after_id, LedgerEntry.id <= up_to_id)
+        .group_by(LedgerEntry.user_id)
+    )
+    return [tuple(row) for row in (await session.execute(stmt)).all()]
+
+
+async def add_to_balance_snapshots(session: AsyncSession, rows: Sequence[Dict[str, Any]]) -> None:
+    """
+    Прибавляет суммы к снимкам балансов одним запросом (INSERT ... ON CONFLICT/DUPLICATE KEY UPDATE).
+    :param rows: Словари с ключами user_id, balance (прибавка), entry_id (новая отметка свертки).
+    """
+    if not rows:
+        return
+    await session.execute(_upsert(
+        session, BalanceSnapshot, list(rows), [BalanceSnapshot.user_id],
+        lambda new: {"balance": BalanceSnapshot.balance + new.balance, "entry_id": new.entry_id}))
+
+
+async def list_ledger_balances(
+    session: AsyncSession, after_id: int, limit: int
+) -> List[Tuple[int, Decimal, Decimal]]:
+    """
+    Пачка (id, users.balance, баланс по журналу) по возрастанию id - для сверки.
+    Баланс по журналу - снимок плюс записи после него (по индексу ix_ledger_user).
+    """
+    tail = (
+        select(func.coalesce(func.sum(LedgerEntry.amount), 0))
+        .where(LedgerEntry.user_id == User.id,
+               LedgerEntry.id > func.coalesce(BalanceSnapshot.entry_id, 0))
+        .correlate(User, BalanceSnapshot)
+        .scalar_subquery()
+    )
+    stmt = (
+        select(User.id, User.balance, func.coalesce(BalanceSnapshot.balance, 0) + tail)
+        .outerjoin(BalanceSnapshot, BalanceSnapshot.user_id == User.id)
+        .where(User.id > after_id)
+        .order_by(User.id)
+        .limit(limit)
+    )
+    return [(user_id, balance, Decimal(ledger or 0)) for user_id, balance, ledger in (await session.execute(stmt)).all()]
+
+
+# --- Платежи ---
+
+async def insert_topup(
+    session: AsyncSession, user_id: int, provider: str, external_id: str, amount: Decimal
+) -> bool:
+    """
+    Регистрирует ожидающее пополнение (счет провайдера); повтор с тем же (provider, external_id) ничего не меняет.
+    :return: True, если запись создана.
+    """
+    values = {"user_id": user_id, "provider": provider, "external_id": external_id, "amount": amount,
+              "status": "pending"}
+    result = await session.execute(_insert_ignore(session, TopUp, values, [TopUp.provider, TopUp.external_id]))
+    return result.rowcount > 0
+
+
+async def list_pending_topups(session: AsyncSession, provider: str, after_id: int, limit: int) -> List[Tuple[int, str]]:
+    """Пачка (id, external_id) ожидающих оплаты пополнений провайдера по возрастанию id - для сверки."""
+    stmt = (
+        select(TopUp.id, TopUp.external_id)
+        .where(TopUp.provider == provider, TopUp.status == "pending", TopUp.id > after_id)
+        .order_by(TopUp.id)
+        .limit(limit)
+    )
+    return [tuple(row) for row in (await session.execute(stmt)).all()]
+
+
+async def get_pending_topups(
+    session: AsyncSession, provider: str, external_ids: Sequence[str]
+) -> List[Tuple[int, str, int, Decimal, Optional[int], bool]]:
+    """
+    Ожидающие пополнения по id счетов провайдера вместе с пригласившим пополняющего - один запрос на пачку.
+    Пополнение без строки пользователя тоже возвращается (has_user False), а не пропускается молча.
+    :return: (id, external_id, user_id, amount, referrer_id, has_user).
+    """
+    if not external_ids:
+        return []
+    stmt = (
+        select(TopUp.id, TopUp.external_id, TopUp.user_id, TopUp.amount, User.referrer_id, User.id.is_not(None))
+        .outerjoin(User, User.id == TopUp.user_id)
+        .where(TopUp.provider == provider, TopUp.external_id.in_(external_ids), TopUp.status == "pending")
+    )
+    return [tuple(row) for row in (await session.execute(stmt)).all()]
+
+
+async def set_topup_status(session: AsyncSession, topup_id: int, status: str) -> bool:
+    """
+    Переводит ожидающее пополнение в status (paid/expired) условным UPDATE.
+    :return: False, если пополнение уже не ожидает оплаты (обработано раньше).
+    """
+    result = await session.execute(
+        update(TopUp).where(TopUp.id == topup_id, TopUp.status == "pending").values(status=status))
+    return result.rowcount > 0
+
+
+# --- Промокоды ---
+
+async def create_promo_code(
+    session: AsyncSession,
+    code: str,
+    kind: str,
+    value: Decimal = Decimal("0"),
+    max_uses: Optional[int] = None,
+    expires_at: Optional[datetime] = None,
+    product_id: Optional[int] = None,
+    variant_id: Optional[int] = None,
+    target_product_ids: Sequence[int] = (),
+    target_category_ids: Sequence[int] = (),
+    shards: int = 16
+) -> PromoCode:
+    """
+    Создает промокод вместе с целями скидки и шардами счетчика активаций.
+    :param shards: На сколько строк разбить лимит max_uses (не больше самого лимита).
+    """
+    promo = PromoCode(code=code, kind=kind, value=value, max_uses=max_uses, expires_at=expires_at,
+                      product_id=product_id, variant_id=variant_id, is_active=True)
+    session.add(promo)
+    await session.flush()
+    targets = ([{"promo_id": promo.id, "product_id": target_id, "category_id": None} for target_id in target_product_ids]
+               + [{"promo_id": promo.id, "product_id": None, "category_id": target_id} for target_id in target_category_ids])
+    if targets:
+        await session.execute(insert(PromoTarget), targets)
+    if max_uses is not None:
+        shards = max(1, min(shards, max_uses))
+        base, extra = divmod(max_uses, shards)
+        await session.execute(insert(PromoCounter), [
+            {"promo_id": promo.id, "shard": shard, "used": 0, "cap": base + (1 if shard < extra else 0)}
+            for shard in range(shards)])
+    return promo
+
+
+async def set_promo_active(session: AsyncSession, promo_id: int, active: bool) -> bool:
+    result = await session.execute(update(PromoCode).where(PromoCode.id == promo_id).values(is_active=active))
+    return result.rowcount > 0
+
+
+async def list_active_promo_codes(
+    session: AsyncSession
+) -> Tuple[List[PromoCode], List[Tuple[int, Optional[int], Optional[int]]], List[Tuple[int, int, int, int]]]:
+    """
+    Все активные промокоды для индекса в памяти - три запроса на любое их число.
+    :return: (промокоды, цели (promo_id, product_id, category_id), шарды (promo_id, shard, used, cap)).
+    """
+    promos = list((await session.scalars(select(PromoCode).where(PromoCode.is_active.is_(True)))).all())
+    active = select(PromoCode.id).where(PromoCode.is_active.is_(True))
+    targets = await session.execute(
+        select(PromoTarget.promo_id, PromoTarget.product_id, PromoTarget.category_id)
+        .where(PromoTarget.promo_id.in_(active)))
+    counters = await session.execute(
+        select(PromoCounter.promo_id, PromoCounter.shard, PromoCounter.used, PromoCounter.cap)
+        .where(PromoCounter.promo_id.in_(active)))
+    return promos, [tuple(row) for row in targets.all()], [tuple(row) for row in counters.all()]
+
+
+async def insert_promo_redemption(session: AsyncSession, promo_id: int, user_id: int) -> bool:
+    """
+    Записывает активацию промокода пользователем, если ее еще не было.
+    :return: False - пользователь уже активировал этот промокод.
+    """
+    result = await session.execute(_insert_ignore(
+        session, PromoRedemption, {"promo_id": promo_id, "user_id": user_id},
+        [PromoRedemption.promo_id, PromoRedemption.user_id]))
+    return result.rowcount > 0
+
+
+async def delete_promo_redemption(session: AsyncSession, promo_id: int, user_id: int) -> None:
+    await session.execute(
+        delete(PromoRedemption).where(PromoRedemption.promo_id == promo_id, PromoRedemption.user_id == user_id))
+
+
+async def increment_promo_counter(session: AsyncSession, promo_id: int, shard: int) -> bool:
+    """
+    Занимает одну активацию в шарде условным UPDATE (used = used + 1 WHERE used < cap).
+    :return: False, если шард исчерпан.
+    """
+    result = await session.execute(
+        update(PromoCounter)
+        .where(PromoCounter.promo_id == promo_id, PromoCounter.shard == shard, PromoCounter.used < PromoCounter.cap)
+        .values(used=PromoCounter.used + 1)
+    )
+    return result.rowcount > 0
+
+
+async def get_promo_usage(session: AsyncSession, promo_id: int) -> Tuple[int, int]:
+    """(использовано, лимит) по всем шардам промокода."""
+    row = (await session.execute(
+        select(func.coalesce(func.sum(PromoCounter.used), 0), func.coalesce(func.sum(PromoCounter.cap), 0))
+        .where(PromoCounter.promo_id == promo_id))).one()
+    return int(row[0]), int(row[1])
+
+
+# --- Рассылки ---
+
+async def create_broadcast(session: AsyncSession, created_by: int, text: str) -> Broadcast:
+    """Создает рассылку в статусе running."""
+    broadcast = Broadcast(
+        created_by=created_by, text=text, status="running", last_user_id=0, done_ahead="", sent=0, failed=0)
+    session.add(broadcast)
+    await session.flush()
+    return broadcast
+
+
+async def get_broadcast(session: AsyncSession, broadcast_id: int) -> Optional[Broadcast]:
+    return await session.get(Broadcast, broadcast_id, populate_existing=True)
+
+
+async def list_unfinished_broadcasts(session: AsyncSession) -> List[Broadcast]:
+    """Рассылки, прерванные перезапуском бота."""
+    stmt = select(Broadcast).where(Broadcast.status == "running").order_by(Broadcast.id)
+    return list((await session.scalars(stmt)).all())
+
+
+async def save_broadcast_progress(
+    session: AsyncSession,
+    broadcast_id: int,
+    last_user_id: int,
+    done_ahead: Sequence[int],
+    sent: int,
+    failed: int,
+    status: str = "running"
+) -> None:
+    """Сохраняет контрольную точку рассылки одним UPDATE."""
+    values: Dict[str, Any] = {
+        "last_user_id": last_user_id,
+        "done_ahead": ",".join(map(str, done_ahead)),
+        "sent": sent,
+        "failed": failed,
+        "status": status,
+    }
+    if status != "running":
+        values["finished_at"] = func.now()
+    await session.execute(update(Broadcast).where(Broadcast.id == broadcast_id).values(**values))
+
+
+# --- FSM ---
+
+async def get_fsm_record(session: AsyncSession, key: str, now: datetime) -> Optional[Tuple[Optional[str], str]]:
+    """(state, data JSON) по ключу FSM или None, если записи нет или она истекла."""
+    stmt = select(FSMRecord.state, FSMRecord.data).where(
+        FSMRecord.key == key, or_(FSMRecord.expires_at.is_(None), FSMRecord.expires_at > now))
+    row = (await session.execute(stmt)).first()
+    return (row.state, row.data) if row is not None else None
+
+
+async def upsert_fsm_record(
+    session: AsyncSession, key: str, state: Optional[str], data: str, expires_at: Optional[datetime]
+) -> None:
+    """Записывает состояние и данные FSM одним запросом (INSERT ... ON CONFLICT/DUPLICATE KEY UPDATE)."""
+    await session.execute(_upsert(
+        session, FSMRecord, {"key": key, "state": state, "data": data, "expires_at": expires_at}, [FSMRecord.key],
+        lambda new: {"state": new.state, "data": new.data, "expires_at": new.expires_at}))
+
+
+async def delete_fsm_record(session: AsyncSession, key: str) -> None:
+    await session.execute(delete(FSMRecord).where(FSMRecord.key == key))
+
+
+async def delete_expired_fsm_records(session: AsyncSession, now: datetime) -> int:
+    """Удаляет истекшие записи FSM. :return: Сколько удалено."""
+    result = await session.execute(delete(FSMRecord).where(FSMRecord.expires_at <= now))
+    return result.rowcount
@@ -0,0 +1,90 @@
+import html
+from typing import TYPE_CHECKING, Callable, Optional
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message
+
+from app.common.filters import IsAdmin
+from app.services.language_service import reload_translations_async
+
+if TYPE_CHECKING:
+    from app.database.database import SessionProvider
+    from app.services.broadcast_service import BroadcastEngine, BroadcastProgress
+
+
+admin_handler = Router(name="admin_handler")
+admin_handler.message.filter(IsAdmin())
+
+
+@admin_handler.message(Command("reload_locales"))
+async def handle_command_reload_locales(message: Message, _: Callable):
+    problems = await reload_translations_async(force=True)
+    if not problems:
+        await message.answer(_("admin.locales.reloaded"))
+        return
+    await message.answer(_("admin.locales.reloaded_with_problems",
+                           count=len(problems), problems=html.escape("\n".join(problems[:20]))))
+
+
+@admin_handler.message(Command("broadcast"))
+async def handle_command_broadcast(
+    message: Message,
+    command: CommandObject,
+    _: Callable,
+    db: Optional["SessionProvider"] = None,
+    broadcast_engine: Optional["BroadcastEngine"] = None
+):
+    # Без DATABASE_URL роутер подключен ради остальных команд, но db и движка рассылок нет.
+    if db is None or broadcast_engine is None:
+        await message.answer(_("admin.broadcast.unavailable"))
+        return
+
+    # Модули БД загружаются при первой рассылке, а не при старте бота.
+    from app.database import requests
+    from app.services.broadcast_service import start_broadcast_task
+
+    if not command.args:
+        await message.answer(_("admin.broadcast.usage"))
+        return
+
+    session = await db.get()
+    broadcast = await requests.create_broadcast(session, message.from_user.id, message.html_text.split(maxsplit=1)[1])
+    await session.commit()
+
+    status_message = await message.answer(_("admin.broadcast.started", broadcast_id=broadcast.id))
+
+    async def report_progress(progress: "BroadcastProgress") -> None:
+        key = "admin.broadcast.finished" if progress.finished else "admin.broadcast.progress"
+        await status_message.edit_text(_(
+            key,
+            broadcast_id=progress.broadcast_id,
+            sent=progress.sent,
+            failed=progress.failed,
+            rate=f"{progress.messages_per_second:.1f}"
+        ))
+
+    start_broadcast_task(broadcast_engine, broadcast.id, report_progress)
+
+
+@admin_handler.message(Command("remove_lot"))
+async def handle_command_remove_lot(
+    message: Message,
+    command: CommandObject,
+    _: Callable,
+    db: Optional["SessionProvider"] = None
+):
+    if db is None:
+        await message.answer(_("admin.lots.unavailable"))
+        return
+    if not command.args or not command.args.strip().isdigit():
+        await message.answer(_("admin.lots.usage"))
+        return
+
+    from app.services.search_service import remove_lot
+
+    product_id = int(command.args)
+    # remove_lot фиксирует транзакцию сам и убирает лот из поиска и клавиатур каталога.
+    if await remove_lot(await db.get(), product_id):
+        await message.answer(_("admin.lots.removed", product_id=product_id))
+    else:
+        await message.answer(_("admin.lots.not_found", product_id=product_id))
@@ -1,12 +1,42 @@
-from typing import Callable
+from typing import TYPE_CHECKING, Callable
 from aiogram import F, Router
 from aiogram.filters import Command, CommandStart
-from aiogram.types import Message
+from aiogram.types import Message, PreCheckoutQuery
 
+if TYPE_CHECKING:
+    from app.database.database import SessionProvider
+    from app.services.payment_service import PaymentService
 
-user_handler = Router()
+
+user_handler = Router(name="user_handler")
 
 
 @user_handler.message(CommandStart())
 async def handle_command_start(message: Message, _: Callable):
     await message.answer(_("welcome", name=message.from_user.username))
+
+
+@user_handler.pre_checkout_query()
+async def handle_pre_checkout(query: PreCheckoutQuery, _: Callable):
+    # Платежный модуль импортируется при первом счете, а не при старте; payment_service в данных
+    # диспетчера может не быть (без DATABASE_URL), поэтому нужен только статический метод класса.
+    from app.services.payment_service import PaymentService
+
+    # Сумма пополнения зашита в payload счета, проверять перед списанием Stars больше нечего.
+    if PaymentService.is_stars_topup(query.invoice_payload):
+        await query.answer(ok=True)
+    else:
+        await query.answer(ok=False, error_message=_("errors.general"))
+
+
+@user_handler.message(F.successful_payment)
+async def handle_successful_payment(
+    message: Message,
+    _: Callable,
+    db: "SessionProvider",
+    payment_service: "PaymentService"
+):
+    session = await db.get()
+    amount = await payment_service.credit_stars_payment(session, message.from_user.id, message.successful_payment)
+    if amount is not None:
+        await message.answer(_("payments.credited", amount=amount))
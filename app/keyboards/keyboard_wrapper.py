@@ -1,7 +1,15 @@
+import inspect
+import logging
 import math
+from collections import OrderedDict
 from aiogram.filters.callback_data import CallbackData
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from typing import Callable, List, Tuple, Optional, Dict, Any, Union
+from typing import Awaitable, Callable, Hashable, List, Tuple, Optional, Dict, Any, Union
+
+from app.services.language_service import add_reload_listener
+
+
+printx = logging.getLogger(__name__)
 
 class PageCallbackData(CallbackData, prefix="page_nav"):
     action: str
@@ -24,7 +32,122 @@ class ButtonData:
             params["url"] = self.url
         params.update(self.kwargs)
         return InlineKeyboardButton(**params)
-    
+
+
+class PageWindow:
+    """
+    Окно одной страницы, которое возвращает источник страниц для KeyboardBuilder.build_paginated.
+    Нужно указать либо total (общее число элементов), либо has_next (для keyset-пагинации).
+    """
+
+    def __init__(
+        self,
+        items: List[Union[ButtonData, Dict[str, Any]]],
+        total: Optional[int] = None,
+        has_next: Optional[bool] = None
+    ):
+        self.items = items
+        self.total = total
+        self.has_next = has_next
+
+
+PageSource = Callable[[int, int], Union[PageWindow, Awaitable[PageWindow]]]
+
+
+FrozenRows = Tuple[Tuple[InlineKeyboardButton, ...], ...]
+
+
+class KeyboardCache:
+    """
+    LRU-кэш готовых InlineKeyboardMarkup.
+    Ключ начинается с (язык, меню), остальное - параметры сборки и номер страницы.
+    Хранятся замороженные строки кнопок (кортежи); get каждый раз отдает новую клавиатуру
+    с копиями кнопок, поэтому ее изменение вызывающим не портит кэш для остальных.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[Tuple[Hashable, ...], FrozenRows]" = OrderedDict()
+
+    def get(self, key: Tuple[Hashable, ...]) -> Optional[InlineKeyboardMarkup]:
+        items = self._items
+        rows = items.get(key)
+        if rows is None:
+            self.misses += 1
+            return None
+        items.move_to_end(key)
+        self.hits += 1
+        # model_construct без повторной валидации: кнопки уже проверены при сборке.
+        return InlineKeyboardMarkup.model_construct(
+            inline_keyboard=[[button.model_copy() for button in row] for row in rows])
+
+    def put(self, key: Tuple[Hashable, ...], markup: InlineKeyboardMarkup) -> None:
+        items = self._items
+        items[key] = tuple(tuple(button.model_copy() for button in row) for row in markup.inline_keyboard)
+        items.move_to_end(key)
+        while len(items) > self.max_size:
+            items.popitem(last=False)
+
+    def invalidate(self, menu: Optional[Hashable] = None, lang: Optional[str] = None) -> int:
+        """
+        Удаляет клавиатуры меню и/или языка (например, после изменения товаров).
+        :param menu: Имя меню из cache_key. None - любое меню.
+        :param lang: Код языка из cache_key. None - любой язык.
+        :return: Количество удаленных клавиатур.
+        """
+        if menu is None and lang is None:
+            return self.clear()
+        stale = [key for key in list(self._items)
+                 if (lang is None or key[0] == lang) and (menu is None or key[1] == menu)]
+        for key in stale:
+            self._items.pop(key, None)
+        return len(stale)
+
+    def clear(self) -> int:
+        # Подменяем словарь целиком: clear может прийти из потока перезагрузки переводов.
+        removed = len(self._items)
+        self._items = OrderedDict()
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+    def render_prometheus(self, prefix: str) -> List[str]:
+        """Строки Prometheus для UpdateMetrics.add_collector."""
+        return [
+            f"# HELP {prefix}_keyboard_cache_size Keyboards held in the cache.",
+            f"# TYPE {prefix}_keyboard_cache_size gauge",
+            f"{prefix}_keyboard_cache_size {len(self._items)}",
+            f"# HELP {prefix}_keyboard_cache_hits_total Keyboards served from the cache.",
+            f"# TYPE {prefix}_keyboard_cache_hits_total counter",
+            f"{prefix}_keyboard_cache_hits_total {self.hits}",
+            f"# HELP {prefix}_keyboard_cache_misses_total Keyboards built because they were not cached.",
+            f"# TYPE {prefix}_keyboard_cache_misses_total counter",
+            f"{prefix}_keyboard_cache_misses_total {self.misses}",
+        ]
+
+    def log_summary(self) -> None:
+        stats = self.stats()
+        printx.info(
+            f"Кэш клавиатур: размер {stats['size']}, попаданий {stats['hits']}, "
+            f"промахов {stats['misses']}, hit ratio {stats['hit_ratio']:.1%}")
+
+
+# Меню каталога в cache_key: сбрасывается при изменении товаров (search_service.index_product/remove_lot).
+CATALOG_MENU = "catalog"
+
+keyboard_cache = KeyboardCache()
+add_reload_listener(keyboard_cache.clear)
+
+
 class KeyboardBuilder:
     def __init__(self, _: Callable):
         self._buttons: List[ButtonData] = []
@@ -57,7 +180,8 @@ class KeyboardBuilder:
         current_page_for_controls: int, 
         total_pages_for_controls: int, 
         page_callback_factory: Any,
-        action_name_for_factory: str
+        action_name_for_factory: str,
+        total_known: bool = True
     ) -> List[InlineKeyboardButton]:
         pagination_row: List[InlineKeyboardButton] = []
         if current_page_for_controls > 1:
@@ -73,10 +197,12 @@ class KeyboardBuilder:
         except TypeError:
             pass
 
-        pagination_row.append(InlineKeyboardButton(
-            text=self._("buttons.pagination.current_page", current_page=current_page_for_controls, total_pages=total_pages_for_controls),
-            callback_data=ignore_cb_data
-        ))
+        if total_known:
+            page_label = self._("buttons.pagination.current_page", current_page=current_page_for_controls, total_pages=total_pages_for_controls)
+        else:
+            # Keyset-пагинация: известно только, есть ли следующая страница, общее число не показываем.
+            page_label = self._("buttons.pagination.current_page_open", current_page=current_page_for_controls)
+        pagination_row.append(InlineKeyboardButton(text=page_label, callback_data=ignore_cb_data))
 
         if current_page_for_controls < total_pages_for_controls:
             next_page_cb_data = page_callback_factory(
@@ -92,7 +218,8 @@ class KeyboardBuilder:
         default_row_width: int = 1,
         items_per_page: Optional[int] = None,
         current_page: int = 1,
-        page_callback_data_provider: Optional[Dict[str, Any]] = None
+        page_callback_data_provider: Optional[Dict[str, Any]] = None,
+        cache_key: Optional[Tuple[str, Hashable]] = None
     ) -> InlineKeyboardMarkup:
         """
         Собирает и возвращает InlineKeyboardMarkup.
@@ -104,10 +231,19 @@ class KeyboardBuilder:
         :param current_page: Номер текущей отображаемой страницы контента (начинается с 1).
         :param page_callback_data_provider: Словарь с { "factory": PageCallbackData, "action": "имя_действия" }.
                                             Если указан и страниц больше одной, пагинация будет добавлена.
+        :param cache_key: Кортеж (язык, меню). Если указан, клавиатура берется из keyboard_cache
+                          или кладется туда после сборки. Содержимое меню должно зависеть только
+                          от этого ключа; при изменении товаров вызывайте keyboard_cache.invalidate.
         :return: Готовая инлайн-клавиатура.
         """
-        markup_rows: List[List[InlineKeyboardButton]] = []
-        
+        full_cache_key = self._make_cache_key(
+            cache_key, layout, default_row_width, items_per_page, current_page, page_callback_data_provider)
+        if full_cache_key is not None:
+            cached_markup = keyboard_cache.get(full_cache_key)
+            if cached_markup is not None:
+                self._buttons = []
+                return cached_markup
+
         buttons_to_display_data: List[ButtonData]
         actual_total_pages_for_controls = 1
         actual_current_page_for_controls = 1
@@ -123,6 +259,116 @@ class KeyboardBuilder:
             buttons_to_display_data = list(self._buttons)
             page_callback_data_provider = None
 
+        return self._assemble_markup(
+            buttons_to_display_data,
+            layout,
+            default_row_width,
+            actual_current_page_for_controls,
+            actual_total_pages_for_controls,
+            page_callback_data_provider,
+            full_cache_key
+        )
+
+    async def build_paginated(
+        self,
+        page_source: PageSource,
+        items_per_page: int,
+        current_page: int = 1,
+        layout: Optional[Tuple[int, ...]] = None,
+        default_row_width: int = 1,
+        page_callback_data_provider: Optional[Dict[str, Any]] = None,
+        cache_key: Optional[Tuple[str, Hashable]] = None
+    ) -> InlineKeyboardMarkup:
+        """
+        Собирает страницу клавиатуры, запрашивая у источника только нужное окно элементов.
+        Стоимость сборки - O(items_per_page), а не O(размер каталога).
+
+        :param page_source: Функция (page, per_page) -> PageWindow, синхронная или асинхронная
+                            (например, запрос к БД с LIMIT/OFFSET или keyset-пагинацией).
+        :param items_per_page: Количество основных кнопок на странице.
+        :param current_page: Номер запрашиваемой страницы (начинается с 1).
+        :param layout: Кортеж для расположения кнопок страницы.
+        :param default_row_width: Ширина ряда по умолчанию.
+        :param page_callback_data_provider: Словарь с { "factory": PageCallbackData, "action": "имя_действия" }.
+        :param cache_key: Кортеж (язык, меню), см. build. При попадании источник не вызывается.
+        :return: Готовая инлайн-клавиатура.
+        """
+        if items_per_page <= 0:
+            raise ValueError("items_per_page должен быть больше нуля.")
+
+        full_cache_key = self._make_cache_key(
+            cache_key, layout, default_row_width, items_per_page, current_page, page_callback_data_provider)
+        if full_cache_key is not None:
+            cached_markup = keyboard_cache.get(full_cache_key)
+            if cached_markup is not None:
+                self._buttons = []
+                return cached_markup
+
+        page = max(1, current_page)
+        window = await self._fetch_window(page_source, page, items_per_page)
+        if not window.items and window.total and page > 1:
+            # Запрошенная страница за пределами каталога (например, товары удалили) - берем последнюю.
+            page = math.ceil(window.total / items_per_page)
+            window = await self._fetch_window(page_source, page, items_per_page)
+
+        total_known = window.total is not None
+        if total_known:
+            total_pages = max(1, math.ceil(window.total / items_per_page))
+        else:
+            # Для кнопки "вперед" достаточно знать, что страница не последняя.
+            total_pages = page + 1 if window.has_next else page
+
+        self._buttons = []
+        self.add_buttons(window.items)
+        return self._assemble_markup(
+            self._buttons,
+            layout,
+            default_row_width,
+            page,
+            total_pages,
+            page_callback_data_provider,
+            full_cache_key,
+            total_known
+        )
+
+    @staticmethod
+    async def _fetch_window(page_source: PageSource, page: int, per_page: int) -> "PageWindow":
+        window = page_source(page, per_page)
+        if inspect.isawaitable(window):
+            window = await window
+        if not isinstance(window, PageWindow):
+            raise TypeError("page_source должен возвращать PageWindow.")
+        return window
+
+    @staticmethod
+    def _make_cache_key(
+        cache_key: Optional[Tuple[str, Hashable]],
+        layout: Optional[Tuple[int, ...]],
+        default_row_width: int,
+        items_per_page: Optional[int],
+        current_page: int,
+        page_callback_data_provider: Optional[Dict[str, Any]]
+    ) -> Optional[Tuple[Hashable, ...]]:
+        if cache_key is None:
+            return None
+        provider = page_callback_data_provider or {}
+        return (
+            *cache_key, layout, default_row_width, items_per_page, current_page,
+            provider.get('factory'), provider.get('action'),
+        )
+
+    def _assemble_markup(
+        self,
+        buttons_to_display_data: List[ButtonData],
+        layout: Optional[Tuple[int, ...]],
+        default_row_width: int,
+        actual_current_page_for_controls: int,
+        actual_total_pages_for_controls: int,
+        page_callback_data_provider: Optional[Dict[str, Any]],
+        full_cache_key: Optional[Tuple[Hashable, ...]],
+        total_known: bool = True
+    ) -> InlineKeyboardMarkup:
+        markup_rows: List[List[InlineKeyboardButton]] = []
         aiogram_buttons_for_page = [btn_data.to_aiogram_button() for btn_data in buttons_to_display_data]
         
         current_button_idx_for_page = 0
@@ -152,10 +398,14 @@ class KeyboardBuilder:
                 actual_current_page_for_controls,
                 actual_total_pages_for_controls,
                 factory,
-                action_name
+                action_name,
+                total_known
             )
             if pagination_row_buttons:
                 markup_rows.append(pagination_row_buttons)
 
         self._buttons = [] 
-        return InlineKeyboardMarkup(inline_keyboard=markup_rows)
\ No newline at end of file
+        markup = InlineKeyboardMarkup(inline_keyboard=markup_rows)
+        if full_cache_key is not None:
+            keyboard_cache.put(full_cache_key, markup)
+        return markup
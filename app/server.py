@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import secrets
+from typing import TYPE_CHECKING, Any, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+from aiohttp import web
+
+from app import config
+from app.services.metrics_service import UpdateMetrics
+
+if TYPE_CHECKING:
+    from app.services.payment_service import PaymentService
+
+printx = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def make_metrics_handler(metrics: UpdateMetrics):
+    """Создает aiohttp-обработчик, отдающий метрики в текстовом формате Prometheus."""
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain")
+
+    return handle_metrics
+
+
+async def start_metrics_server(metrics: UpdateMetrics, host: str = "0.0.0.0", port: int = 9100) -> web.AppRunner:
+    """
+    Поднимает отдельный HTTP-сервер с GET /metrics (для режима polling, где вебхук-сервера нет).
+    :return: AppRunner; для остановки вызовите его cleanup().
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", make_metrics_handler(metrics))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    printx.info(f"Метрики Prometheus доступны на {host}:{port}/metrics")
+    return runner
+
+
+async def start_payment_server(
+    payments: "PaymentService", host: str = "0.0.0.0", port: int = 8081, path: str = "/cryptobot"
+) -> web.AppRunner:
+    """
+    Поднимает отдельный HTTP-сервер для вебхуков Crypto Pay (для режима polling).
+    :return: AppRunner; для остановки вызовите его cleanup().
+    """
+    app = web.Application()
+    app.router.add_post(path, payments.handle_webhook)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    printx.info(f"Вебхуки CryptoBot принимаются на {host}:{port}{path}")
+    return runner
+
+
+class WebhookServer:
+    """
+    HTTP-сервер для приема обновлений Telegram через вебхук.
+
+    Каждое обновление обрабатывается отдельной задачей, число одновременно
+    работающих задач ограничено семафором. Если лимит исчерпан, ответ Telegram
+    задерживается до освобождения слота - это естественный backpressure,
+    Telegram не шлет новые обновления, пока не получил ответ на предыдущие.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        path: str = "/webhook",
+        secret_token: Optional[str] = None,
+        max_concurrency: int = 100,
+        drain_timeout: float = 30.0,
+        metrics: Optional[UpdateMetrics] = None,
+        payments: Optional["PaymentService"] = None,
+        payments_path: str = "/cryptobot"
+    ):
+        """
+        :param dp: Диспетчер aiogram.
+        :param bot: Экземпляр бота, от имени которого обрабатываются обновления.
+        :param path: URL-путь вебхука.
+        :param secret_token: Секрет для заголовка X-Telegram-Bot-Api-Secret-Token. None - без проверки.
+        :param max_concurrency: Максимум одновременно обрабатываемых обновлений.
+        :param drain_timeout: Сколько секунд ждать завершения задач при остановке.
+        :param metrics: Метрики обновлений для GET /metrics (формат Prometheus); None - без эндпоинта.
+        :param payments: Платежный сервис для вебхуков Crypto Pay на payments_path; None - без эндпоинта.
+        :param payments_path: URL-путь вебхука Crypto Pay.
+        """
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.max_concurrency = max_concurrency
+        self.drain_timeout = drain_timeout
+        self.metrics = metrics
+        self.payments = payments
+        self.payments_path = payments_path
+
+        self.processed = 0
+        self.failed = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._draining = False
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/health", self.handle_health)
+        if self.metrics is not None:
+            app.router.add_get("/metrics", make_metrics_handler(self.metrics))
+        if self.payments is not None:
+            app.router.add_post(self.payments_path, self.payments.handle_webhook)
+        app["webhook_server"] = self
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self._draining:
+            return web.Response(status=503, text="shutting down")
+        if self.secret_token and not secrets.compare_digest(
+                request.headers.get(SECRET_HEADER, ""), self.secret_token):
+            return web.Response(status=401, text="unauthorized")
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            printx.warning(f"Получено некорректное обновление через вебхук: {e}")
+            return web.Response(status=400, text="bad update")
+
+        await self._semaphore.acquire()
+        if self._draining:
+            # Остановка началась, пока обновление ждало места: stop() его уже не дождется, Telegram доставит повторно.
+            self._semaphore.release()
+            return web.Response(status=503, text="shutting down")
+        task = asyncio.create_task(self._process_update(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response(text="ok")
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "draining" if self._draining else "ok",
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "processed": self.processed,
+            "failed": self.failed,
+        }, status=503 if self._draining else 200)
+
+    async def _process_update(self, update: Update) -> None:
+        try:
+            response: Any = await self.dp.feed_update(self.bot, update)
+            if isinstance(response, TelegramMethod):
+                await self.dp.silent_call_request(bot=self.bot, result=response)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            printx.exception(f"Ошибка обработки обновления {update.update_id}: {e}")
+        finally:
+            self._semaphore.release()
+
+    async def start(self, host: str = "0.0.0.0", port: int = 8080) -> None:
+        """Запускает HTTP-сервер и вызывает startup-хэндлеры диспетчера."""
+        await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp, **self.dp.workflow_data)
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        printx.info(f"Вебхук-сервер запущен на {host}:{port}{self.path} "
+                    f"(одновременно до {self.max_concurrency} обновлений).")
+
+    async def drain(self) -> None:
+        """Перестает принимать обновления и дожидается уже запущенных задач."""
+        self._draining = True
+        if not self._tasks:
+            return
+        printx.info(f"Ожидание завершения {len(self._tasks)} обновлений...")
+        _, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            printx.warning(f"Прервано {len(pending)} обновлений после {self.drain_timeout} с ожидания.")
+
+    async def stop(self) -> None:
+        """Корректно останавливает сервер: drain задач, остановка HTTP, shutdown-хэндлеры."""
+        await self.drain()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        await self.dp.emit_shutdown(bot=self.bot, dispatcher=self.dp, **self.dp.workflow_data)
+        printx.info("Вебхук-сервер остановлен.")
+
+
+async def run_webhook(
+    dp: Dispatcher, bot: Bot, metrics: Optional[UpdateMetrics] = None, payments: Optional["PaymentService"] = None
+) -> None:
+    """
+    Запускает бота в режиме вебхука по настройкам из config и работает до отмены.
+    Используется в main.run_telebot при config.BOT_MODE == "webhook".
+    """
+    base_url = getattr(config, "WEBHOOK_BASE_URL", None)
+    if not base_url:
+        raise RuntimeError("Для BOT_MODE = \"webhook\" нужен config.WEBHOOK_BASE_URL - публичный https-адрес бота")
+    server = WebhookServer(
+        dp,
+        bot,
+        path=getattr(config, "WEBHOOK_PATH", "/webhook"),
+        secret_token=getattr(config, "WEBHOOK_SECRET", None),
+        max_concurrency=getattr(config, "WEBHOOK_MAX_CONCURRENCY", 100),
+        drain_timeout=getattr(config, "WEBHOOK_DRAIN_TIMEOUT", 30.0),
+        metrics=metrics,
+        payments=payments,
+        payments_path=getattr(config, "CRYPTOBOT_WEBHOOK_PATH", "/cryptobot"),
+    )
+    await server.start(getattr(config, "WEBHOOK_HOST", "0.0.0.0"), getattr(config, "WEBHOOK_PORT", 8080))
+    await bot.set_webhook(
+        f"{base_url}{server.path}",
+        secret_token=server.secret_token,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        await bot.session.close()
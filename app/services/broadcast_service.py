@@ -0,0 +1,309 @@
+import asyncio
+import bisect
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable, Coroutine, Dict, Iterable, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramNotFound,
+    TelegramRetryAfter
+)
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.database import requests
+
+
+printx = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Ограничитель скорости "ведро токенов" для asyncio.
+    :param rate: Скорость пополнения, токенов в секунду.
+    :param capacity: Размер ведра (допустимый всплеск).
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Останавливает выдачу токенов на seconds секунд (например, после RetryAfter от Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        # Под замком ждет только тот, кто стоит первым в очереди; остальные выстраиваются за ним по порядку.
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    self._updated_at = time.monotonic()
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BroadcastProgress:
+    """Состояние рассылки для отчетов администратору."""
+
+    def __init__(self, broadcast_id: int, sent: int = 0, failed: int = 0, last_user_id: int = 0):
+        self.broadcast_id = broadcast_id
+        self.sent = sent
+        self.failed = failed
+        self.retries = 0
+        self.last_user_id = last_user_id
+        self.finished = False
+        self.started_at = time.monotonic()
+        self._sent_at_start = sent
+
+    @property
+    def messages_per_second(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return (self.sent - self._sent_at_start) / elapsed if elapsed > 0 else 0.0
+
+
+ProgressCallback = Callable[[BroadcastProgress], Awaitable[None]]
+
+
+class _Watermark:
+    """
+    Наибольший id, до которого включительно все получатели обработаны.
+    Воркеры завершают отправки не по порядку, поэтому храним кучу завершенных id.
+    :param start: Контрольная точка, с которой продолжается рассылка.
+    :param carried: Id выше контрольной точки, обработанные прошлыми запусками (done_ahead).
+    """
+
+    def __init__(self, start: int, carried: Iterable[int] = ()):
+        self.value = start
+        self._dispatched: List[int] = []
+        self._done: List[int] = []
+        self._carried = sorted(user_id for user_id in carried if user_id > start)
+
+    def dispatched(self, user_id: int) -> None:
+        heapq.heappush(self._dispatched, user_id)
+
+    def done(self, user_id: int) -> None:
+        heapq.heappush(self._done, user_id)
+        while self._done and self._dispatched and self._done[0] == self._dispatched[0]:
+            self.value = heapq.heappop(self._done)
+            heapq.heappop(self._dispatched)
+
+    def ahead(self) -> List[int]:
+        """
+        Id, обработанные после контрольной точки (их нельзя отправлять повторно).
+        Унаследованные от прошлых запусков хранятся, пока контрольная точка их не пройдет:
+        иначе при следующем прерывании они потеряются и получат сообщение еще раз.
+        """
+        carried = self._carried[bisect.bisect_right(self._carried, self.value):]
+        return sorted(self._done + carried)
+
+
+class BroadcastEngine:
+    """
+    Рассылка сообщения всем пользователям с учетом лимитов Telegram.
+
+    Получатели читаются из БД пачками (keyset по id) в ограниченную очередь, которую
+    разбирает пул воркеров. Общая скорость ограничивается TokenBucket (~30 сообщений/с
+    для бота), RetryAfter приостанавливает все ведро и повторяет отправку, а повтор в тот
+    же чат выполняется не чаще per_chat_interval. Прогресс периодически сохраняется в
+    broadcasts (last_user_id и done_ahead - обработанные не по порядку id после нее),
+    поэтому после перезапуска рассылка продолжается без повторной отправки.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        session_factory: async_sessionmaker,
+        rate: float = 25.0,
+        per_chat_interval: float = 1.0,
+        workers: int = 16,
+        batch_size: int = 500,
+        max_attempts: int = 5,
+        checkpoint_interval: float = 5.0,
+        progress_interval: float = 5.0,
+        spawn: Callable[[Coroutine], asyncio.Task] = asyncio.create_task
+    ):
+        """
+        :param bot: Бот для отправки.
+        :param session_factory: Фабрика сессий БД.
+        :param rate: Сообщений в секунду на всю рассылку (лимит Telegram - около 30).
+        :param per_chat_interval: Минимальный интервал между попытками в один чат, секунд.
+        :param workers: Количество одновременных отправок.
+        :param batch_size: Размер пачки получателей из БД.
+        :param max_attempts: Попыток отправки одному получателю.
+        :param checkpoint_interval: Как часто сохранять прогресс в БД, секунд.
+        :param progress_interval: Как часто вызывать on_progress, секунд.
+        :param spawn: Запуск фоновой задачи рассылки (в боте - BackgroundTasks.spawn: при остановке
+                      рассылки отменяются вместе с остальными задачами до закрытия пула БД).
+        """
+        self.bot = bot
+        self.session_factory = session_factory
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.checkpoint_interval = checkpoint_interval
+        self.progress_interval = progress_interval
+        self.spawn = spawn
+
+    async def run(self, broadcast_id: int, on_progress: Optional[ProgressCallback] = None) -> BroadcastProgress:
+        """
+        Выполняет (или продолжает после перезапуска) рассылку.
+        :param broadcast_id: Id записи в таблице broadcasts.
+        :param on_progress: Корутина, вызываемая периодически и в конце с текущим прогрессом.
+        :return: Итоговый прогресс.
+        """
+        async with self.session_factory() as session:
+            broadcast = await requests.get_broadcast(session, broadcast_id)
+        if broadcast is None:
+            raise ValueError(f"Рассылка {broadcast_id} не найдена")
+
+        progress = BroadcastProgress(broadcast.id, broadcast.sent, broadcast.failed, broadcast.last_user_id)
+        already_done = {int(user_id) for user_id in broadcast.done_ahead.split(",") if user_id}
+        watermark = _Watermark(broadcast.last_user_id, already_done)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        printx.info(f"Рассылка {broadcast_id}: старт после пользователя {broadcast.last_user_id}.")
+
+        async def produce() -> None:
+            after_id = broadcast.last_user_id
+            while True:
+                async with self.session_factory() as session:
+                    user_ids = await requests.list_recipient_ids(session, after_id, self.batch_size)
+                if not user_ids:
+                    break
+                for user_id in user_ids:
+                    if user_id in already_done:
+                        continue
+                    watermark.dispatched(user_id)
+                    await queue.put(user_id)
+                after_id = user_ids[-1]
+            for _ in range(self.workers):
+                await queue.put(None)
+
+        async def work() -> None:
+            while True:
+                user_id = await queue.get()
+                if user_id is None:
+                    return
+                if await self._send(user_id, broadcast.text, progress):
+                    progress.sent += 1
+                else:
+                    progress.failed += 1
+                watermark.done(user_id)
+                progress.last_user_id = watermark.value
+
+        async def report() -> None:
+            last_checkpoint = last_report = time.monotonic()
+            while True:
+                await asyncio.sleep(min(self.checkpoint_interval, self.progress_interval))
+                now = time.monotonic()
+                if now - last_checkpoint >= self.checkpoint_interval:
+                    await self._checkpoint(progress, watermark, "running")
+                    last_checkpoint = now
+                if on_progress is not None and now - last_report >= self.progress_interval:
+                    await self._notify(on_progress, progress)
+                    last_report = now
+
+        reporter = asyncio.create_task(report())
+        tasks = [asyncio.create_task(produce()), *(asyncio.create_task(work()) for _ in range(self.workers))]
+        try:
+            await asyncio.gather(*tasks)
+            progress.finished = True
+        finally:
+            # Без отмены оставшиеся воркеры продолжили бы слать в фоне уже после сохранения прогресса.
+            for task in (reporter, *tasks):
+                task.cancel()
+            await asyncio.gather(reporter, *tasks, return_exceptions=True)
+            # При отмене или ошибке остаемся в running, чтобы resume_broadcasts продолжил с контрольной точки.
+            await self._checkpoint(progress, watermark, "done" if progress.finished else "running")
+
+        printx.info(f"Рассылка {broadcast_id} завершена: отправлено {progress.sent}, ошибок {progress.failed}, "
+                    f"{progress.messages_per_second:.1f} сообщений/с.")
+        if on_progress is not None:
+            await self._notify(on_progress, progress)
+        return progress
+
+    async def _send(self, user_id: int, text: str, progress: BroadcastProgress) -> bool:
+        for attempt in range(1, self.max_attempts + 1):
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(user_id, text)
+                return True
+            except TelegramRetryAfter as e:
+                # Flood control действует на бота целиком - тормозим всех воркеров, а не только этого.
+                progress.retries += 1
+                self.bucket.pause(e.retry_after)
+                await asyncio.sleep(max(e.retry_after, self.per_chat_interval))
+            except (TelegramForbiddenError, TelegramBadRequest, TelegramNotFound):
+                # Бот заблокирован или чат не существует - повтор не поможет.
+                return False
+            except TelegramNetworkError as e:
+                progress.retries += 1
+                printx.warning(f"Сетевая ошибка рассылки пользователю {user_id} (попытка {attempt}): {e}")
+                await asyncio.sleep(max(self.per_chat_interval, 2 ** attempt * 0.5))
+            except TelegramAPIError as e:
+                # Ошибки сервера Telegram (5xx) и прочие ответы API - повторяем с той же задержкой.
+                progress.retries += 1
+                printx.warning(f"Ошибка Telegram при рассылке пользователю {user_id} (попытка {attempt}): {e}")
+                await asyncio.sleep(max(self.per_chat_interval, 2 ** attempt * 0.5))
+        return False
+
+    async def _checkpoint(self, progress: BroadcastProgress, watermark: _Watermark, status: str) -> None:
+        try:
+            async with self.session_factory() as session:
+                await requests.save_broadcast_progress(
+                    session, progress.broadcast_id, watermark.value, watermark.ahead(),
+                    progress.sent, progress.failed, status)
+                await session.commit()
+        except Exception as e:
+            printx.error(f"Не удалось сохранить прогресс рассылки {progress.broadcast_id}: {e}")
+
+    @staticmethod
+    async def _notify(on_progress: ProgressCallback, progress: BroadcastProgress) -> None:
+        try:
+            await on_progress(progress)
+        except Exception as e:
+            printx.warning(f"Ошибка отправки прогресса рассылки {progress.broadcast_id}: {e}")
+
+
+_running: Dict[int, asyncio.Task] = {}
+
+
+def start_broadcast_task(
+    engine: BroadcastEngine, broadcast_id: int, on_progress: Optional[ProgressCallback] = None
+) -> asyncio.Task:
+    """Запускает рассылку фоновой задачей; повторный запуск той же рассылки возвращает уже идущую задачу."""
+    task = _running.get(broadcast_id)
+    if task is None or task.done():
+        task = engine.spawn(engine.run(broadcast_id, on_progress))
+        _running[broadcast_id] = task
+        task.add_done_callback(lambda _: _running.pop(broadcast_id, None))
+    return task
+
+
+async def resume_broadcasts(broadcast_engine: BroadcastEngine) -> int:
+    """
+    Продолжает рассылки, прерванные перезапуском (статус running).
+    Регистрируется как startup-хэндлер диспетчера, broadcast_engine берется из workflow_data.
+    :return: Количество возобновленных рассылок.
+    """
+    async with broadcast_engine.session_factory() as session:
+        broadcasts = await requests.list_unfinished_broadcasts(session)
+    for broadcast in broadcasts:
+        start_broadcast_task(broadcast_engine, broadcast.id)
+    if broadcasts:
+        printx.info(f"Возобновлено рассылок: {len(broadcasts)}.")
+    return len(broadcasts)
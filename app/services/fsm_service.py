@@ -0,0 +1,262 @@
+import asyncio
+import contextvars
+import json
+import logging
+import math
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Mapping, Optional, Tuple
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from app import config
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+
+printx = logging.getLogger(__name__)
+
+FSMRecordValue = Tuple[Optional[str], Dict[str, Any]]
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class FSMBackend(ABC):
+    """Где хранятся состояния FSM. Одна запись на ключ: (state, data); каждый вызов - один round trip."""
+
+    @abstractmethod
+    async def read(self, key: str) -> Optional[FSMRecordValue]:
+        ...
+
+    @abstractmethod
+    async def write(self, key: str, state: Optional[str], data: Dict[str, Any], ttl: Optional[float]) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class SQLFSMBackend(FSMBackend):
+    """
+    Состояния FSM в таблице fsm_states (SQLite/MySQL) через общий пул сессий.
+    Истекшие записи не читаются; purge_expired удаляет их из таблицы.
+    """
+
+    def __init__(self, factory: Optional["async_sessionmaker"] = None):
+        """:param factory: Фабрика сессий; None - database.session_factory на момент обращения (после init_database)."""
+        # SQLAlchemy и модели загружаются, только если выбрано SQL-хранилище.
+        from app.database import database, requests
+
+        self._factory = factory
+        self._database = database
+        self._requests = requests
+
+    @property
+    def factory(self) -> "async_sessionmaker":
+        factory = self._factory or self._database.session_factory
+        if factory is None:
+            raise RuntimeError("SQLFSMBackend: база данных не инициализирована (init_database).")
+        return factory
+
+    async def read(self, key: str) -> Optional[FSMRecordValue]:
+        async with self.factory() as session:
+            record = await self._requests.get_fsm_record(session, key, _utcnow())
+        if record is None:
+            return None
+        state, data = record
+        return state, json.loads(data) if data else {}
+
+    async def write(self, key: str, state: Optional[str], data: Dict[str, Any], ttl: Optional[float]) -> None:
+        expires_at = _utcnow() + timedelta(seconds=ttl) if ttl else None
+        async with self.factory() as session:
+            await self._requests.upsert_fsm_record(session, key, state, json.dumps(data, ensure_ascii=False), expires_at)
+            await session.commit()
+
+    async def delete(self, key: str) -> None:
+        async with self.factory() as session:
+            await self._requests.delete_fsm_record(session, key)
+            await session.commit()
+
+    async def purge_expired(self) -> int:
+        async with self.factory() as session:
+            deleted = await self._requests.delete_expired_fsm_records(session, _utcnow())
+            await session.commit()
+        return deleted
+
+
+class RedisFSMBackend(FSMBackend):
+    """
+    Состояния FSM в Redis (или совместимом сервере): одна JSON-строка на ключ, TTL - средствами Redis.
+    :param redis: Клиент с методами get, set(name, value, px=...), delete и aclose (например, redis.asyncio.Redis).
+    """
+
+    def __init__(self, redis: Any, prefix: str = "fsm"):
+        self.redis = redis
+        self.prefix = prefix
+
+    async def read(self, key: str) -> Optional[FSMRecordValue]:
+        raw = await self.redis.get(f"{self.prefix}:{key}")
+        if raw is None:
+            return None
+        record = json.loads(raw)
+        return record.get("state"), record.get("data") or {}
+
+    async def write(self, key: str, state: Optional[str], data: Dict[str, Any], ttl: Optional[float]) -> None:
+        value = json.dumps({"state": state, "data": data}, ensure_ascii=False)
+        # TTL в миллисекундах: int(ttl) в секундах превращал бы дробный TTL меньше секунды в ex=0.
+        await self.redis.set(f"{self.prefix}:{key}", value, px=math.ceil(ttl * 1000) if ttl else None)
+
+    async def delete(self, key: str) -> None:
+        await self.redis.delete(f"{self.prefix}:{key}")
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+class _Entry:
+    """Запись FSM внутри обработки одного обновления: прочитана один раз, записывается один раз."""
+
+    __slots__ = ("state", "data", "dirty")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state = state
+        self.data = data
+        self.dirty = False
+
+
+class CoalescingStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram поверх FSMBackend с объединением записей.
+
+    Внутри update_scope() (его открывает FSMWriteBehindMiddleware на каждое обновление)
+    запись ключа читается из backend один раз, все set_state/set_data/update_data хэндлера
+    меняют ее в памяти, а в конце обновления изменения уходят в backend одним write.
+    Вне update_scope (фоновые задачи) каждая операция сразу читает и пишет backend.
+    Каждая запись продлевает TTL: брошенные диалоги истекают через ttl секунд.
+    """
+
+    def __init__(self, backend: FSMBackend, ttl: Optional[float] = 86400.0, key_builder: Optional[KeyBuilder] = None):
+        """
+        :param backend: Где хранить состояния.
+        :param ttl: Время жизни записи после последнего изменения, секунд; None - без истечения.
+        :param key_builder: Построение строкового ключа из StorageKey.
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self.reads = 0
+        self.writes = 0
+        self._scope: contextvars.ContextVar[Optional[Dict[str, _Entry]]] = contextvars.ContextVar(
+            f"fsm_scope_{id(self)}", default=None)
+
+    @asynccontextmanager
+    async def update_scope(self) -> AsyncIterator[None]:
+        """Объединяет операции FSM внутри блока; изменения записываются при выходе (в том числе при ошибке)."""
+        entries: Dict[str, _Entry] = {}
+        token = self._scope.set(entries)
+        try:
+            yield
+        finally:
+            self._scope.reset(token)
+            await self._flush(entries)
+
+    async def _flush(self, entries: Dict[str, _Entry]) -> None:
+        for key, entry in entries.items():
+            if entry.dirty:
+                await self._write(key, entry)
+
+    async def _write(self, key: str, entry: _Entry) -> None:
+        self.writes += 1
+        if entry.state is None and not entry.data:
+            await self.backend.delete(key)
+        else:
+            await self.backend.write(key, entry.state, entry.data, self.ttl)
+        entry.dirty = False
+
+    async def _entry(self, key: StorageKey) -> Tuple[str, _Entry, bool]:
+        """(строковый ключ, запись, нужно ли записать сразу - вне update_scope)."""
+        raw_key = self.key_builder.build(key)
+        entries = self._scope.get()
+        if entries is not None:
+            entry = entries.get(raw_key)
+            if entry is None:
+                entry = entries[raw_key] = await self._read(raw_key)
+            return raw_key, entry, False
+        return raw_key, await self._read(raw_key), True
+
+    async def _read(self, raw_key: str) -> _Entry:
+        self.reads += 1
+        record = await self.backend.read(raw_key)
+        return _Entry(*record) if record is not None else _Entry(None, {})
+
+    async def _changed(self, raw_key: str, entry: _Entry, write_now: bool) -> None:
+        entry.dirty = True
+        if write_now:
+            await self._write(raw_key, entry)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        raw_key, entry, write_now = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        await self._changed(raw_key, entry, write_now)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, entry, _ = await self._entry(key)
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        raw_key, entry, write_now = await self._entry(key)
+        entry.data = data.copy()
+        await self._changed(raw_key, entry, write_now)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, entry, _ = await self._entry(key)
+        return entry.data.copy()
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+
+def create_fsm_storage() -> BaseStorage:
+    """
+    FSM-хранилище по config.FSM_STORAGE: "memory" (по умолчанию, теряется при перезапуске),
+    "sql" (таблица fsm_states в основной БД) или "redis" (config.FSM_REDIS_URL, нужен пакет redis).
+    """
+    kind = getattr(config, "FSM_STORAGE", "memory")
+    ttl = getattr(config, "FSM_TTL", 86400.0)
+    if kind == "sql":
+        return CoalescingStorage(SQLFSMBackend(), ttl=ttl)
+    if kind == "redis":
+        try:
+            from redis.asyncio import Redis
+        except ImportError as e:
+            raise RuntimeError("FSM_STORAGE = 'redis' требует пакет redis (pip install redis).") from e
+        return CoalescingStorage(RedisFSMBackend(Redis.from_url(config.FSM_REDIS_URL)), ttl=ttl)
+    return MemoryStorage()
+
+
+async def purge_expired_fsm(storage: BaseStorage, interval: float = 3600.0) -> None:
+    """Фоновая задача: раз в interval секунд удаляет истекшие состояния из SQL-хранилища."""
+    if not isinstance(storage, CoalescingStorage) or not isinstance(storage.backend, SQLFSMBackend):
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            deleted = await storage.backend.purge_expired()
+        except Exception as e:
+            printx.warning(f"Не удалось удалить истекшие состояния FSM: {e}")
+            continue
+        if deleted:
+            printx.info(f"Удалено истекших состояний FSM: {deleted}")
@@ -1,6 +1,11 @@
+import asyncio
 import json
 import logging
+import marshal
 import os
+import string
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from app import config
 
 
@@ -9,20 +14,260 @@ printx = logging.getLogger(__name__)
 
 translations = {}
 
+# Плоские каталоги: язык -> {"buttons.pagination.next": (шаблон, форматтер или None)}.
+# Fallback на config.BASE_LOCAL уже вмержен в каждый каталог при загрузке.
+CompiledEntry = Tuple[str, Optional[Callable[[Dict[str, Any]], str]]]
+_catalogs: Dict[str, Dict[str, CompiledEntry]] = {}
 
-def load_translations():
-    """Загружает все доступные переводы из файлов JSON."""
-    for lang_code in os.listdir(config.LOCALES_DIR):
-        if lang_code.endswith(".json"):
-            lang = lang_code[:-5]
-            file_path = os.path.join(config.LOCALES_DIR, lang_code)
+# Плоские словари переводов и плейсхолдеры шаблонов по языкам - из них собираются каталоги и идет проверка.
+_flat_translations: Dict[str, Dict[str, str]] = {}
+_template_fields_by_lang: Dict[str, Dict[str, frozenset]] = {}
+
+# Путь к файлу локали -> st_mtime_ns на момент последней загрузки.
+_file_mtimes: Dict[str, int] = {}
+_reload_lock = threading.Lock()
+_reload_listeners: List[Callable[[], None]] = []
+_formatter = string.Formatter()
+
+
+def _flatten(tree: Dict[str, Any], prefix: str = "") -> Dict[str, str]:
+    """Разворачивает вложенный словарь переводов в {"a.b.c": "text"}."""
+    flat: Dict[str, str] = {}
+    for k, v in tree.items():
+        full_key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            flat.update(_flatten(v, f"{full_key}."))
+        elif isinstance(v, str):
+            flat[full_key] = v
+        else:
+            printx.info(f"Значение для ключа '{full_key}' не является строкой и будет пропущено")
+    return flat
+
+
+def _compile_entry(template: str) -> CompiledEntry:
+    # Шаблоны без фигурных скобок отдаются как есть, для остальных кэшируем format_map.
+    needs_format = "{" in template or "}" in template
+    return template, (template.format_map if needs_format else None)
+
+
+def _compile_catalogs(flat_by_lang: Dict[str, Dict[str, str]]) -> Dict[str, Dict[str, CompiledEntry]]:
+    """Собирает плоские каталоги для всех языков с заранее вмерженным базовым языком."""
+    compiled_base = {
+        key: _compile_entry(text) for key, text in flat_by_lang.get(config.BASE_LOCAL, {}).items()
+    }
+
+    catalogs: Dict[str, Dict[str, CompiledEntry]] = {}
+    for lang, flat in flat_by_lang.items():
+        if lang == config.BASE_LOCAL:
+            catalogs[lang] = compiled_base
+            continue
+        # Компилируются только строки языка; недостающие ключи берутся из уже скомпилированной базы.
+        catalog = {key: _compile_entry(text) for key, text in flat.items()}
+        catalog.update((key, compiled_base[key]) for key in compiled_base.keys() - catalog.keys())
+        catalogs[lang] = catalog
+    return catalogs
+
+
+def _placeholders(template: str) -> frozenset:
+    try:
+        return frozenset(field for _, field, _, _ in _formatter.parse(template) if field is not None)
+    except ValueError:
+        return frozenset({"<invalid>"})
+
+
+def _template_fields(flat: Dict[str, str]) -> Dict[str, frozenset]:
+    """Плейсхолдеры шаблонов, где они есть: {"a.b": frozenset({"name"})}; у остальных ключей их нет."""
+    return {key: _placeholders(text) for key, text in flat.items() if "{" in text or "}" in text}
+
+
+_NO_FIELDS: frozenset = frozenset()
+
+
+def validate_translations(
+    raw: Dict[str, Dict[str, Any]],
+    flat_by_lang: Optional[Dict[str, Dict[str, str]]] = None,
+    fields_by_lang: Optional[Dict[str, Dict[str, frozenset]]] = None
+) -> List[str]:
+    """
+    Сверяет все локали с базовой (config.BASE_LOCAL).
+    :param raw: Словарь язык -> вложенный словарь переводов.
+    :param flat_by_lang: Уже развернутые переводы тех же языков (чтобы не разворачивать повторно).
+    :param fields_by_lang: Уже разобранные плейсхолдеры (_template_fields) тех же языков.
+    :return: Список найденных проблем: отсутствующие ключи и несовпадающие плейсхолдеры.
+    """
+    if flat_by_lang is None:
+        flat_by_lang = {lang: _flatten(tree) for lang, tree in raw.items()}
+    if fields_by_lang is None:
+        fields_by_lang = {lang: _template_fields(flat) for lang, flat in flat_by_lang.items()}
+    base_flat = flat_by_lang.get(config.BASE_LOCAL, {})
+    base_fields = fields_by_lang.get(config.BASE_LOCAL, {})
+    problems: List[str] = []
+    for lang, flat in flat_by_lang.items():
+        if lang == config.BASE_LOCAL:
+            continue
+        fields = fields_by_lang[lang]
+        for key in sorted(base_flat.keys() - flat.keys()):
+            problems.append(f"[{lang}] отсутствует ключ '{key}'")
+        for key in sorted(base_flat.keys() & flat.keys()):
+            expected, actual = base_fields.get(key, _NO_FIELDS), fields.get(key, _NO_FIELDS)
+            if expected != actual:
+                problems.append(
+                    f"[{lang}] ключ '{key}': плейсхолдеры {sorted(actual)} вместо {sorted(expected)}")
+    return problems
+
+
+def _scan_locale_files() -> Dict[str, int]:
+    mtimes: Dict[str, int] = {}
+    with os.scandir(config.LOCALES_DIR) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(".json"):
+                mtimes[entry.path] = entry.stat().st_mtime_ns
+    return mtimes
+
+
+# Версия формата кэша локалей: меняется вместе с тем, что в нем хранится.
+_CACHE_FORMAT = 1
+
+# Разобранный файл локали: вложенный словарь, развернутые переводы, плейсхолдеры шаблонов.
+LocaleFile = Tuple[Dict[str, Any], Dict[str, str], Dict[str, frozenset]]
+
+
+def _cache_path(path: str) -> str:
+    cache_dir = getattr(config, "LOCALES_CACHE_DIR", None) or os.path.join(os.path.dirname(path), "__pycache__")
+    return os.path.join(cache_dir, f"{os.path.basename(path)[:-5]}.marshal")
+
+
+def _read_locale(path: str, mtime_ns: int) -> LocaleFile:
+    """
+    Читает и разбирает файл локали.
+
+    Результат разбора (вместе с развернутыми ключами и плейсхолдерами, которые иначе заново
+    разбираются при каждой проверке) кэшируется в __pycache__ рядом с локалями
+    (config.LOCALES_CACHE_DIR) в формате marshal - как .pyc для модулей. Кэш действителен, пока у JSON
+    те же mtime и размер; иначе файл разбирается заново и кэш перезаписывается.
+    Недоступный для записи каталог кэша не мешает загрузке.
+    """
+    size = os.path.getsize(path)
+    cache_path = _cache_path(path)
+    try:
+        with open(cache_path, "rb") as f:
+            # loads от прочитанных байтов: marshal.load из файла читает его мелкими кусками в разы медленнее.
+            cached = marshal.loads(f.read())
+        if cached[:3] == (_CACHE_FORMAT, mtime_ns, size):
+            tree, flat, fields = cached[3:]
+            return tree, flat, fields
+    except (OSError, EOFError, ValueError, TypeError):
+        # Нет кэша, он поврежден или другого формата - разбираем JSON.
+        pass
+
+    with open(path, "r", encoding="utf-8") as f:
+        tree = json.load(f)
+    flat = _flatten(tree)
+    fields = _template_fields(flat)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(marshal.dumps((_CACHE_FORMAT, mtime_ns, size, tree, flat, fields)))
+        os.replace(tmp_path, cache_path)
+    except (OSError, ValueError) as e:
+        printx.debug(f"Не удалось записать кэш переводов {cache_path}: {e}")
+    return tree, flat, fields
+
+
+def add_reload_listener(callback: Callable[[], None]) -> None:
+    """
+    Регистрирует функцию, вызываемую после каждой подмены каталога переводов
+    (например, для сброса кэшей, собранных из старых строк).
+    :param callback: Функция без аргументов.
+    """
+    _reload_listeners.append(callback)
+
+
+def reload_translations(force: bool = False, strict: bool = False) -> List[str]:
+    """
+    Перечитывает изменившиеся файлы локалей и атомарно подменяет каталог.
+
+    Парсятся только файлы с новым mtime, удаленные файлы убирают язык из каталога.
+    Новый каталог собирается целиком в стороне и подменяется одним присваиванием,
+    поэтому get_text никогда не видит наполовину загруженные данные.
+    :param force: Перечитать все файлы, не глядя на mtime.
+    :param strict: Не применять новый каталог, если валидация нашла проблемы.
+    :return: Список проблем валидации (пустой, если все в порядке или ничего не изменилось).
+    """
+    global translations, _flat_translations, _template_fields_by_lang, _catalogs, _file_mtimes
+
+    with _reload_lock:
+        current_mtimes = _scan_locale_files()
+        changed = [path for path, mtime in current_mtimes.items()
+                   if force or _file_mtimes.get(path) != mtime]
+        removed = [path for path in _file_mtimes if path not in current_mtimes]
+        if not changed and not removed:
+            return []
+
+        new_translations = dict(translations)
+        new_flat = dict(_flat_translations)
+        new_fields = dict(_template_fields_by_lang)
+        new_mtimes = dict(current_mtimes)
+        for path in removed:
+            lang = os.path.basename(path)[:-5]
+            new_translations.pop(lang, None)
+            new_flat.pop(lang, None)
+            new_fields.pop(lang, None)
+            printx.info(f"Файл переводов для языка '{lang}' удален, язык выгружен.")
+        for path in changed:
+            lang = os.path.basename(path)[:-5]
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    translations[lang] = json.load(f)
+                new_translations[lang], new_flat[lang], new_fields[lang] = _read_locale(path, current_mtimes[path])
                 printx.info(f"Переводы для языка '{lang}' успешно загружены.")
             except Exception as e:
+                # Оставляем прошлую версию языка и попробуем снова на следующем проходе.
+                new_mtimes.pop(path, None)
                 printx.info(f"Ошибка загрузки переводов для '{lang}': {e}")
 
+        problems = validate_translations(new_translations, new_flat, new_fields)
+        for problem in problems:
+            printx.warning(f"Проверка переводов: {problem}")
+        if strict and problems:
+            printx.warning("Новые переводы не применены: найдены проблемы при проверке.")
+            return problems
+
+        new_catalogs = _compile_catalogs(new_flat)
+        translations, _flat_translations, _template_fields_by_lang = new_translations, new_flat, new_fields
+        _catalogs, _file_mtimes = new_catalogs, new_mtimes
+
+    for callback in _reload_listeners:
+        try:
+            callback()
+        except Exception as e:
+            printx.error(f"Ошибка обработчика перезагрузки переводов {callback!r}: {e}")
+    return problems
+
+
+async def reload_translations_async(force: bool = False, strict: bool = False) -> List[str]:
+    """Выполняет reload_translations в отдельном потоке, не блокируя event loop."""
+    return await asyncio.to_thread(reload_translations, force, strict)
+
+
+async def watch_translations(interval: float = 5.0) -> None:
+    """
+    Фоновая задача: раз в interval секунд проверяет mtime файлов локалей
+    и перезагружает изменившиеся.
+    :param interval: Период опроса в секундах.
+    """
+    printx.info(f"Отслеживание изменений переводов запущено (интервал {interval} с).")
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await reload_translations_async()
+        except Exception as e:
+            printx.error(f"Ошибка перезагрузки переводов: {e}")
+
+
+def load_translations():
+    """Загружает все доступные переводы из файлов JSON."""
+    reload_translations(force=True)
+
 
 def get_text(key: str, lang: str = "ru", **kwargs) -> str:
     """
@@ -32,38 +277,13 @@ def get_text(key: str, lang: str = "ru", **kwargs) -> str:
     :param kwargs: Именованные аргументы для подстановки в текст.
     :return: Переведенный и отформатированный текст или ключ, если перевод не найден.
     """
-
-    keys = key.split('.')
-    text_template = translations.get(lang, translations.get(config.BASE_LOCAL))
-
-    try:
-        for k in keys:
-            if isinstance(text_template, dict):
-                text_template = text_template[k]
-            else:
-                printx.info(
-                    f"Ключ '{key}' не найден для языка '{lang}' на уровне '{k}'")
-                return key
-
-        if not isinstance(text_template, str):
-            printx.info(
-                f"Значение для ключа '{key}' не является строкой для языка '{lang}'")
-            return key
-
-    except KeyError:
+    catalog = _catalogs.get(lang) or _catalogs.get(config.BASE_LOCAL)
+    entry = catalog.get(key) if catalog else None
+    if entry is None:
         printx.info(f"Ключ '{key}' не найден для языка '{lang}'")
-        default_lang_translations = translations.get("ru", {})
-        text_template_default = default_lang_translations
-        try:
-            for k_default in keys:
-                if isinstance(text_template_default, dict):
-                    text_template_default = text_template_default[k_default]
-                else:
-                    return key
-            if isinstance(text_template_default, str):
-                return text_template_default.format_map(kwargs) if kwargs else text_template_default
-        except KeyError:
-            return key
         return key
 
-    return text_template.format_map(kwargs) if kwargs else text_template
+    text_template, formatter = entry
+    if formatter is None or not kwargs:
+        return text_template
+    return formatter(kwargs)
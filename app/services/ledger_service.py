@@ -0,0 +1,208 @@
+import asyncio
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.database import requests
+
+
+printx = logging.getLogger(__name__)
+
+# Виды записей журнала.
+TOPUP, PURCHASE, SALE, TRANSFER, PROMO, REFERRAL, ADJUSTMENT = (
+    "topup", "purchase", "sale", "transfer", "promo", "referral", "adjustment")
+
+
+class InsufficientFunds(Exception):
+    """На балансе меньше, чем нужно списать; операция не применена."""
+
+    def __init__(self, user_id: int, amount: Decimal):
+        super().__init__(f"Недостаточно средств у пользователя {user_id} для списания {amount}")
+        self.user_id = user_id
+        self.amount = amount
+
+
+def update_key(update_id: int, action: str) -> str:
+    """
+    Ключ идемпотентности операции из обновления Telegram. Повторно доставленное обновление
+    (перезапуск polling, повтор вебхука) несет тот же update_id - операция не выполнится дважды.
+    :param action: Что делает хэндлер ("transfer", "buy:42", ...), если одно обновление порождает несколько операций.
+    """
+    return f"tg:{update_id}:{action}"
+
+
+def _entry(user_id: int, amount: Decimal, kind: str, key: str, counterparty_id: Optional[int]) -> dict:
+    return {"user_id": user_id, "amount": amount, "kind": kind, "idempotency_key": key,
+            "counterparty_id": counterparty_id}
+
+
+async def _insert_entries(session: AsyncSession, key: str, entries: List[dict]) -> Optional[List[int]]:
+    """
+    Вставляет все записи операции или ни одной.
+    :return: Id вставленных записей; None - операция с этим ключом уже выполнена.
+    :raises ValueError: Часть записей с этим ключом уже есть - ключ занят другой операцией;
+        вставленные сейчас записи убраны.
+    """
+    entry_ids = await requests.insert_ledger_entries(session, entries)
+    if not entry_ids:
+        return None
+    if len(entry_ids) != len(entries):
+        await requests.delete_ledger_entries(session, entry_ids)
+        raise ValueError(f"Ключ идемпотентности '{key}' уже использован другой операцией")
+    return entry_ids
+
+
+# Операции ниже не делают commit (как и requests): они выполняются в транзакции обновления
+# (DatabaseMiddleware) и вместе с остальными ее изменениями либо фиксируются, либо откатываются.
+# Каждая - вставка записей в журнал и один-два UPDATE по первичному ключу, без SELECT ... FOR UPDATE.
+# Отмена операции удаляет только свои записи по id: журнал с тем же ключом из других транзакций не трогается.
+
+async def credit(
+    session: AsyncSession, user_id: int, amount: Decimal, kind: str, key: str,
+    counterparty_id: Optional[int] = None
+) -> bool:
+    """
+    Зачисляет amount на баланс.
+    :param key: Ключ идемпотентности (update_key или id платежа у провайдера).
+    :return: True - зачислено; False - операция с этим ключом уже выполнена.
+    """
+    if amount <= 0:
+        raise ValueError(f"Сумма зачисления должна быть положительной: {amount}")
+    entry_ids = await _insert_entries(session, key, [_entry(user_id, amount, kind, key, counterparty_id)])
+    if entry_ids is None:
+        return False
+    if not await requests.credit_balance(session, user_id, amount):
+        await requests.delete_ledger_entries(session, entry_ids)
+        raise LookupError(f"Пользователь {user_id} не найден")
+    return True
+
+
+async def debit(
+    session: AsyncSession, user_id: int, amount: Decimal, kind: str, key: str,
+    counterparty_id: Optional[int] = None
+) -> bool:
+    """
+    Списывает amount с баланса условным UPDATE: параллельные списания не уводят баланс в минус.
+    :return: True - списано; False - операция с этим ключом уже выполнена.
+    :raises InsufficientFunds: Средств недостаточно; журнал и баланс не изменены.
+    """
+    if amount <= 0:
+        raise ValueError(f"Сумма списания должна быть положительной: {amount}")
+    entry_ids = await _insert_entries(session, key, [_entry(user_id, -amount, kind, key, counterparty_id)])
+    if entry_ids is None:
+        return False
+    if not await requests.debit_balance(session, user_id, amount):
+        await requests.delete_ledger_entries(session, entry_ids)
+        raise InsufficientFunds(user_id, amount)
+    return True
+
+
+async def transfer(session: AsyncSession, sender_id: int, receiver_id: int, amount: Decimal, key: str) -> bool:
+    """
+    Перевод между пользователями: две записи журнала с одним ключом и два UPDATE.
+    Строки users обновляются в порядке возрастания id, поэтому встречные переводы
+    не взаимоблокируются в MySQL.
+    :return: True - переведено; False - перевод с этим ключом уже выполнен.
+    :raises InsufficientFunds: У отправителя недостаточно средств; ничего не изменено.
+    :raises LookupError: Получатель не найден; ничего не изменено.
+    :raises ValueError: Ключ уже занят другой операцией (есть только одна из ног); ничего не изменено.
+    """
+    if sender_id == receiver_id:
+        raise ValueError("Перевод самому себе")
+    if amount <= 0:
+        raise ValueError(f"Сумма перевода должна быть положительной: {amount}")
+    entries = [_entry(sender_id, -amount, TRANSFER, key, receiver_id),
+               _entry(receiver_id, amount, TRANSFER, key, sender_id)]
+    entry_ids = await _insert_entries(session, key, entries)
+    if entry_ids is None:
+        return False
+
+    # Порядок UPDATE по id строк; failed - какой шаг не прошел: списание (мало средств) или зачисление (нет получателя).
+    failed = None
+    steps = [("debit", sender_id), ("credit", receiver_id)]
+    done = []
+    for step, user_id in sorted(steps, key=lambda item: item[1]):
+        if step == "debit":
+            ok = await requests.debit_balance(session, user_id, amount)
+        else:
+            ok = await requests.credit_balance(session, user_id, amount)
+        if not ok:
+            failed = step
+            break
+        done.append(step)
+    if failed is not None:
+        if "debit" in done:
+            await requests.credit_balance(session, sender_id, amount)
+        if "credit" in done:
+            await requests.credit_balance(session, receiver_id, -amount)
+        await requests.delete_ledger_entries(session, entry_ids)
+        if failed == "debit":
+            raise InsufficientFunds(sender_id, amount)
+        raise LookupError(f"Получатель {receiver_id} не найден")
+    return True
+
+
+# --- Свертка и сверка ---
+
+async def compact_ledger(factory: async_sessionmaker, settle: float = 60.0) -> int:
+    """
+    Сворачивает новые записи журнала в balance_snapshots: одна GROUP BY-выборка и один
+    upsert, журнал не меняется. Сворачиваются только записи старше settle секунд: id
+    выдаются при вставке, а фиксируются позже, и незафиксированная запись с меньшим id
+    не должна оказаться за отметкой свертки (операции короткие, минуты хватает с запасом).
+    Возраст считается по часам БД, как и created_at: время процесса может быть в другой зоне
+    (NOW() в MySQL - в зоне сессии).
+    :return: Сколько пользователей получили новый снимок.
+    """
+    async with factory() as session:
+        after_id = await requests.get_snapshot_watermark(session)
+        cutoff = await requests.get_db_now(session) - timedelta(seconds=settle)
+        up_to_id = await requests.get_last_ledger_id(session, cutoff)
+        if up_to_id <= after_id:
+            return 0
+        sums = await requests.sum_ledger_range(session, after_id, up_to_id)
+        await requests.add_to_balance_snapshots(
+            session, [{"user_id": user_id, "balance": total, "entry_id": up_to_id} for user_id, total in sums])
+        await session.commit()
+    printx.debug(f"Журнал баланса свернут до записи {up_to_id}: пользователей {len(sums)}")
+    return len(sums)
+
+
+async def audit_balances(
+    factory: async_sessionmaker, batch_size: int = 1000, max_samples: int = 20
+) -> Tuple[int, int, List[Tuple[int, Decimal, Decimal]]]:
+    """
+    Сверяет users.balance с балансом по журналу (снимок + хвост) keyset-пачками.
+    Балансы, начисленные до появления журнала, видны как расхождения, пока для них нет записи adjustment.
+    :return: (проверено пользователей, расхождений, первые max_samples расхождений (id, users.balance, по журналу)).
+    """
+    checked, drifted, samples = 0, 0, []
+    after_id = 0
+    while True:
+        async with factory() as session:
+            rows = await requests.list_ledger_balances(session, after_id, batch_size)
+        if not rows:
+            break
+        for user_id, balance, ledger_balance in rows:
+            if balance != ledger_balance:
+                drifted += 1
+                if len(samples) < max_samples:
+                    samples.append((user_id, balance, ledger_balance))
+        checked += len(rows)
+        after_id = rows[-1][0]
+    level = logging.WARNING if drifted else logging.INFO
+    printx.log(level, f"Сверка балансов с журналом: проверено {checked}, расхождений {drifted}")
+    return checked, drifted, samples
+
+
+async def run_ledger_compaction(factory: async_sessionmaker, interval: float = 3600.0, settle: float = 60.0) -> None:
+    """Фоновая задача: раз в interval секунд сворачивает журнал баланса."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await compact_ledger(factory, settle)
+        except Exception as e:
+            printx.warning(f"Не удалось свернуть журнал баланса: {e}")
@@ -1,6 +1,11 @@
+import atexit
+import copy
+import itertools
+import json
 import logging
 import logging.handlers
 import os
+import queue
 import re
 import sys
 from datetime import datetime
@@ -8,6 +13,8 @@ from datetime import datetime
 
 SESSION_UPDATE_COUNTER = 0
 
+_queue_listener = None
+
 try:
     import colorama
     colorama.init(autoreset=True)
@@ -33,6 +40,11 @@ except ImportError:
     setattr(Style, "BRIGHT", "")
 
 
+AIOGRAM_UPDATE_TEMPLATE = "Update id=%s is %s. Duration %d ms by bot id=%d"
+
+_session_update_counter = itertools.count(1)
+
+
 class AiogramEventFilter(logging.Filter):
     """
     Фильтр для обогащения лог-записей от aiogram.event.
@@ -42,28 +54,49 @@ class AiogramEventFilter(logging.Filter):
     def filter(self, record):
         global SESSION_UPDATE_COUNTER
 
-        expected_msg_template = "Update id=%s is %s. Duration %d ms by bot id=%d"
-        if record.name == 'aiogram.event' and record.msg == expected_msg_template:
-
-            SESSION_UPDATE_COUNTER += 1
-            record.session_update_count = SESSION_UPDATE_COUNTER
+        if record.msg == AIOGRAM_UPDATE_TEMPLATE and record.name == 'aiogram.event':
+            SESSION_UPDATE_COUNTER = record.session_update_count = next(_session_update_counter)
 
-            if hasattr(record, 'args') and isinstance(record.args, tuple):
-                if len(record.args) >= 1:
-                    record.parsed_update_id = record.args[0]
+            args = record.args
+            if isinstance(args, tuple):
+                if len(args) >= 1:
+                    record.parsed_update_id = args[0]
 
-                if len(record.args) >= 3:
-                    record.parsed_duration_ms = record.args[2]
+                if len(args) >= 3:
+                    record.parsed_duration_ms = args[2]
 
-            record.original_aiogram_msg_template = record.msg
+            record.original_aiogram_msg_template = AIOGRAM_UPDATE_TEMPLATE
         return True
 
 
+class _RecordView:
+    """
+    Представление лог-записи для подстановки в строку формата без копирования и без изменения записи:
+    отдельные поля (message, levelname, asctime) подменяются, остальные читаются из record.__dict__.
+    """
+
+    __slots__ = ("_values", "_overrides")
+
+    def __init__(self, record, overrides):
+        self._values = record.__dict__
+        self._overrides = overrides
+
+    def __getitem__(self, key):
+        overrides = self._overrides
+        if key in overrides:
+            return overrides[key]
+        return self._values[key]
+
+
 class ColorizingFormatter(logging.Formatter):
     """
     Кастомный форматер для логирования с цветами в консоли.
     Числа в сообщении будут подсвечены.
     Специально обрабатывает сообщения от aiogram.event.
+
+    Запись не изменяется: регулярное выражение и цветные префиксы уровней собираются один раз,
+    а строка формата заполняется через _RecordView. Цвета выключаются, если use_colors=False,
+    colorama не установлена или (при use_colors=None) поток вывода не является терминалом.
     """
     LEVEL_COLORS = {
         logging.DEBUG: Fore.BLUE,
@@ -73,68 +106,181 @@ class ColorizingFormatter(logging.Formatter):
         logging.CRITICAL: Fore.MAGENTA,
     } if HAS_COLORAMA else {}
 
+    NUMBER_PATTERN = re.compile(r'(\b\d+\.?\d*\b)')
+
+    def __init__(self, fmt=None, datefmt=None, style='%', validate=True, *, use_colors=None, stream=None):
+        """
+        :param use_colors: True/False - включить/выключить цвета; None - только если stream является TTY.
+        :param stream: Поток вывода для автоопределения TTY (по умолчанию sys.stdout).
+        """
+        super().__init__(fmt, datefmt, style, validate)
+        if use_colors is None:
+            stream = stream if stream is not None else sys.stdout
+            use_colors = hasattr(stream, "isatty") and stream.isatty()
+        self.use_colors = bool(use_colors) and HAS_COLORAMA
+        self._uses_time = self.usesTime()
+        self._percent_style = type(self._style) is logging.PercentStyle
+
+        if self.use_colors:
+            self._level_names = {
+                levelno: f"{color}{Style.BRIGHT}{logging.getLevelName(levelno)}{Style.RESET_ALL}"
+                for levelno, color in self.LEVEL_COLORS.items()
+            }
+            self._number_replacement = f'{Fore.CYAN}\\1{Style.RESET_ALL}'
+            self._aiogram_template = (
+                f"Обработано обновление {Style.BRIGHT}[{Fore.CYAN}%s{Style.RESET_ALL}]. "
+                f"Длительность: {Fore.GREEN}%s{Style.RESET_ALL}."
+            )
+        else:
+            self._level_names = {}
+            self._number_replacement = None
+            self._aiogram_template = "Обработано обновление [%s]. Длительность: %s."
+
+    def _render_message(self, record):
+        values = record.__dict__
+        if 'session_update_count' in values and values.get('original_aiogram_msg_template') == AIOGRAM_UPDATE_TEMPLATE:
+            update_id = values.get('parsed_update_id')
+            duration = values.get('parsed_duration_ms')
+            return self._aiogram_template % (
+                f"ID {update_id}" if update_id is not None else "ID (неизвестно)",
+                f"{int(duration)} мс" if duration is not None else "(неизвестно)",
+            )
+
+        message = record.getMessage()
+        if self._number_replacement is not None:
+            message = self.NUMBER_PATTERN.sub(self._number_replacement, message)
+        return message
+
+    def format(self, record):
+        if not self._percent_style:
+            return super().format(record)
+
+        overrides = {"message": self._render_message(record)}
+        levelname = self._level_names.get(record.levelno)
+        if levelname is not None:
+            overrides["levelname"] = levelname
+        if self._uses_time:
+            overrides["asctime"] = self.formatTime(record, self.datefmt)
+
+        formatted_log = self._style._fmt % _RecordView(record, overrides)
+
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = self.formatException(record.exc_info)
+        if exc_text:
+            formatted_log = f"{formatted_log}\n{exc_text}"
+        if record.stack_info:
+            formatted_log = f"{formatted_log}\n{self.formatStack(record.stack_info)}"
+        return formatted_log
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Форматер в JSON Lines для машинной обработки логов: одна запись - один JSON-объект в строке.
+    Для обновлений aiogram добавляются update_id, duration_ms и session_update_count.
+    """
+
+    EXTRA_FIELDS = (
+        ("parsed_update_id", "update_id"),
+        ("parsed_duration_ms", "duration_ms"),
+        ("session_update_count", "session_update_count"),
+    )
+
     def format(self, record):
+        payload = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "func": record.funcName,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        values = record.__dict__
+        for attr, key in self.EXTRA_FIELDS:
+            if attr in values:
+                payload[key] = values[attr]
+        exc_text = record.exc_text or (self.formatException(record.exc_info) if record.exc_info else None)
+        if exc_text:
+            payload["exc_info"] = exc_text
+        if record.stack_info:
+            payload["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+_exception_formatter = logging.Formatter()
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler для ограниченной очереди: на потоке event loop в запись только подставляются
+    аргументы сообщения и текст исключения, оформление (время, цвета, JSON) и запись
+    на консоль/диск выполняет поток QueueListener.
+    При переполнении запись отбрасывается и учитывается в счетчике dropped.
+    """
 
-        original_levelname = record.levelname
-        text_message_with_args_if_not_overridden = record.getMessage()
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._reported_dropped = 0
+
+    def prepare(self, record):
+        # Как в стандартном prepare, сообщение собирается сразу: к моменту обработки в потоке слушателя
+        # изменяемые args могли поменяться, а exc_info держал бы кадры стека живыми. Но полный format
+        # здесь не вызывается - оформление остается форматтерам слушателя.
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
-        _original_msg_for_record = record.msg
-        _original_args_for_record = record.args
-        _formatter_modified_msg_or_args = False
+    def take_dropped_report(self):
+        """Возвращает число отброшенных записей с прошлого вызова."""
+        dropped, self._reported_dropped = self.dropped - self._reported_dropped, self.dropped
+        return dropped
 
-        if HAS_COLORAMA:
-            color = self.LEVEL_COLORS.get(record.levelno, Fore.RESET)
-            record.levelname = f"{color}{Style.BRIGHT}{original_levelname}{Style.RESET_ALL}"
 
-        _processed_as_aiogram_event = False
+class _DropReportingListener(logging.handlers.QueueListener):
+    """QueueListener, который сообщает в лог о записях, отброшенных из-за переполнения очереди."""
 
-        expected_msg_template_for_formatter = "Update id=%s is %s. Duration %d ms by bot id=%d"
-        if record.name == 'aiogram.event' and \
-           hasattr(record, 'session_update_count') and \
-           getattr(record, 'original_aiogram_msg_template', None) == expected_msg_template_for_formatter:
+    def __init__(self, log_queue, *handlers, queue_handler=None, respect_handler_level=False):
+        super().__init__(log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self.queue_handler = queue_handler
 
-            update_id_str = f"ID {record.parsed_update_id}" if hasattr(
-                record, 'parsed_update_id') else "ID (неизвестно)"
+    def handle(self, record):
+        if self.queue_handler is not None and self.queue_handler.dropped != self.queue_handler._reported_dropped:
+            dropped = self.queue_handler.take_dropped_report()
+            warning = logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0,
+                "Очередь логов переполнена: отброшено записей: %d", (dropped,), None, func="handle")
+            super().handle(warning)
+        super().handle(record)
 
-            duration_val = getattr(record, 'parsed_duration_ms', None)
-            duration_str = f"{int(duration_val)} мс" if duration_val is not None else "(неизвестно)"
+    def enqueue_sentinel(self):
+        # Ждем места в очереди, иначе stop() при переполненной очереди упадет с queue.Full.
+        self.queue.put(self._sentinel)
+
+
+def shutdown_logging():
+    """Останавливает фоновый поток логирования, предварительно записав все записи из очереди."""
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        for handler in _queue_listener.handlers:
+            handler.flush()
+        _queue_listener = None
 
-            new_msg_template = (
-                f"Обработано обновление {Style.BRIGHT}"
-                f"[{Fore.CYAN}{update_id_str}{Style.RESET_ALL}]. "
-                f"Длительность: {Fore.GREEN}{duration_str}{Style.RESET_ALL}."
-            )
-            
-            record.msg = new_msg_template
-            record.args = tuple()
-            _formatter_modified_msg_or_args = True
-            _processed_as_aiogram_event = True
-
-        elif HAS_COLORAMA and not _processed_as_aiogram_event:
-            
-            
-            
-            
-            colored_text_message = re.sub(
-                r'(\b\d+\.?\d*\b)', f'{Fore.CYAN}\\1{Style.RESET_ALL}', text_message_with_args_if_not_overridden)
-            
-            record.msg = colored_text_message
-            record.args = tuple()
-            _formatter_modified_msg_or_args = True
-        
-        formatted_log = super().format(record)
-        
-        
-        
-        
-
-        record.levelname = original_levelname
-
-        if _formatter_modified_msg_or_args:
-            record.msg = _original_msg_for_record
-            record.args = _original_args_for_record
-        
-        return formatted_log
+
+atexit.register(shutdown_logging)
 
 
 def setup_logging(
@@ -143,7 +289,11 @@ def setup_logging(
     file_level=logging.DEBUG,
     aiogram_level=logging.INFO,
     log_file_name="app.log",
-    symlink_name="latest.log"
+    symlink_name="latest.log",
+    use_queue=True,
+    queue_size=10000,
+    console_colors=None,
+    file_format="text"
 ):
     """
     Настраивает систему логирования.
@@ -154,7 +304,14 @@ def setup_logging(
     :param aiogram_level: Уровень логирования для библиотеки aiogram.
     :param log_file_name: Базовое имя файла для логов.
     :param symlink_name: Имя символической ссылки на последний лог.
+    :param use_queue: Писать логи через QueueHandler/QueueListener в фоновом потоке,
+                      не блокируя event loop вводом-выводом (включая ротацию в полночь).
+    :param queue_size: Размер очереди записей; при переполнении записи отбрасываются с подсчетом.
+    :param console_colors: Цвета в консоли: True/False или None - только если stdout является терминалом.
+    :param file_format: Формат файла логов: "text" или "json" (JSON Lines для машинной обработки).
     """
+    global _queue_listener
+
     if not HAS_COLORAMA:
         print("Предупреждение: библиотека colorama не найдена. Логи в консоли не будут окрашены.", file=sys.stderr)
 
@@ -165,27 +322,26 @@ def setup_logging(
         return
 
     console_format_str = "%(asctime)s - %(levelname)s - [%(name)s] - %(message)s"
-    if not HAS_COLORAMA:
-        console_formatter = logging.Formatter(
-            console_format_str, datefmt="%Y-%m-%d %H:%M:%S")
-    else:
-        console_formatter = ColorizingFormatter(
-            console_format_str, datefmt="%Y-%m-%d %H:%M:%S")
+    console_formatter = ColorizingFormatter(
+        console_format_str, datefmt="%Y-%m-%d %H:%M:%S", use_colors=console_colors, stream=sys.stdout)
 
-    file_format_str = "%(asctime)s - %(levelname)s - [%(name)s:%(module)s:%(funcName)s:%(lineno)d] - %(message)s"
-    file_formatter = logging.Formatter(
-        file_format_str, datefmt="%Y-%m-%d %H:%M:%S")
+    if file_format == "json":
+        file_formatter = JsonLinesFormatter()
+    else:
+        file_format_str = "%(asctime)s - %(levelname)s - [%(name)s:%(module)s:%(funcName)s:%(lineno)d] - %(message)s"
+        file_formatter = logging.Formatter(
+            file_format_str, datefmt="%Y-%m-%d %H:%M:%S")
 
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.DEBUG)
 
+    shutdown_logging()
     for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
 
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(console_level)
     console_handler.setFormatter(console_formatter)
-    root_logger.addHandler(console_handler)
 
     current_log_file_path = os.path.join(log_dir, log_file_name)
 
@@ -194,7 +350,19 @@ def setup_logging(
     )
     file_handler.setLevel(file_level)
     file_handler.setFormatter(file_formatter)
-    root_logger.addHandler(file_handler)
+
+    if use_queue:
+        queue_handler = BoundedQueueHandler(queue.Queue(maxsize=queue_size))
+        # Не кладем в очередь то, что не запишет ни один обработчик.
+        queue_handler.setLevel(min(console_level, file_level))
+        root_logger.addHandler(queue_handler)
+        _queue_listener = _DropReportingListener(
+            queue_handler.queue, console_handler, file_handler,
+            queue_handler=queue_handler, respect_handler_level=True)
+        _queue_listener.start()
+    else:
+        root_logger.addHandler(console_handler)
+        root_logger.addHandler(file_handler)
 
     aiogram_logger = logging.getLogger("aiogram")
     aiogram_logger.setLevel(aiogram_level)
@@ -0,0 +1,281 @@
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import random
+import time
+import traceback
+from bisect import bisect_left
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+
+printx = logging.getLogger(__name__)
+
+# Границы корзин гистограммы задержек, секунд (как у клиентов Prometheus, с запасом в сторону медленных).
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек: кумулятивные корзины для Prometheus и окно последних
+    измерений для точных p50/p95/p99 в логах. observe() - O(log корзин), без аллокаций.
+    """
+
+    __slots__ = ("bounds", "counts", "count", "total", "_window")
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BUCKETS, window: int = 1024):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._window: Deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self._window.append(seconds)
+
+    def quantiles(self, quantiles: Sequence[float] = QUANTILES) -> Dict[float, float]:
+        """Квантили по окну последних измерений; пустой словарь, если измерений не было."""
+        if not self._window:
+            return {}
+        ordered = sorted(self._window)
+        last = len(ordered) - 1
+        return {q: ordered[min(last, int(q * len(ordered)))] for q in quantiles}
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Пары (le, накопленное число) для экспорта в формате Prometheus."""
+        result, running = [], 0
+        for bound, count in zip(self.bounds, self.counts):
+            running += count
+            result.append((repr(bound), running))
+        result.append(("+Inf", self.count))
+        return result
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: Any) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+class UpdateMetrics:
+    """
+    Метрики обработки обновлений: задержки по хэндлерам и роутерам, обновления в работе
+    и ошибки. Заполняется MetricsMiddleware, читается через render_prometheus() и log_summary().
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, window: int = 1024):
+        self.buckets = tuple(buckets)
+        self.window = window
+        self.in_flight = 0
+        self.updates = LatencyHistogram(self.buckets, window)
+        self.handlers: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self.routers: Dict[str, LatencyHistogram] = {}
+        self.errors: Counter = Counter()
+        self.slow_updates = 0
+        self._collectors: List[Any] = []
+
+    def add_collector(self, collector: Any) -> None:
+        """
+        Подключает дополнительный источник метрик (например, UserLaneMiddleware).
+        У collector должны быть render_prometheus(prefix) -> List[str] и log_summary().
+        """
+        self._collectors.append(collector)
+
+    def _histogram(self, storage: Dict[Any, LatencyHistogram], key: Any) -> LatencyHistogram:
+        histogram = storage.get(key)
+        if histogram is None:
+            histogram = storage[key] = LatencyHistogram(self.buckets, self.window)
+        return histogram
+
+    def observe_handler(self, router: str, handler: str, seconds: float, error: Optional[str] = None) -> None:
+        self._histogram(self.handlers, (router, handler)).observe(seconds)
+        self._histogram(self.routers, router).observe(seconds)
+        if error is not None:
+            self.errors[(router, handler, error)] += 1
+
+    def render_prometheus(self, prefix: str = "notshop") -> str:
+        """Текст в формате Prometheus exposition (text/plain; version=0.0.4)."""
+        lines = [
+            f"# HELP {prefix}_updates_in_flight Updates being processed right now.",
+            f"# TYPE {prefix}_updates_in_flight gauge",
+            f"{prefix}_updates_in_flight {self.in_flight}",
+            f"# HELP {prefix}_slow_updates_total Updates slower than the profiler threshold.",
+            f"# TYPE {prefix}_slow_updates_total counter",
+            f"{prefix}_slow_updates_total {self.slow_updates}",
+        ]
+
+        def histogram(name: str, help_text: str, series: List[Tuple[Dict[str, str], LatencyHistogram]]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, hist in series:
+                for le, count in hist.cumulative():
+                    lines.append(f"{name}_bucket{_labels(**labels, le=le)} {count}")
+                lines.append(f"{name}_sum{_labels(**labels)} {hist.total:.6f}")
+                lines.append(f"{name}_count{_labels(**labels)} {hist.count}")
+
+        histogram(f"{prefix}_update_duration_seconds", "Whole update processing time.", [({}, self.updates)])
+        histogram(f"{prefix}_router_duration_seconds", "Handler time grouped by router.",
+                  [({"router": router}, hist) for router, hist in sorted(self.routers.items())])
+        histogram(f"{prefix}_handler_duration_seconds", "Handler time.",
+                  [({"router": router, "handler": handler}, hist)
+                   for (router, handler), hist in sorted(self.handlers.items())])
+
+        lines.append(f"# HELP {prefix}_handler_errors_total Exceptions raised by handlers.")
+        lines.append(f"# TYPE {prefix}_handler_errors_total counter")
+        for (router, handler, error), count in sorted(self.errors.items()):
+            lines.append(f"{prefix}_handler_errors_total{_labels(router=router, handler=handler, error=error)} {count}")
+        for collector in self._collectors:
+            lines.extend(collector.render_prometheus(prefix))
+        return "\n".join(lines) + "\n"
+
+    def log_summary(self, top: int = 10) -> None:
+        """Пишет в лог сводку: общие перцентили и самые медленные по p95 хэндлеры."""
+        for collector in self._collectors:
+            collector.log_summary()
+        quantiles = self.updates.quantiles()
+        if not quantiles:
+            printx.info(f"Метрики обновлений: обновлений еще не было, в работе {self.in_flight}.")
+            return
+        printx.info(
+            f"Метрики обновлений: всего {self.updates.count}, в работе {self.in_flight}, "
+            f"p50 {quantiles[0.5] * 1000:.1f} мс, p95 {quantiles[0.95] * 1000:.1f} мс, "
+            f"p99 {quantiles[0.99] * 1000:.1f} мс, ошибок {sum(self.errors.values())}, "
+            f"медленных {self.slow_updates}")
+        ranked = sorted(
+            ((hist.quantiles(), router, handler, hist.count) for (router, handler), hist in self.handlers.items()),
+            key=lambda item: item[0].get(0.95, 0.0), reverse=True)
+        for handler_quantiles, router, handler, count in ranked[:top]:
+            printx.info(
+                f"  {router}.{handler}: {count} вызовов, p50 {handler_quantiles[0.5] * 1000:.1f} мс, "
+                f"p95 {handler_quantiles[0.95] * 1000:.1f} мс, p99 {handler_quantiles[0.99] * 1000:.1f} мс")
+
+
+update_metrics = UpdateMetrics()
+
+
+class SlowUpdateProfiler:
+    """
+    Необязательный профилировщик медленных обновлений.
+
+    mode="stack": если обновление не завершилось за threshold секунд, в лог пишется стек
+    его задачи в этот момент - видно, где именно оно ждет. Стоит один таймер на обновление.
+    mode="cprofile": выбранное с вероятностью sample_rate обновление профилируется cProfile,
+    и если оно оказалось медленнее threshold, в лог пишутся top функций. Одновременно
+    профилируется не больше одного обновления; в профиль попадают и задачи, работавшие
+    параллельно в том же цикле событий, поэтому sample_rate стоит держать маленьким.
+    """
+
+    def __init__(self, threshold: float = 1.0, mode: str = "stack", sample_rate: float = 1.0, top: int = 25):
+        """
+        :param threshold: Порог медленного обновления, секунд.
+        :param mode: "stack" или "cprofile".
+        :param sample_rate: Доля обновлений, за которыми следит профилировщик (0..1).
+        :param top: Сколько функций cProfile выводить.
+        """
+        if mode not in ("stack", "cprofile"):
+            raise ValueError(f"Неизвестный режим профилировщика: {mode}")
+        self.threshold = threshold
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.top = top
+        self._profiling = False
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def start(self, update_id: Any) -> Any:
+        """Вызывается перед обработкой; возвращает токен для finish() или None, если обновление не выбрано."""
+        if not self.sampled():
+            return None
+        if self.mode == "stack":
+            task = asyncio.current_task()
+            if task is None:
+                return None
+            return asyncio.get_running_loop().call_later(self.threshold, self._dump_stack, task, update_id)
+        if self._profiling:
+            return None
+        self._profiling = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, token: Any, update_id: Any, elapsed: float) -> None:
+        if token is None:
+            return
+        if self.mode == "stack":
+            token.cancel()
+            return
+        token.disable()
+        self._profiling = False
+        if elapsed >= self.threshold:
+            output = io.StringIO()
+            pstats.Stats(token, stream=output).sort_stats("cumulative").print_stats(self.top)
+            printx.warning(f"Медленное обновление {update_id}: {elapsed * 1000:.0f} мс, профиль cProfile:\n"
+                           f"{output.getvalue()}")
+
+    def _dump_stack(self, task: asyncio.Task, update_id: Any) -> None:
+        if task.done():
+            return
+        printx.warning(f"Обновление {update_id} обрабатывается дольше {self.threshold * 1000:.0f} мс, "
+                       f"текущий стек:\n{''.join(_await_chain(task.get_coro()))}")
+
+
+def _await_chain(coro: Any) -> List[str]:
+    # Task.get_stack() для приостановленной корутины дает один кадр; идем по цепочке cr_await до места ожидания.
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is not None:
+            frames.append((frame, frame.f_lineno))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return traceback.format_list(traceback.StackSummary.extract(frames))
+
+
+async def log_update_metrics(interval: float = 60.0, metrics: UpdateMetrics = update_metrics) -> None:
+    """Фоновая задача: раз в interval секунд пишет в лог сводку метрик обновлений."""
+    while True:
+        await asyncio.sleep(interval)
+        metrics.log_summary()
+
+
+class StartupTimer:
+    """
+    Этапы запуска бота до готовности принимать обновления: после каждого этапа вызывается mark(),
+    на startup диспетчера - log_report(). Показывает, куда уходит время перезапуска.
+    :param started: Момент начала отсчета (time.perf_counter()); по умолчанию - создание таймера.
+    """
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = time.perf_counter() if started is None else started
+        self.phases: List[Tuple[str, float]] = []
+        self._last = self.started
+
+    def mark(self, phase: str) -> float:
+        """Завершает этап phase. :return: Его длительность, секунд."""
+        now = time.perf_counter()
+        elapsed, self._last = now - self._last, now
+        self.phases.append((phase, elapsed))
+        return elapsed
+
+    @property
+    def total(self) -> float:
+        return self._last - self.started
+
+    def report(self) -> str:
+        phases = ", ".join(f"{phase} {elapsed * 1000:.0f} мс" for phase, elapsed in self.phases)
+        return f"{self.total * 1000:.0f} мс ({phases})"
+
+    async def log_report(self, **kwargs: Any) -> None:
+        """Отмечает готовность и пишет отчет в лог (подходит как startup-хэндлер диспетчера)."""
+        self.mark("запуск диспетчера")
+        printx.info(f"Бот готов принимать обновления через {self.report()}")
@@ -0,0 +1,291 @@
+import asyncio
+import json
+import logging
+import math
+from decimal import ROUND_HALF_UP, Decimal
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiogram import Bot
+from aiogram.types import LabeledPrice, SuccessfulPayment
+from aiohttp import ClientError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.database import requests
+from app.services import ledger_service
+from app.services.referral_service import record_referral_topup
+from app.services.user_service import register_user
+
+if TYPE_CHECKING:
+    # aiocryptopay тянет aiohttp.web (~0.2 с) - импортируется, только когда CryptoBot настроен.
+    from aiocryptopay import AioCryptoPay
+    from aiocryptopay.models.invoice import Invoice
+    from aiohttp import web
+
+
+printx = logging.getLogger(__name__)
+
+CRYPTOBOT, STARS = "cryptobot", "stars"
+SIGNATURE_HEADER = "Crypto-Pay-Api-Signature"
+STARS_CURRENCY = "XTR"
+STARS_PAYLOAD_PREFIX = "topup:"
+CENT = Decimal("0.01")
+
+
+def topup_key(provider: str, external_id: str) -> str:
+    """Ключ идемпотентности зачисления пополнения: один платеж провайдера - одно зачисление."""
+    return f"topup:{provider}:{external_id}"
+
+
+class PaymentStats:
+    """Счетчики платежного сервиса для логов и бенчмарков."""
+
+    def __init__(self):
+        self.webhooks = 0
+        self.rejected_webhooks = 0
+        self.api_calls = 0
+        self.reconciled = 0
+        self.credited = 0
+        self.expired = 0
+
+
+class PaymentService:
+    """
+    Пополнение баланса через CryptoBot и Telegram Stars.
+
+    Оплата счета CryptoBot приходит вебхуком (handle_webhook на HTTP-сервере из app/server.py)
+    и подтверждается фоновой сверкой: ожидающие пополнения читаются keyset-пачками и
+    проверяются одним get_invoices(invoice_ids=[...]) на пачку, а не запросом на счет.
+    Хэндлеры не ждут оплату. Каждое пополнение зачисляется ровно один раз: условный перевод
+    top_ups.status из pending и запись в журнал баланса с ключом topup:<провайдер>:<id платежа>,
+    поэтому повтор вебхука, вебхук во время сверки или повтор successful_payment ничего не меняют.
+    """
+
+    def __init__(
+        self,
+        crypto: Optional["AioCryptoPay"],
+        factory: async_sessionmaker,
+        batch_size: int = 100,
+        reconcile_interval: float = 30.0,
+        invoice_ttl: int = 3600,
+        stars_per_usd: Optional[Decimal] = None
+    ):
+        """
+        :param crypto: Клиент Crypto Pay API; None - CryptoBot не настроен (только Stars).
+        :param factory: Фабрика сессий.
+        :param batch_size: Счетов в одном get_invoices при сверке (лимит API - 1000).
+        :param reconcile_interval: Период сверки ожидающих счетов, секунд.
+        :param invoice_ttl: Срок оплаты счета CryptoBot, секунд.
+        :param stars_per_usd: Курс Stars за доллар, установленный администратором; None - Stars отключены.
+        """
+        self.crypto = crypto
+        self.factory = factory
+        self.batch_size = batch_size
+        self.reconcile_interval = reconcile_interval
+        self.invoice_ttl = invoice_ttl
+        self.stars_per_usd = Decimal(str(stars_per_usd)) if stars_per_usd is not None else None
+        self.stats = PaymentStats()
+
+    # --- Зачисление ---
+
+    async def _settle(
+        self, session: AsyncSession, provider: str, statuses: Dict[str, str]
+    ) -> Tuple[int, int]:
+        """
+        Применяет статусы платежей провайдера к ожидающим пополнениям в транзакции session.
+        :param statuses: external_id -> "paid" или "expired" (остальные статусы пропускаются).
+        :return: (зачислено, истекло).
+        """
+        credited = expired = 0
+        rows = await requests.get_pending_topups(session, provider, list(statuses))
+        for topup_id, external_id, user_id, amount, referrer_id, has_user in rows:
+            status = statuses[external_id]
+            if status == "expired":
+                expired += await requests.set_topup_status(session, topup_id, "expired")
+                continue
+            if status != "paid" or not await requests.set_topup_status(session, topup_id, "paid"):
+                continue
+            if not has_user:
+                await register_user(session, user_id)
+            key = topup_key(provider, external_id)
+            if await ledger_service.credit(session, user_id, amount, ledger_service.TOPUP, key):
+                await record_referral_topup(session, referrer_id, amount, key)
+                credited += 1
+        return credited, expired
+
+    async def apply_invoices(self, invoices: Iterable["Invoice"]) -> int:
+        """Применяет статусы счетов CryptoBot одной транзакцией. :return: Сколько пополнений зачислено."""
+        statuses = {str(invoice.invoice_id): str(invoice.status) for invoice in invoices}
+        if not statuses:
+            return 0
+        async with self.factory() as session:
+            credited, expired = await self._settle(session, CRYPTOBOT, statuses)
+            await session.commit()
+        self.stats.credited += credited
+        self.stats.expired += expired
+        return credited
+
+    # --- CryptoBot ---
+
+    async def create_invoice(self, session: AsyncSession, user_id: int, amount: Decimal) -> "Invoice":
+        """
+        Создает счет CryptoBot на amount долларов и ожидающее пополнение в транзакции session
+        (коммит делает вызывающий). Пользователю отправляется invoice.bot_invoice_url.
+        """
+        if self.crypto is None:
+            raise RuntimeError("CryptoBot не настроен (config.CRYPTOBOT_TOKEN)")
+        self.stats.api_calls += 1
+        invoice = await self.crypto.create_invoice(
+            amount=float(amount), currency_type="fiat", fiat="USD", payload=str(user_id), expires_in=self.invoice_ttl)
+        await register_user(session, user_id)
+        await requests.insert_topup(session, user_id, CRYPTOBOT, str(invoice.invoice_id), amount)
+        return invoice
+
+    async def handle_webhook(self, request: "web.Request") -> "web.Response":
+        """
+        aiohttp-обработчик вебхука Crypto Pay: проверяет подпись и зачисляет оплаченный счет.
+        Ошибка БД - ответ 500, CryptoBot повторит доставку; повтор зачисления исключен ключом.
+        """
+        from aiocryptopay.models.update import Update as CryptoPayUpdate
+        from aiohttp import web
+
+        body = await request.text()
+        if self.crypto is None or not self.crypto.check_signature(body, request.headers.get(SIGNATURE_HEADER, "")):
+            self.stats.rejected_webhooks += 1
+            return web.Response(status=401, text="bad signature")
+        try:
+            update = CryptoPayUpdate(**json.loads(body))
+        except (ValueError, TypeError) as e:
+            self.stats.rejected_webhooks += 1
+            printx.warning(f"Некорректный вебхук CryptoBot: {e}")
+            return web.Response(status=400, text="bad update")
+        self.stats.webhooks += 1
+        if update.update_type == "invoice_paid":
+            try:
+                await self.apply_invoices([update.payload])
+            except Exception as e:
+                printx.exception(f"Не удалось зачислить счет CryptoBot {update.payload.invoice_id}: {e}")
+                return web.Response(status=500, text="retry later")
+        return web.Response(text="ok")
+
+    async def _fetch_invoices(self, invoice_ids: Sequence[int]) -> List["Invoice"]:
+        self.stats.api_calls += 1
+        invoices = await self.crypto.get_invoices(invoice_ids=list(invoice_ids), count=len(invoice_ids))
+        if invoices is None:
+            return []
+        return invoices if isinstance(invoices, list) else [invoices]
+
+    async def reconcile(self) -> int:
+        """
+        Сверяет все ожидающие счета CryptoBot: пачка id из БД -> один get_invoices -> одна транзакция
+        зачислений. Запрос следующей пачки к API идет, пока записывается предыдущая.
+        :return: Сколько счетов проверено.
+        """
+        if self.crypto is None:
+            return 0
+        checked, after_id = 0, 0
+        pending_write: Optional[asyncio.Task] = None
+        try:
+            while True:
+                async with self.factory() as session:
+                    batch = await requests.list_pending_topups(session, CRYPTOBOT, after_id, self.batch_size)
+                if not batch:
+                    break
+                after_id = batch[-1][0]
+                invoices = await self._fetch_invoices([int(external_id) for _, external_id in batch])
+                if pending_write is not None:
+                    await pending_write
+                pending_write = asyncio.create_task(self.apply_invoices(invoices))
+                checked += len(batch)
+        except BaseException:
+            if pending_write is not None:
+                # Запись предыдущей пачки доводим до конца, но ее ошибка не должна скрыть исходную.
+                (write_result,) = await asyncio.gather(pending_write, return_exceptions=True)
+                if isinstance(write_result, BaseException):
+                    printx.error(f"Ошибка записи пачки счетов CryptoBot: {write_result!r}", exc_info=write_result)
+            raise
+        if pending_write is not None:
+            await pending_write
+        self.stats.reconciled += checked
+        return checked
+
+    # --- Telegram Stars ---
+
+    def stars_for(self, amount: Decimal) -> int:
+        """Сколько Stars стоит пополнение на amount долларов (с округлением вверх)."""
+        if self.stars_per_usd is None:
+            raise RuntimeError("Курс Stars не установлен (config.STARS_PER_USD)")
+        return math.ceil(amount * self.stars_per_usd)
+
+    async def send_stars_invoice(self, bot: Bot, chat_id: int, amount: Decimal, title: str, description: str) -> None:
+        """Отправляет счет в Stars; сумма в долларах зашита в payload и не зависит от смены курса до оплаты."""
+        await bot.send_invoice(
+            chat_id=chat_id, title=title, description=description,
+            payload=f"{STARS_PAYLOAD_PREFIX}{amount}", currency=STARS_CURRENCY,
+            prices=[LabeledPrice(label=title, amount=self.stars_for(amount))])
+
+    @staticmethod
+    def is_stars_topup(payload: str) -> bool:
+        return payload.startswith(STARS_PAYLOAD_PREFIX)
+
+    async def credit_stars_payment(self, session: AsyncSession, user_id: int, payment: SuccessfulPayment) -> Optional[Decimal]:
+        """
+        Зачисляет оплату Stars в транзакции session (коммит делает вызывающий).
+        Ключ - telegram_payment_charge_id: повтор обновления с successful_payment ничего не меняет.
+        Telegram не доставляет successful_payment повторно, поэтому строка пользователя создается,
+        если ее еще нет, а неудачное зачисление пишется в лог со всеми данными платежа для ручного зачисления.
+        :return: Зачисленная сумма в долларах или None, если платеж уже зачислен.
+        """
+        if payment.currency != STARS_CURRENCY or not self.is_stars_topup(payment.invoice_payload):
+            raise ValueError(f"Неизвестный платеж: {payment.currency} {payment.invoice_payload}")
+        amount = Decimal(payment.invoice_payload[len(STARS_PAYLOAD_PREFIX):]).quantize(CENT, rounding=ROUND_HALF_UP)
+        charge_id = payment.telegram_payment_charge_id
+        try:
+            await register_user(session, user_id)
+            await requests.insert_topup(session, user_id, STARS, charge_id, amount)
+            credited, _ = await self._settle(session, STARS, {charge_id: "paid"})
+        except Exception:
+            printx.exception(
+                f"Оплата Stars не зачислена: пользователь {user_id}, charge_id {charge_id}, "
+                f"{payment.total_amount} {STARS_CURRENCY}, ${amount}")
+            raise
+        self.stats.credited += credited
+        return amount if credited else None
+
+    # --- Фоновая сверка ---
+
+    async def run(self) -> None:
+        """Фоновая задача: раз в reconcile_interval секунд сверяет ожидающие счета CryptoBot."""
+        from aiocryptopay.exceptions import CryptoPayAPIError
+
+        while True:
+            try:
+                checked = await self.reconcile()
+                if checked:
+                    printx.debug(f"Сверка счетов CryptoBot: проверено {checked}, всего зачислено {self.stats.credited}")
+            except (CryptoPayAPIError, ClientError, asyncio.TimeoutError) as e:
+                printx.warning(f"CryptoBot недоступен при сверке счетов: {e}")
+            except Exception as e:
+                printx.exception(f"Ошибка сверки счетов CryptoBot: {e}")
+            await asyncio.sleep(self.reconcile_interval)
+
+    async def close(self) -> None:
+        """Закрывает HTTP-сессию Crypto Pay (shutdown-хэндлер диспетчера, после остановки run)."""
+        if self.crypto is not None:
+            await self.crypto.close()
+
+
+def create_payment_service(factory: async_sessionmaker, config: Any) -> PaymentService:
+    """Платежный сервис по настройкам config (CRYPTOBOT_TOKEN, CRYPTOBOT_NETWORK, STARS_PER_USD, ...)."""
+    token = getattr(config, "CRYPTOBOT_TOKEN", None)
+    crypto = None
+    if token:
+        from aiocryptopay import AioCryptoPay
+        crypto = AioCryptoPay(token, network=getattr(config, "CRYPTOBOT_NETWORK", "https://pay.crypt.bot"))
+    return PaymentService(
+        crypto,
+        factory,
+        batch_size=getattr(config, "CRYPTOBOT_RECONCILE_BATCH", 100),
+        reconcile_interval=getattr(config, "CRYPTOBOT_RECONCILE_INTERVAL", 30.0),
+        invoice_ttl=getattr(config, "CRYPTOBOT_INVOICE_TTL", 3600),
+        stars_per_usd=getattr(config, "STARS_PER_USD", None),
+    )
@@ -0,0 +1,262 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.database import requests
+from app.services import ledger_service
+
+
+printx = logging.getLogger(__name__)
+
+CENT = Decimal("0.01")
+
+# Виды промокодов.
+BALANCE, PRODUCT, DISCOUNT, TOPUP_BONUS = "balance", "product", "discount", "topup_bonus"
+
+# Причины отказа; текст - в локализации по ключу promo.errors.<причина>.
+NOT_FOUND, EXPIRED, ALREADY_USED, EXHAUSTED = "not_found", "expired", "already_used", "exhausted"
+
+
+class PromoRejected(Exception):
+    """Промокод не активирован; reason - одна из NOT_FOUND, EXPIRED, ALREADY_USED, EXHAUSTED."""
+
+    def __init__(self, code: str, reason: str):
+        super().__init__(f"Промокод {code} не активирован: {reason}")
+        self.code = code
+        self.reason = reason
+
+    @property
+    def text_key(self) -> str:
+        return f"promo.errors.{self.reason}"
+
+
+def normalize_code(code: str) -> str:
+    return code.strip().upper()
+
+
+class Promo:
+    """
+    Промокод в индексе: все, что нужно для активации и расчета цены, без обращения к БД.
+    product_ids/category_ids - цели скидки (пустые - скидка на все товары).
+    full_shards - шарды счетчика, которые этот процесс видел исчерпанными; exhausted - исчерпаны все.
+    """
+
+    __slots__ = ("id", "code", "kind", "value", "product_id", "variant_id", "max_uses", "expires_at",
+                 "product_ids", "category_ids", "shards", "full_shards", "exhausted")
+
+    def __init__(self, id: int, code: str, kind: str, value: Decimal, product_id: Optional[int],
+                 variant_id: Optional[int], max_uses: Optional[int], expires_at: Optional[datetime],
+                 product_ids: FrozenSet[int] = frozenset(), category_ids: FrozenSet[int] = frozenset(),
+                 shards: Tuple[int, ...] = (), full_shards: Iterable[int] = ()):
+        self.id = id
+        self.code = code
+        self.kind = kind
+        self.value = value
+        self.product_id = product_id
+        self.variant_id = variant_id
+        self.max_uses = max_uses
+        self.expires_at = expires_at
+        self.product_ids = product_ids
+        self.category_ids = category_ids
+        self.shards = shards
+        self.full_shards: Set[int] = set(full_shards)
+        self.exhausted = bool(shards) and len(self.full_shards) == len(shards)
+
+    def expired(self, now: datetime) -> bool:
+        return self.expires_at is not None and self.expires_at <= now
+
+    def applies_to(self, product_id: int, category_id: Optional[int]) -> bool:
+        """Действует ли скидка на товар: две проверки по множествам, без запросов."""
+        if not self.product_ids and not self.category_ids:
+            return True
+        return product_id in self.product_ids or category_id in self.category_ids
+
+    def price(self, price: Decimal, product_id: int, category_id: Optional[int]) -> Decimal:
+        """Цена товара со скидкой промокода (для kind == "discount"; иначе цена без изменений)."""
+        if self.kind != DISCOUNT or not self.applies_to(product_id, category_id):
+            return price
+        return (price * (1 - self.value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+    def prices(self, items: Iterable[Tuple[int, Optional[int], Decimal]]) -> List[Decimal]:
+        """Цены корзины со скидкой. :param items: (product_id, category_id, цена)."""
+        return [self.price(price, product_id, category_id) for product_id, category_id, price in items]
+
+    def bonus(self, amount: Decimal) -> Decimal:
+        """Бонус к пополнению на amount (для kind == "topup_bonus")."""
+        if self.kind != TOPUP_BONUS:
+            return Decimal("0")
+        return (amount * self.value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+class PromoIndex:
+    """
+    Активные промокоды в памяти процесса: код -> Promo.
+
+    Загружается из БД целиком (три запроса) при старте и периодически - чтобы увидеть изменения
+    из других процессов; новая версия собирается в стороне и подменяет словарь одной операцией.
+    Изменения этого процесса (create_promo, deactivate_promo) попадают в индекс сразу после commit.
+    """
+
+    def __init__(self):
+        self._promos: Dict[str, Promo] = {}
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self._promos)
+
+    def get(self, code: str) -> Optional[Promo]:
+        return self._promos.get(normalize_code(code))
+
+    def replace(self, promos: Iterable[Promo]) -> None:
+        self._promos = {promo.code: promo for promo in promos}
+        self.version += 1
+
+    def put(self, promo: Promo) -> None:
+        self._promos[promo.code] = promo
+        self.version += 1
+
+    def discard(self, promo_id: int) -> None:
+        for code, promo in list(self._promos.items()):
+            if promo.id == promo_id:
+                del self._promos[code]
+                self.version += 1
+
+    async def reload(self, factory: async_sessionmaker) -> int:
+        """Перечитывает активные промокоды из БД. :return: Их число."""
+        async with factory() as session:
+            rows, targets, counters = await requests.list_active_promo_codes(session)
+        products: Dict[int, Set[int]] = {}
+        categories: Dict[int, Set[int]] = {}
+        for promo_id, product_id, category_id in targets:
+            if product_id is not None:
+                products.setdefault(promo_id, set()).add(product_id)
+            if category_id is not None:
+                categories.setdefault(promo_id, set()).add(category_id)
+        shards: Dict[int, List[int]] = {}
+        full: Dict[int, List[int]] = {}
+        for promo_id, shard, used, cap in counters:
+            shards.setdefault(promo_id, []).append(shard)
+            if used >= cap:
+                full.setdefault(promo_id, []).append(shard)
+        self.replace(
+            Promo(row.id, normalize_code(row.code), row.kind, row.value, row.product_id, row.variant_id,
+                  row.max_uses, row.expires_at, frozenset(products.get(row.id, ())),
+                  frozenset(categories.get(row.id, ())), tuple(sorted(shards.get(row.id, ()))),
+                  full.get(row.id, ()))
+            for row in rows)
+        return len(self)
+
+
+promo_index = PromoIndex()
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+async def _take_usage(session: AsyncSession, promo: Promo, user_id: int) -> bool:
+    """
+    Занимает активацию в одном из шардов счетчика. Начальный шард выбирается по пользователю,
+    поэтому одновременные активации расходятся по разным строкам; известные исчерпанные шарды пропускаются.
+    """
+    shards = promo.shards
+    start = user_id % len(shards)
+    for offset in range(len(shards)):
+        shard = shards[(start + offset) % len(shards)]
+        if shard in promo.full_shards:
+            continue
+        if await requests.increment_promo_counter(session, promo.id, shard):
+            return True
+        promo.full_shards.add(shard)
+    promo.exhausted = len(promo.full_shards) == len(shards)
+    return False
+
+
+async def redeem(session: AsyncSession, code: str, user_id: int, index: PromoIndex = promo_index) -> Promo:
+    """
+    Активирует промокод: проверки по индексу без БД, затем запись активации (один раз на пользователя),
+    условное увеличение шарда счетчика и эффект кода - зачисление на баланс через журнал или выдача товара.
+    Скидку и бонус к пополнению применяет вызывающий через Promo.price/Promo.bonus в той же транзакции.
+    Коммит делает вызывающий (DatabaseMiddleware).
+    :raises PromoRejected: Код не найден, истек, уже активирован пользователем или исчерпан.
+    """
+    promo = index.get(code)
+    if promo is None:
+        raise PromoRejected(code, NOT_FOUND)
+    if promo.expired(_utcnow()):
+        raise PromoRejected(code, EXPIRED)
+    if promo.exhausted:
+        # Исчерпанный код отклоняется без запросов - основная нагрузка пика кампании.
+        raise PromoRejected(code, EXHAUSTED)
+    # Пока активация ждала соединение из пула, другие могли исчерпать код - проверяем еще раз.
+    await session.connection()
+    if promo.exhausted:
+        raise PromoRejected(code, EXHAUSTED)
+    if not await requests.insert_promo_redemption(session, promo.id, user_id):
+        raise PromoRejected(code, ALREADY_USED)
+    if promo.shards and not await _take_usage(session, promo, user_id):
+        await requests.delete_promo_redemption(session, promo.id, user_id)
+        raise PromoRejected(code, EXHAUSTED)
+
+    if promo.kind == BALANCE:
+        await ledger_service.credit(session, user_id, promo.value, ledger_service.PROMO, f"promo:{promo.id}:{user_id}")
+    elif promo.kind == PRODUCT:
+        await requests.bulk_insert_purchases(session, [{
+            "user_id": user_id, "product_id": promo.product_id, "variant_id": promo.variant_id,
+            "seller_id": None, "price": Decimal("0")}])
+    return promo
+
+
+async def create_promo(
+    session: AsyncSession,
+    code: str,
+    kind: str,
+    value: Decimal = Decimal("0"),
+    max_uses: Optional[int] = None,
+    expires_at: Optional[datetime] = None,
+    product_id: Optional[int] = None,
+    variant_id: Optional[int] = None,
+    target_product_ids: Iterable[int] = (),
+    target_category_ids: Iterable[int] = (),
+    shards: int = 16,
+    index: PromoIndex = promo_index
+) -> Promo:
+    """
+    Создает промокод (панель владельца) и после commit сразу добавляет его в индекс.
+    :param shards: На сколько строк счетчика разбить max_uses - больше шардов, меньше конкуренции за строку.
+    """
+    code = normalize_code(code)
+    target_product_ids, target_category_ids = frozenset(target_product_ids), frozenset(target_category_ids)
+    row = await requests.create_promo_code(
+        session, code, kind, value, max_uses, expires_at, product_id, variant_id,
+        sorted(target_product_ids), sorted(target_category_ids), shards)
+    shard_count = max(1, min(shards, max_uses)) if max_uses is not None else 0
+    await session.commit()
+    promo = Promo(row.id, code, kind, value, product_id, variant_id, max_uses, expires_at,
+                  target_product_ids, target_category_ids, tuple(range(shard_count)))
+    index.put(promo)
+    return promo
+
+
+async def deactivate_promo(session: AsyncSession, promo_id: int, index: PromoIndex = promo_index) -> bool:
+    """Отключает промокод: is_active=False в БД и удаление из индекса после commit."""
+    found = await requests.set_promo_active(session, promo_id, False)
+    await session.commit()
+    index.discard(promo_id)
+    return found
+
+
+async def refresh_promo_index(factory: async_sessionmaker, interval: float = 60.0,
+                              index: PromoIndex = promo_index) -> None:
+    """Фоновая задача: загружает промокоды при старте и перечитывает их раз в interval секунд."""
+    while True:
+        try:
+            count = await index.reload(factory)
+            printx.debug(f"Индекс промокодов обновлен: {count}")
+        except Exception as e:
+            printx.warning(f"Не удалось обновить индекс промокодов: {e}")
+        await asyncio.sleep(interval)
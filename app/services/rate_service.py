@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import time
+from decimal import ROUND_HALF_UP, Decimal
+from typing import TYPE_CHECKING, Iterable, List, Optional
+
+from app import config
+
+if TYPE_CHECKING:
+    import httpx
+
+
+printx = logging.getLogger(__name__)
+
+CBR_DAILY_URL = "https://www.cbr-xml-daily.ru/daily_json.js"
+CENT = Decimal("0.01")
+
+
+class RateSourceError(Exception):
+    """Источник курса недоступен или вернул некорректный ответ."""
+
+
+class Quote:
+    """Курс: сколько рублей стоит один доллар, и когда он получен."""
+
+    __slots__ = ("rub_per_usd", "usd_per_rub", "fetched_at", "source")
+
+    def __init__(self, rub_per_usd: Decimal, fetched_at: float, source: str):
+        self.rub_per_usd = rub_per_usd
+        self.usd_per_rub = 1 / rub_per_usd
+        self.fetched_at = fetched_at
+        self.source = source
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+
+def parse_cbr_daily(payload: dict) -> Decimal:
+    """Достает курс USD из ответа cbr-xml-daily.ru (Valute.USD.Value за Nominal единиц)."""
+    try:
+        usd = payload["Valute"]["USD"]
+        rate = Decimal(str(usd["Value"])) / Decimal(str(usd.get("Nominal", 1)))
+    except (KeyError, TypeError, ArithmeticError) as e:
+        raise RateSourceError(f"Некорректный ответ источника курса: {e}") from e
+    if rate <= 0:
+        raise RateSourceError(f"Некорректный курс: {rate}")
+    return rate
+
+
+class RateService:
+    """
+    Курс RUB/USD с фоновым обновлением.
+
+    Одна фоновая задача (run) раз в refresh_interval запрашивает курс через общий
+    httpx.AsyncClient с пулом соединений. Чтение курса (quote, convert) не ждет сеть и
+    не берет блокировок: текущий Quote - неизменяемый объект, который обновление заменяет
+    целиком. Если курс устарел, читатель получает старое значение, а обновление запускается
+    в фоне (stale-while-revalidate); если источник недоступен, остается последний удачный курс.
+    """
+
+    def __init__(
+        self,
+        url: str = CBR_DAILY_URL,
+        refresh_interval: float = 3600.0,
+        timeout: float = 10.0,
+        fallback_rate: Optional[Decimal] = None,
+        transport: Optional["httpx.AsyncBaseTransport"] = None
+    ):
+        """
+        :param url: Адрес JSON с курсами ЦБ РФ.
+        :param refresh_interval: Период обновления и возраст, после которого курс считается устаревшим, секунд.
+        :param timeout: Таймаут запроса к источнику, секунд.
+        :param fallback_rate: Курс до первого удачного запроса (например, из config); None - курса нет.
+        :param transport: Транспорт httpx (для тестов - httpx.MockTransport вместо реального ЦБ).
+        """
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.transport = transport
+        self.refreshes = 0
+        self.failures = 0
+        self.quote: Optional[Quote] = (
+            Quote(Decimal(str(fallback_rate)), 0.0, "fallback") if fallback_rate is not None else None)
+        self._client: Optional["httpx.AsyncClient"] = None
+        self._refreshing: Optional[asyncio.Task] = None
+        self._runner: Optional[asyncio.Task] = None
+
+    def _get_client(self) -> "httpx.AsyncClient":
+        if self._client is None:
+            import httpx  # Импорт httpx (~0.1 с) - при первом запросе курса, а не при старте бота
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                transport=self.transport,
+                limits=httpx.Limits(max_connections=4, max_keepalive_connections=2),
+            )
+        return self._client
+
+    async def fetch(self) -> Decimal:
+        """Запрашивает курс у источника. :raises RateSourceError: при сетевой ошибке или плохом ответе."""
+        import httpx
+        try:
+            response = await self._get_client().get(self.url)
+            response.raise_for_status()
+            payload = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise RateSourceError(f"Источник курса недоступен: {e}") from e
+        return parse_cbr_daily(payload)
+
+    async def refresh(self) -> bool:
+        """
+        Обновляет курс; при ошибке оставляет последний удачный.
+        :return: True, если курс обновлен.
+        """
+        try:
+            rate = await self.fetch()
+        except RateSourceError as e:
+            self.failures += 1
+            last = self.quote
+            printx.warning(f"{e}. Используется последний курс: "
+                           f"{last.rub_per_usd if last is not None else 'нет'}")
+            return False
+        self.quote = Quote(rate, time.time(), self.url)
+        self.refreshes += 1
+        printx.info(f"Курс обновлен: 1 USD = {rate} RUB")
+        return True
+
+    def refresh_in_background(self) -> asyncio.Task:
+        """Запускает обновление, если оно еще не идет; одновременные вызовы получают одну задачу."""
+        task = self._refreshing
+        if task is None or task.done():
+            task = self._refreshing = asyncio.create_task(self.refresh())
+        return task
+
+    def current(self) -> Optional[Quote]:
+        """
+        Текущий курс без ожидания сети. Устаревший курс возвращается как есть,
+        а его обновление запускается в фоне (нужен работающий цикл событий).
+        """
+        quote = self.quote
+        if quote is None or quote.age > self.refresh_interval:
+            self.refresh_in_background()
+        return quote
+
+    def usd_to_rub(self, amounts: Iterable[Decimal]) -> List[Optional[Decimal]]:
+        """
+        Переводит суммы в долларах в рубли одним курсом для всего списка (экраны истории).
+        :return: Суммы в рублях с округлением до копеек; None для всех, если курса еще нет.
+        """
+        return self._convert(amounts, "rub_per_usd")
+
+    def rub_to_usd(self, amounts: Iterable[Decimal]) -> List[Optional[Decimal]]:
+        """Переводит суммы в рублях в доллары; см. usd_to_rub."""
+        return self._convert(amounts, "usd_per_rub")
+
+    def _convert(self, amounts: Iterable[Decimal], factor_name: str) -> List[Optional[Decimal]]:
+        quote = self.current()
+        if quote is None:
+            return [None for _ in amounts]
+        factor = getattr(quote, factor_name)
+        # Курс читается один раз, quantize и округление связываются локально - цикл без обращений к атрибутам.
+        quantize, cent, rounding = Decimal.quantize, CENT, ROUND_HALF_UP
+        return [quantize(amount * factor, cent, rounding) for amount in amounts]
+
+    async def run(self) -> None:
+        """Фоновая задача обновления курса; после ошибки повторяет чаще, чем раз в refresh_interval."""
+        retry_delay = 30.0
+        while True:
+            if await self.refresh():
+                retry_delay = 30.0
+                delay = self.refresh_interval
+            else:
+                delay = min(retry_delay, self.refresh_interval)
+                retry_delay *= 2
+            await asyncio.sleep(delay)
+
+    async def start(self) -> None:
+        """Запускает фоновое обновление (startup-хэндлер диспетчера)."""
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        """Останавливает обновление и закрывает HTTP-клиент (shutdown-хэндлер диспетчера)."""
+        for task in (self._runner, self._refreshing):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._runner = self._refreshing = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+rate_service = RateService(
+    url=getattr(config, "RATE_SOURCE_URL", CBR_DAILY_URL),
+    refresh_interval=getattr(config, "RATE_REFRESH_INTERVAL", 3600.0),
+    fallback_rate=getattr(config, "RATE_FALLBACK_RUB_PER_USD", None),
+)
@@ -0,0 +1,147 @@
+import logging
+from decimal import ROUND_HALF_UP, Decimal
+from typing import List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.database import requests
+from app.services import ledger_service
+
+
+printx = logging.getLogger(__name__)
+
+CENT = Decimal("0.01")
+
+
+class ReferralTier(NamedTuple):
+    """
+    Уровень реферальной программы.
+    Уровень достигнут, если рефералов не меньше min_referrals и сумма их пополнений больше min_topups.
+    """
+    level: int
+    percent: Decimal
+    min_referrals: int
+    min_topups: Optional[Decimal]
+    discount: Decimal = Decimal("0")
+
+    @property
+    def name_key(self) -> str:
+        return f"referral.tiers.{self.level}"
+
+
+# Уровни из README, от высшего к низшему: evaluate_tier проверяет не больше пяти условий.
+REFERRAL_TIERS: Tuple[ReferralTier, ...] = (
+    ReferralTier(5, Decimal("0.20"), 50, Decimal("150"), discount=Decimal("0.25")),
+    ReferralTier(4, Decimal("0.15"), 20, Decimal("50")),
+    ReferralTier(3, Decimal("0.10"), 10, Decimal("30")),
+    ReferralTier(2, Decimal("0.05"), 5, Decimal("10")),
+    ReferralTier(1, Decimal("0.03"), 0, None),
+)
+
+
+def evaluate_tier(referral_count: int, topup_total: Decimal) -> ReferralTier:
+    """
+    Уровень по денормализованным агрегатам пригласившего, O(1): без COUNT/SUM по рефералам.
+    :param referral_count: User.referral_count.
+    :param topup_total: User.referral_topup_total.
+    """
+    for tier in REFERRAL_TIERS:
+        if referral_count >= tier.min_referrals and (tier.min_topups is None or topup_total > tier.min_topups):
+            return tier
+    return REFERRAL_TIERS[-1]
+
+
+async def register_referral(session: AsyncSession, user_id: int, referrer_id: int) -> bool:
+    """
+    Привязывает нового пользователя к пригласившему (по ссылке /start ref_<id>).
+    Коммит делает вызывающий (DatabaseMiddleware).
+    :return: True, если привязка выполнена.
+    """
+    return await requests.set_referrer(session, user_id, referrer_id)
+
+
+async def record_referral_topup(
+    session: AsyncSession, referrer_id: Optional[int], amount: Decimal, key: str
+) -> Optional[Decimal]:
+    """
+    Учитывает оплаченное пополнение реферала: обновляет агрегат пригласившего и начисляет
+    ему бонус по уровню с учетом этого пополнения через журнал баланса. Несколько точечных
+    запросов по первичному ключу в транзакции пополнения, независимо от числа рефералов.
+    :param referrer_id: User.referrer_id пополнившего; None - пополнение без реферальной программы.
+    :param amount: Сумма пополнения в долларах.
+    :param key: Ключ идемпотентности пополнения; бонус записывается с ключом referral:<key>.
+    :return: Начисленный бонус или None, если начислять некому.
+    """
+    if referrer_id is None:
+        return None
+    aggregates = await requests.add_referral_topup(session, referrer_id, amount)
+    if aggregates is None:
+        return None
+    tier = evaluate_tier(*aggregates)
+    bonus = (amount * tier.percent).quantize(CENT, rounding=ROUND_HALF_UP)
+    if bonus > 0:
+        await ledger_service.credit(session, referrer_id, bonus, ledger_service.REFERRAL, f"referral:{key}")
+        await requests.add_referral_earned(session, referrer_id, bonus)
+    return bonus
+
+
+class ReconciliationReport:
+    """Итог сверки агрегатов: сколько пользователей проверено и у скольких агрегаты разошлись."""
+
+    def __init__(self):
+        self.checked = 0
+        self.drifted = 0
+        self.count_drift = 0
+        self.total_drift = Decimal("0")
+        self.samples: List[Tuple[int, int, Decimal, int, Decimal]] = []
+
+    def add(self, user_id: int, stored: Tuple[int, Decimal], actual: Tuple[int, Decimal], max_samples: int) -> None:
+        self.drifted += 1
+        self.count_drift += abs(actual[0] - stored[0])
+        self.total_drift += abs(actual[1] - stored[1])
+        if len(self.samples) < max_samples:
+            self.samples.append((user_id, stored[0], stored[1], actual[0], actual[1]))
+
+
+async def reconcile_referral_aggregates(
+    factory: async_sessionmaker,
+    batch_size: int = 1000,
+    fix: bool = True,
+    max_samples: int = 20
+) -> ReconciliationReport:
+    """
+    Пакетная сверка денормализованных агрегатов с пересчетом из users и top_ups.
+    Пользователи читаются keyset-пачками, каждая пачка сверяется и исправляется в своей
+    короткой транзакции, чтобы не держать блокировки на всю таблицу. Исправление пишется
+    разницей, а не абсолютным значением: инкременты add_referral_topup, зафиксированные
+    между чтением пачки и записью, сохраняются.
+    :param factory: Фабрика сессий.
+    :param batch_size: Пользователей в пачке.
+    :param fix: Записать пересчитанные значения; False - только отчет.
+    :param max_samples: Сколько расхождений сохранить в отчете для лога.
+    """
+    report = ReconciliationReport()
+    after_id = 0
+    while True:
+        async with factory() as session:
+            rows = await requests.list_referral_aggregates(session, after_id, batch_size)
+            if not rows:
+                break
+            fixes = []
+            for user_id, count, total, actual_count, actual_total in rows:
+                if (count, total) != (actual_count, actual_total):
+                    report.add(user_id, (count, total), (actual_count, actual_total), max_samples)
+                    fixes.append({"user_id": user_id, "count_delta": actual_count - count,
+                                  "total_delta": actual_total - total})
+            if fix and fixes:
+                await requests.adjust_referral_aggregates(session, fixes)
+                await session.commit()
+        report.checked += len(rows)
+        after_id = rows[-1][0]
+
+    level = logging.WARNING if report.drifted else logging.INFO
+    printx.log(level, f"Сверка реферальных агрегатов: проверено {report.checked}, расхождений {report.drifted} "
+                      f"(рефералов {report.count_drift}, сумма ${report.total_drift}){', исправлено' if fix and report.drifted else ''}")
+    for user_id, count, total, actual_count, actual_total in report.samples:
+        printx.debug(f"  пользователь {user_id}: было {count} / ${total}, стало {actual_count} / ${actual_total}")
+    return report
@@ -0,0 +1,356 @@
+import heapq
+import logging
+import re
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.database import requests
+from app.keyboards.keyboard_wrapper import CATALOG_MENU, ButtonData, PageSource, PageWindow, keyboard_cache
+
+
+printx = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Вес совпадения по полю товара и по способу совпадения слова запроса.
+TITLE_WEIGHT, CATEGORY_WEIGHT, DESCRIPTION_WEIGHT = 3, 2, 1
+EXACT_MATCH, PREFIX_MATCH, FUZZY_MATCH = 1.0, 0.8, 0.6
+
+
+def tokenize(text: str) -> List[str]:
+    """Слова текста в нижнем регистре, "ё" приравнена к "е"."""
+    return TOKEN_RE.findall(text.lower().replace("ё", "е"))
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchDocument:
+    """Товар в индексе: то, что нужно для фильтров и текста кнопки, без обращения к БД."""
+
+    __slots__ = ("product_id", "title", "category_id", "seller_id", "tokens")
+
+    def __init__(self, product_id: int, title: str, category_id: Optional[int], seller_id: Optional[int],
+                 tokens: Dict[str, int]):
+        self.product_id = product_id
+        self.title = title
+        self.category_id = category_id
+        self.seller_id = seller_id
+        self.tokens = tokens
+
+
+class CatalogSearchIndex:
+    """
+    Поисковый индекс каталога и маркетплейса в памяти процесса.
+
+    - инвертированный индекс: слово -> {product_id: вес поля} (название, категория, описание);
+    - префиксное дерево по словарю: последнее слово запроса ищется как префикс ("vp" -> "vpn");
+    - триграммы по словарю: слова с опечатками ("netflx" -> "netflix") находятся по доле общих триграмм.
+
+    Все слова запроса должны совпасть (AND), результат упорядочен по сумме весов.
+    Индекс обновляется по одному товару (add/remove) и перестраивается целиком (rebuild_index);
+    изменения, сделанные во время перестройки, записываются и применяются к новому индексу перед подменой.
+    """
+
+    def __init__(self, max_prefix_expansions: int = 64, fuzzy_threshold: float = 0.45,
+                 max_fuzzy_expansions: int = 8, result_cache_size: int = 256):
+        """
+        :param max_prefix_expansions: Сколько слов словаря максимум подставлять вместо префикса.
+        :param fuzzy_threshold: Минимальное сходство по триграммам (коэффициент Дайса, 0..1).
+        :param max_fuzzy_expansions: Сколько похожих слов максимум подставлять вместо слова с опечаткой.
+        :param result_cache_size: Сколько последних запросов хранить для листания страниц.
+        """
+        self.max_prefix_expansions = max_prefix_expansions
+        self.fuzzy_threshold = fuzzy_threshold
+        self.max_fuzzy_expansions = max_fuzzy_expansions
+        self.result_cache_size = result_cache_size
+        self.version = 0
+        self._docs: Dict[int, SearchDocument] = {}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._trie: Dict[str, Any] = {}
+        self._trigrams: Dict[str, Set[str]] = {}
+        self._results: "OrderedDict[Tuple, List[int]]" = OrderedDict()
+        # Журналы идущих перестроек: add/remove дописывают в каждый (имя метода, аргументы).
+        self._rebuild_logs: List[List[Tuple[str, tuple]]] = []
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def __contains__(self, product_id: int) -> bool:
+        return product_id in self._docs
+
+    # --- Изменение индекса ---
+
+    def add(self, product_id: int, title: str, description: str = "", category: str = "",
+            category_id: Optional[int] = None, seller_id: Optional[int] = None) -> None:
+        """Добавляет товар или заменяет уже проиндексированный."""
+        self._log("add", (product_id, title, description, category, category_id, seller_id))
+        if product_id in self._docs:
+            self._remove(product_id)
+        tokens: Dict[str, int] = {}
+        for text, weight in ((description, DESCRIPTION_WEIGHT), (category, CATEGORY_WEIGHT), (title, TITLE_WEIGHT)):
+            for token in tokenize(text):
+                if tokens.get(token, 0) < weight:
+                    tokens[token] = weight
+        self._docs[product_id] = SearchDocument(product_id, title, category_id, seller_id, tokens)
+        for token, weight in tokens.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                self._add_to_vocabulary(token)
+            posting[product_id] = weight
+        self._changed()
+
+    def remove(self, product_id: int) -> bool:
+        """Убирает товар из индекса. :return: True, если он был проиндексирован."""
+        self._log("remove", (product_id,))
+        return self._remove(product_id)
+
+    def _remove(self, product_id: int) -> bool:
+        doc = self._docs.pop(product_id, None)
+        if doc is None:
+            return False
+        for token in doc.tokens:
+            posting = self._postings[token]
+            del posting[product_id]
+            if not posting:
+                del self._postings[token]
+                self._remove_from_vocabulary(token)
+        self._changed()
+        return True
+
+    def replace_with(self, other: "CatalogSearchIndex") -> None:
+        """Атомарно подменяет содержимое индексом, собранным в стороне (полная перестройка)."""
+        self._docs, self._postings, self._trie, self._trigrams = (
+            other._docs, other._postings, other._trie, other._trigrams)
+        self._changed()
+
+    def begin_rebuild(self) -> List[Tuple[str, tuple]]:
+        """Начинает запись изменений на время перестройки. :return: Журнал для replay_changes и end_rebuild."""
+        log: List[Tuple[str, tuple]] = []
+        self._rebuild_logs.append(log)
+        return log
+
+    def end_rebuild(self, log: List[Tuple[str, tuple]]) -> None:
+        self._rebuild_logs.remove(log)
+
+    @staticmethod
+    def replay_changes(log: List[Tuple[str, tuple]], target: "CatalogSearchIndex") -> None:
+        """Повторяет записанные изменения на target в исходном порядке."""
+        for method, args in log:
+            getattr(target, method)(*args)
+
+    def _log(self, method: str, args: tuple) -> None:
+        for log in self._rebuild_logs:
+            log.append((method, args))
+
+    def _changed(self) -> None:
+        self.version += 1
+        if self._results:
+            self._results = OrderedDict()
+
+    def _add_to_vocabulary(self, token: str) -> None:
+        node = self._trie
+        for char in token:
+            node = node.setdefault(char, {})
+        node[""] = token
+        for trigram in trigrams(token):
+            self._trigrams.setdefault(trigram, set()).add(token)
+
+    def _remove_from_vocabulary(self, token: str) -> None:
+        path = [self._trie]
+        for char in token:
+            path.append(path[-1][char])
+        del path[-1][""]
+        for char, node in zip(reversed(token), reversed(path[:-1])):
+            if node[char]:
+                break
+            del node[char]
+        for trigram in trigrams(token):
+            tokens = self._trigrams[trigram]
+            tokens.discard(token)
+            if not tokens:
+                del self._trigrams[trigram]
+
+    # --- Поиск ---
+
+    def _prefix_tokens(self, prefix: str) -> List[str]:
+        """Слова словаря с префиксом prefix: не больше max_prefix_expansions самых частых (по числу товаров)."""
+        node = self._trie
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        found, stack = [], [node]
+        while stack:
+            node = stack.pop()
+            for char, child in node.items():
+                if char == "":
+                    found.append(child)
+                else:
+                    stack.append(child)
+        if len(found) <= self.max_prefix_expansions:
+            return found
+        postings = self._postings
+        return heapq.nlargest(self.max_prefix_expansions, found, key=lambda token: (len(postings[token]), token))
+
+    def _fuzzy_tokens(self, token: str) -> List[Tuple[str, float]]:
+        query_trigrams = trigrams(token)
+        shared: Counter = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+        scored = []
+        for candidate, common in shared.items():
+            similarity = 2 * common / (len(query_trigrams) + len(candidate) + 1)
+            if similarity >= self.fuzzy_threshold:
+                scored.append((candidate, similarity))
+        return heapq.nlargest(self.max_fuzzy_expansions, scored, key=lambda item: item[1])
+
+    def _expand(self, token: str, is_last: bool) -> List[Tuple[str, float]]:
+        """Слова словаря, которыми может оказаться слово запроса, с весом способа совпадения."""
+        expansions = [(token, EXACT_MATCH)] if token in self._postings else []
+        if is_last and len(token) >= 2:
+            expansions += [(found, PREFIX_MATCH) for found in self._prefix_tokens(token) if found != token]
+        if not expansions and len(token) >= 3:
+            expansions = [(found, FUZZY_MATCH * similarity) for found, similarity in self._fuzzy_tokens(token)]
+        return expansions
+
+    def _match(self, query: str) -> Dict[int, float]:
+        tokens = tokenize(query)
+        if not tokens:
+            return {}
+        per_token: List[Dict[int, float]] = []
+        for position, token in enumerate(tokens):
+            scores: Dict[int, float] = {}
+            for found, match_weight in self._expand(token, position == len(tokens) - 1):
+                for product_id, field_weight in self._postings[found].items():
+                    score = match_weight * field_weight
+                    if score > scores.get(product_id, 0.0):
+                        scores[product_id] = score
+            if not scores:
+                return {}
+            per_token.append(scores)
+
+        per_token.sort(key=len)
+        result = dict(per_token[0])
+        for scores in per_token[1:]:
+            result = {product_id: score + scores[product_id]
+                      for product_id, score in result.items() if product_id in scores}
+            if not result:
+                break
+        return result
+
+    def search(self, query: str, category_id: Optional[int] = None, marketplace: Optional[bool] = None,
+               limit: Optional[int] = None) -> List[int]:
+        """
+        Id товаров, подходящих под запрос, от наиболее релевантных.
+        :param category_id: Только товары категории.
+        :param marketplace: True - только лоты пользователей, False - только товары площадки, None - все.
+        :param limit: Максимум результатов; None - все (для пагинации берется из кэша результатов).
+        """
+        key = (query.strip().lower(), category_id, marketplace)
+        cached = self._results.get(key)
+        if cached is None:
+            docs = self._docs
+            matched = [
+                (score, product_id) for product_id, score in self._match(query).items()
+                if (category_id is None or docs[product_id].category_id == category_id)
+                and (marketplace is None or (docs[product_id].seller_id is not None) == marketplace)
+            ]
+            matched.sort(key=lambda item: (-item[0], item[1]))
+            cached = [product_id for _, product_id in matched]
+            self._results[key] = cached
+            while len(self._results) > self.result_cache_size:
+                self._results.popitem(last=False)
+        else:
+            self._results.move_to_end(key)
+        return cached if limit is None else cached[:limit]
+
+    def document(self, product_id: int) -> Optional[SearchDocument]:
+        return self._docs.get(product_id)
+
+    def page_source(
+        self,
+        query: str,
+        button_factory: Callable[[SearchDocument], ButtonData],
+        category_id: Optional[int] = None,
+        marketplace: Optional[bool] = None
+    ) -> PageSource:
+        """
+        Источник страниц для KeyboardBuilder.build_paginated: результаты запроса сразу в виде кнопок.
+        Список найденных id кэшируется, поэтому листание страниц не повторяет поиск.
+        :param button_factory: Кнопка для найденного товара, например ButtonData(doc.title, f"product:{id}").
+        """
+
+        def fetch(page: int, per_page: int) -> PageWindow:
+            found = self.search(query, category_id, marketplace)
+            start = (page - 1) * per_page
+            items = [button_factory(self._docs[product_id]) for product_id in found[start:start + per_page]]
+            return PageWindow(items, total=len(found))
+
+        return fetch
+
+
+catalog_index = CatalogSearchIndex()
+
+
+def index_product(product: Any, category: str = "", index: CatalogSearchIndex = catalog_index) -> None:
+    """
+    Индексирует товар (модель Product) после создания или изменения; неактивные товары убирает.
+    Закэшированные клавиатуры каталога сбрасываются.
+    """
+    if not product.is_active:
+        index.remove(product.id)
+    else:
+        index.add(product.id, product.title, product.description or "", category, product.category_id,
+                  product.seller_id)
+    keyboard_cache.invalidate(menu=CATALOG_MENU)
+
+
+async def rebuild_index(
+    factory: async_sessionmaker, batch_size: int = 5000, index: CatalogSearchIndex = catalog_index
+) -> int:
+    """
+    Полная перестройка индекса из БД (при старте бота): активные товары читаются keyset-пачками
+    в новый индекс, который затем атомарно подменяет текущий - поиск во время сборки продолжает работать.
+    index_product/remove_lot во время сборки записываются и повторяются на новом индексе перед подменой,
+    иначе снятый модерацией лот, уже прочитанный из БД, вернулся бы в поиск.
+    :return: Число проиндексированных товаров.
+    """
+    fresh = CatalogSearchIndex(index.max_prefix_expansions, index.fuzzy_threshold,
+                               index.max_fuzzy_expansions, index.result_cache_size)
+    changes = index.begin_rebuild()
+    try:
+        after_id = 0
+        while True:
+            async with factory() as session:
+                rows = await requests.list_search_documents(session, after_id, batch_size)
+            if not rows:
+                break
+            for product_id, title, description, category, category_id, seller_id in rows:
+                fresh.add(product_id, title, description, category, category_id, seller_id)
+            after_id = rows[-1][0]
+        # Между повтором и подменой нет await - новые изменения не проскочат.
+        index.replay_changes(changes, fresh)
+        index.replace_with(fresh)
+    finally:
+        index.end_rebuild(changes)
+    printx.info(f"Поисковый индекс каталога перестроен: товаров {len(index)}, слов {len(index._postings)}.")
+    return len(index)
+
+
+async def remove_lot(session: AsyncSession, product_id: int, index: CatalogSearchIndex = catalog_index) -> bool:
+    """
+    Снимает лот с публикации (модерация): is_active=False в БД, удаление из индекса и из кэша клавиатур
+    каталога после commit.
+    :return: True, если товар найден.
+    """
+    found = await requests.set_product_active(session, product_id, False)
+    await session.commit()
+    index.remove(product_id)
+    keyboard_cache.invalidate(menu=CATALOG_MENU)
+    return found
@@ -0,0 +1,350 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+
+printx = logging.getLogger(__name__)
+
+
+class CachedUser:
+    """Снимок пользователя для горячего пути: язык, бан, роль и баланс на момент загрузки."""
+
+    __slots__ = ("id", "language", "is_banned", "role", "balance")
+
+    def __init__(self, id: int, language: str, is_banned: bool, role: str, balance: Decimal):
+        self.id = id
+        self.language = language
+        self.is_banned = is_banned
+        self.role = role
+        self.balance = balance
+
+    @classmethod
+    def from_model(cls, user: Any) -> "CachedUser":
+        return cls(user.id, user.language, user.is_banned, user.role, user.balance)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "language": self.language, "is_banned": self.is_banned,
+                "role": self.role, "balance": str(self.balance)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CachedUser":
+        return cls(data["id"], data["language"], data["is_banned"], data["role"], Decimal(data["balance"]))
+
+
+class CacheBackend(ABC):
+    """Общий (межпроцессный) кэш, например Redis. Значения - JSON-совместимые словари."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Локальная замена общего кэша для одного процесса, тестов и бенчмарков."""
+
+    def __init__(self):
+        self._items: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self._items.pop(key, None)
+            return None
+        return value
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        self._items[key] = (time.monotonic() + ttl, value)
+
+    async def delete(self, key: str) -> None:
+        self._items.pop(key, None)
+
+
+UserLoader = Callable[[int], Awaitable[Optional[CachedUser]]]
+
+
+class UserCache:
+    """
+    Read-through кэш пользователей: локальный TTL+LRU в процессе и необязательный общий backend.
+    Одновременные промахи по одному пользователю объединяются в одну загрузку из БД.
+    Отсутствие пользователя в БД тоже кэшируется (локально, на короткий missing_ttl),
+    чтобы обновления от незарегистрированных пользователей не шли в БД каждый раз.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0, backend: Optional[CacheBackend] = None,
+                 missing_ttl: float = 30.0):
+        """
+        :param max_size: Максимум пользователей в локальном кэше.
+        :param ttl: Время жизни записи в секундах.
+        :param backend: Общий кэш второго уровня; None - только локальный.
+        :param missing_ttl: Сколько секунд помнить, что пользователя нет в БД; 0 - не помнить.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+        self.missing_ttl = missing_ttl
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items: "OrderedDict[int, Tuple[float, CachedUser]]" = OrderedDict()
+        self._missing: "OrderedDict[int, float]" = OrderedDict() # user_id -> когда забыть промах
+        self._loading: Dict[int, "asyncio.Future[Optional[CachedUser]]"] = {}
+        # Растет при каждой записи/инвалидации: загрузка, начатая до записи, не кладет в кэш старые данные.
+        self._write_epoch = 0
+
+    @staticmethod
+    def _shared_key(user_id: int) -> str:
+        return f"user:{user_id}"
+
+    def _get_local(self, user_id: int) -> Optional[CachedUser]:
+        item = self._items.get(user_id)
+        if item is None:
+            return None
+        expires_at, user = item
+        if expires_at < time.monotonic():
+            del self._items[user_id]
+            return None
+        self._items.move_to_end(user_id)
+        return user
+
+    def _put_local(self, user: CachedUser) -> None:
+        self._items[user.id] = (time.monotonic() + self.ttl, user)
+        self._items.move_to_end(user.id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def _is_missing(self, user_id: int) -> bool:
+        expires_at = self._missing.get(user_id)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del self._missing[user_id]
+            return False
+        return True
+
+    def _put_missing(self, user_id: int) -> None:
+        if self.missing_ttl <= 0:
+            return
+        self._missing[user_id] = time.monotonic() + self.missing_ttl
+        self._missing.move_to_end(user_id)
+        while len(self._missing) > self.max_size:
+            self._missing.popitem(last=False)
+
+    async def get(self, user_id: int, loader: Optional[UserLoader] = None) -> Optional[CachedUser]:
+        """
+        Возвращает пользователя из кэша, при промахе - из общего backend или через loader.
+        :param user_id: Telegram id пользователя.
+        :param loader: Загрузка из БД при полном промахе; None - только кэш.
+        :return: Снимок пользователя или None, если он не найден.
+        """
+        user = self._get_local(user_id)
+        if user is not None:
+            self.hits += 1
+            return user
+        if self._is_missing(user_id):
+            self.hits += 1
+            return None
+
+        if self.backend is not None:
+            data = await self.backend.get(self._shared_key(user_id))
+            if data is not None:
+                self.shared_hits += 1
+                user = CachedUser.from_dict(data)
+                self._put_local(user)
+                return user
+
+        self.misses += 1
+        if loader is None:
+            return None
+
+        pending = self._loading.get(user_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = future
+        epoch = self._write_epoch
+        try:
+            user = await loader(user_id)
+            if epoch == self._write_epoch:
+                if user is not None:
+                    await self._store(user)
+                else:
+                    self._put_missing(user_id)
+            future.set_result(user)
+            return user
+        except BaseException as e:
+            future.set_exception(e)
+            # Исключение уже отдано ожидающим; помечаем его полученным, чтобы asyncio не ругался.
+            future.exception()
+            raise
+        finally:
+            self._loading.pop(user_id, None)
+
+    async def put(self, user: CachedUser) -> None:
+        """Кладет (или обновляет) пользователя в оба уровня кэша."""
+        self._write_epoch += 1
+        await self._store(user)
+
+    async def _store(self, user: CachedUser) -> None:
+        self._missing.pop(user.id, None)
+        self._put_local(user)
+        if self.backend is not None:
+            await self.backend.set(self._shared_key(user.id), user.to_dict(), self.ttl)
+
+    def forget(self, user_id: int) -> None:
+        """Удаляет пользователя из локального кэша; загрузки, начатые раньше, его не вернут."""
+        self._write_epoch += 1
+        self._items.pop(user_id, None)
+        self._missing.pop(user_id, None)
+
+    async def invalidate(self, user_id: int) -> None:
+        """Удаляет пользователя из обоих уровней кэша."""
+        self.forget(user_id)
+        if self.backend is not None:
+            await self.backend.delete(self._shared_key(user_id))
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.shared_hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits + self.shared_hits) / total if total else 0.0,
+        }
+
+    def log_stats(self) -> None:
+        stats = self.stats()
+        printx.info(
+            f"Кэш пользователей: размер {stats['size']}, попаданий {stats['hits']} "
+            f"(+{stats['shared_hits']} из общего кэша), промахов {stats['misses']}, "
+            f"вытеснено {stats['evictions']}, hit ratio {stats['hit_ratio']:.1%}")
+
+
+user_cache = UserCache()
+
+
+def make_db_loader(factory: "async_sessionmaker") -> UserLoader:
+    """Создает loader для UserCache.get, читающий пользователя отдельной короткой сессией."""
+    from app.database import requests
+
+    async def load(user_id: int) -> Optional[CachedUser]:
+        async with factory() as session:
+            user = await requests.get_user(session, user_id)
+            return CachedUser.from_model(user) if user is not None else None
+
+    return load
+
+
+async def register_user(session: "AsyncSession", user_id: int, **values: Any) -> bool:
+    """
+    Создает строку пользователя, если ее еще нет, и сбрасывает закэшированный промах.
+    Коммит делает вызывающий; промах, закэшированный до коммита, живет не дольше missing_ttl.
+    :return: True, если пользователь создан.
+    """
+    from app.database import requests
+
+    created = await requests.ensure_user(session, user_id, **values)
+    if created:
+        await user_cache.invalidate(user_id)
+    return created
+
+
+# session.info[_PENDING_INVALIDATIONS] - id пользователей, измененных в текущей транзакции сессии.
+_PENDING_INVALIDATIONS = "user_cache_invalidations"
+_invalidation_tasks: Set["asyncio.Task"] = set()
+
+
+def _invalidate_after_commit(session: "AsyncSession", user_id: int) -> None:
+    """
+    Сбрасывает пользователя из кэша после коммита транзакции вызывающего.
+    До коммита конкурентный промах еще читает старую строку и кладет ее в кэш, поэтому
+    сброс сразу после UPDATE не помогает; при откате кэш остается верным и не трогается.
+    """
+    pending = session.info.get(_PENDING_INVALIDATIONS)
+    if pending is None:
+        from sqlalchemy import event
+
+        pending = session.info[_PENDING_INVALIDATIONS] = set()
+        event.listen(session.sync_session, "after_commit", _on_commit)
+        event.listen(session.sync_session, "after_rollback", _on_rollback)
+    pending.add(user_id)
+
+
+def _on_commit(sync_session: Any) -> None:
+    pending = sync_session.info[_PENDING_INVALIDATIONS]
+    user_ids, cache = list(pending), user_cache
+    pending.clear()
+    for user_id in user_ids:
+        cache.forget(user_id)
+    if user_ids and cache.backend is not None:
+        # Событие синхронное: общий кэш чистим задачей в том же цикле событий.
+        task = asyncio.get_running_loop().create_task(_delete_shared(cache, user_ids))
+        _invalidation_tasks.add(task)
+        task.add_done_callback(_invalidation_tasks.discard)
+
+
+def _on_rollback(sync_session: Any) -> None:
+    sync_session.info[_PENDING_INVALIDATIONS].clear()
+
+
+async def _delete_shared(cache: UserCache, user_ids: Iterable[int]) -> None:
+    for user_id in user_ids:
+        try:
+            await cache.backend.delete(cache._shared_key(user_id))
+        except Exception as e:
+            printx.warning(f"Не удалось сбросить пользователя {user_id} в общем кэше: {e}")
+
+
+async def _update_user(session: "AsyncSession", user_id: int, **values: Any) -> bool:
+    from app.database import requests
+
+    found = await requests.update_user(session, user_id, **values)
+    _invalidate_after_commit(session, user_id)
+    return found
+
+
+async def set_user_language(session: "AsyncSession", user_id: int, language: str) -> bool:
+    """
+    Меняет язык пользователя в БД. Коммит делает вызывающий; после него пользователь
+    сбрасывается из кэша, и следующее обновление прочитает новый язык.
+    :return: True, если пользователь найден.
+    """
+    return await _update_user(session, user_id, language=language)
+
+
+async def set_user_banned(session: "AsyncSession", user_id: int, banned: bool = True) -> bool:
+    """
+    Банит или разбанивает пользователя в БД. Коммит делает вызывающий; после него
+    пользователь сбрасывается из кэша.
+    :return: True, если пользователь найден.
+    """
+    return await _update_user(session, user_id, is_banned=banned)
+
+
+async def log_user_cache_stats(interval: float = 60.0) -> None:
+    """Фоновая задача: раз в interval секунд пишет в лог статистику кэша пользователей."""
+    while True:
+        await asyncio.sleep(interval)
+        user_cache.log_stats()
@@ -0,0 +1,70 @@
+"""
+Бенчмарк рассылок на фейковой сессии бота: скорость, RetryAfter, заблокированные чаты
+и продолжение с контрольной точки после двух "перезапусков" подряд.
+Корректность (без повторных отправок, обработка ошибок API) проверяет tests/test_broadcast_service.py.
+
+Запуск из корня репозитория: python -m benchmarks.bench_broadcast
+"""
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from sqlalchemy import insert
+
+from app.database import requests
+from app.database.database import create_engine, create_session_factory, create_tables
+from app.database.models import User
+from app.services.broadcast_service import BroadcastEngine, BroadcastProgress
+from tests.fake_telegram import make_fake_bot
+
+USERS = 3000
+BLOCKED = set(range(10, USERS, 97))
+
+
+async def main() -> None:
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_engine = create_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+        factory = create_session_factory(db_engine)
+        await create_tables(db_engine)
+        async with factory() as session:
+            await session.execute(insert(User), [
+                {"id": i, "is_banned": i % 500 == 0} for i in range(1, USERS + 1)])
+            broadcast = await requests.create_broadcast(session, 1, "Hello!")
+            await session.commit()
+
+        bot = make_fake_bot(latency=0.03, flood_every=700, retry_after=1, blocked_chats=BLOCKED)
+        engine = BroadcastEngine(bot, factory, rate=1000, workers=64, checkpoint_interval=0.2, progress_interval=0.5)
+        reports = []
+
+        async def on_progress(progress: BroadcastProgress) -> None:
+            reports.append(f"{progress.sent}/{progress.messages_per_second:.0f} msg/s")
+
+        print(f"Broadcast to {USERS} users (6 banned, {len(BLOCKED)} blocked), 30 ms API latency, rate 1000/s")
+        started = time.perf_counter()
+        checkpoints = []
+        for _ in range(2):
+            interrupted = asyncio.create_task(engine.run(broadcast.id, on_progress))
+            await asyncio.sleep(1.0)
+            interrupted.cancel()  # имитация перезапуска посреди рассылки
+            await asyncio.gather(interrupted, return_exceptions=True)
+            async with factory() as session:
+                checkpoints.append(str((await requests.get_broadcast(session, broadcast.id)).last_user_id))
+        progress = await engine.run(broadcast.id, on_progress)
+        elapsed = time.perf_counter() - started
+
+        session_stats = bot.session
+        duplicates = sum(count - 1 for count in session_stats.sent_to.values() if count > 1)
+        expected = USERS - USERS // 500 - len(BLOCKED)
+        delivered = len([chat for chat in session_stats.sent_to if chat not in BLOCKED])
+        print(f"  restarted after checkpoint users {', '.join(checkpoints)}; progress reports: {', '.join(reports[:4])} ...")
+        print(f"  sent {progress.sent}, failed {progress.failed}, delivered to {delivered}/{expected} chats, "
+              f"duplicates {duplicates}, RetryAfter {session_stats.floods}")
+        print(f"  overall {progress.sent / elapsed:,.0f} msg/s incl. restart and flood waits")
+        await db_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
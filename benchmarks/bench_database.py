@@ -0,0 +1,55 @@
+"""
+Бенчмарк сессий БД на обновление: ленивый SessionProvider против сессии на каждое обновление.
+Работает на SQLite (aiosqlite), MySQL не нужен.
+
+Запуск из корня репозитория: python -m benchmarks.bench_database
+"""
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from sqlalchemy import text
+
+from app.database.database import SessionProvider, create_engine, create_session_factory, pool_metrics
+
+
+async def simulate_updates(factory, total_updates: int, db_ratio: float, lazy: bool, concurrency: int) -> float:
+    needs_db_every = max(1, round(1 / db_ratio)) if db_ratio else 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def handle(i: int) -> None:
+        async with semaphore:
+            provider = SessionProvider(factory)
+            if not lazy:
+                await provider.get()
+            if needs_db_every and i % needs_db_every == 0:
+                session = await provider.get()
+                await session.execute(text("SELECT 1"))
+            await asyncio.sleep(0)
+            await provider.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handle(i) for i in range(total_updates)))
+    return time.perf_counter() - started
+
+
+async def main(total_updates: int = 5000) -> None:
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}", pool_size=5, max_overflow=5)
+        factory = create_session_factory(engine)
+        print(f"Session-per-update benchmark: {total_updates} updates, pool_size=5, max_overflow=5")
+        for db_ratio in (0.1, 1.0):
+            for lazy in (False, True):
+                elapsed = await simulate_updates(factory, total_updates, db_ratio, lazy, concurrency=50)
+                stats = pool_metrics.snapshot(engine, reset_wait=True)
+                print(f"  db ratio {db_ratio:>4.0%} {'lazy ' if lazy else 'eager'}: "
+                      f"{total_updates / elapsed:>9,.0f} updates/s, pool wait avg {stats['avg_wait_ms']:.2f} ms, "
+                      f"max {stats['max_wait_ms']:.2f} ms, checkouts total {stats['checkouts']}")
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,254 @@
+"""
+Сквозной офлайн-бенчмарк: настоящий Dispatcher в сборке main.py (LanguageMiddleware, UserLaneMiddleware,
+MetricsMiddleware, FSM из create_fsm_storage) с user_handler и меню каталога на KeyboardBuilder
+против FakeTelegramSession - без сети, Telegram и БД.
+
+Сценарии (синтетические потоки обновлений; одновременно до CONCURRENCY, как у WebhookServer):
+  start_flood         - /start от USERS пользователей, по два от каждого;
+  pagination_storm    - /catalog и листание страниц каталога инлайн-кнопками, без кэша клавиатур;
+  pagination_cached   - то же с keyboard_cache (ключ (язык, меню));
+  callback_burst      - серии нажатий одной кнопки от немногих пользователей (упор в порядок полос);
+  replay:<файл>       - записанные обновления из JSONL (по одному Update на строку), если файлы переданы.
+Для каждого - обновлений в секунду и перцентили задержки feed_update; затем память на 1000 новых
+пользователей (tracemalloc, после gc).
+
+Результат печатается и пишется в bench_output.txt в корне репозитория: таблица с фиксированными
+колонками и порядком строк, чтобы регрессии было видно простым diff между коммитами.
+
+Запуск из корня репозитория: python -m benchmarks.bench_e2e [обновления.jsonl ...]
+"""
+import asyncio
+import gc
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, Iterable, List, Tuple
+
+import aiogram
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery, Message, Update
+
+from app.common.middlewares import LanguageMiddleware, MetricsMiddleware, UserLaneMiddleware
+from app.handlers.user_handler import user_handler
+from app.keyboards.keyboard_wrapper import (
+    CATALOG_MENU, ButtonData, KeyboardBuilder, PageCallbackData, PageWindow, keyboard_cache
+)
+from app.services.fsm_service import create_fsm_storage
+from app.services.language_service import load_translations
+from app.services.metrics_service import UpdateMetrics
+from tests.fake_telegram import make_callback_update, make_fake_bot, make_message_update
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT = os.path.join(ROOT, "bench_output.txt")
+FORMAT_VERSION = 1
+
+USERS = 5_000
+CONCURRENCY = 100
+CATALOG_SIZE = 400
+PER_PAGE = 8
+STORM_USERS = 1_000
+PAGE_FLIPS = 10
+BURST_USERS = 20
+BURST_TAPS = 250
+MEMORY_USERS = 2_000
+
+CATALOG = [ButtonData(f"Товар {i}", callback_data=f"item:{i}") for i in range(1, CATALOG_SIZE + 1)]
+PROVIDER = {"factory": PageCallbackData, "action": "catalog"}
+TOTAL_PAGES = -(-CATALOG_SIZE // PER_PAGE)
+
+
+def catalog_page(page: int, per_page: int) -> PageWindow:
+    start = (page - 1) * per_page
+    return PageWindow(CATALOG[start:start + per_page], total=len(CATALOG))
+
+
+def make_catalog_router(options: Dict[str, bool]) -> Router:
+    """Меню каталога, каким его собирают хэндлеры бота: KeyboardBuilder.build_paginated + FSM."""
+    router = Router(name="bench_catalog")
+
+    async def build(_: Any, user_lang: str, page: int):
+        cache_key = (user_lang, CATALOG_MENU) if options["cache"] else None
+        return await KeyboardBuilder(_).build_paginated(
+            catalog_page, PER_PAGE, current_page=page, page_callback_data_provider=PROVIDER, cache_key=cache_key)
+
+    @router.message(Command("catalog"))
+    async def open_catalog(message: Message, _: Any, user_lang: str, state: FSMContext) -> None:
+        await state.update_data(catalog_page=1)
+        await message.answer(_("buttons.pagination.current_page", current_page=1, total_pages=TOTAL_PAGES),
+                             reply_markup=await build(_, user_lang, 1))
+
+    @router.callback_query(PageCallbackData.filter(F.action == "catalog"))
+    async def flip_page(callback: CallbackQuery, callback_data: PageCallbackData, _: Any, user_lang: str,
+                        state: FSMContext) -> None:
+        await state.update_data(catalog_page=callback_data.page_num)
+        await callback.message.edit_reply_markup(reply_markup=await build(_, user_lang, callback_data.page_num))
+        await callback.answer()
+
+    @router.callback_query(F.data == "profile")
+    async def show_profile(callback: CallbackQuery, _: Any) -> None:
+        await callback.answer(_("profile_info", user_id=callback.from_user.id), show_alert=True)
+
+    return router
+
+
+def make_dispatcher(options: Dict[str, bool]) -> Dispatcher:
+    """Та же цепочка middleware, что в main.run_telebot без БД."""
+    dp = Dispatcher(storage=create_fsm_storage())
+    dp.update.middleware(LanguageMiddleware(None))
+    UserLaneMiddleware(64, 100).setup(dp)
+    MetricsMiddleware(UpdateMetrics()).setup(dp)
+    dp.include_router(user_handler)
+    dp.include_router(make_catalog_router(options))
+    return dp
+
+
+# --- Потоки обновлений ---
+
+def page_data(page: int) -> str:
+    return PageCallbackData(action="catalog", page_num=page).pack()
+
+
+def start_flood(first_id: int, users: int) -> List[Dict[str, Any]]:
+    return [make_message_update(first_id + i * users + n, 1_000_000 + n)
+            for i in range(2) for n in range(users)]
+
+
+def pagination_storm(first_id: int, users: int, flips: int, user_base: int = 2_000_000) -> List[Dict[str, Any]]:
+    updates = [make_message_update(first_id + n, user_base + n, text="/catalog") for n in range(users)]
+    for step in range(flips):
+        for n in range(users):
+            # Вперед на первых шагах, дальше - туда-обратно: сочетание новых и уже собранных страниц.
+            page = 1 + (step + n) % TOTAL_PAGES if step < flips // 2 else 1 + (n + flips // 2 - step % 2) % TOTAL_PAGES
+            updates.append(make_callback_update(first_id + users * (step + 1) + n, user_base + n, page_data(page)))
+    return updates
+
+
+def callback_burst(first_id: int) -> List[Dict[str, Any]]:
+    return [make_callback_update(first_id + tap * BURST_USERS + n, 3_000_000 + n, "profile")
+            for tap in range(BURST_TAPS) for n in range(BURST_USERS)]
+
+
+def read_replay(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# --- Прогон ---
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+async def run_stream(dp: Dispatcher, bot: Bot, raw_updates: Iterable[Dict[str, Any]]) -> Dict[str, float]:
+    updates = [Update.model_validate(raw, context={"bot": bot}) for raw in raw_updates]
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies: List[float] = []
+
+    async def feed(update: Update) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await dp.feed_update(bot, update)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(update) for update in updates))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "updates": len(updates),
+        "rate": len(updates) / elapsed,
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "max": latencies[-1] * 1000,
+    }
+
+
+async def memory_per_1k_users(dp: Dispatcher, bot: Bot, first_id: int) -> float:
+    """Прирост памяти процесса на 1000 новых пользователей: /start, /catalog и одно листание у каждого."""
+    raw = start_flood(first_id, MEMORY_USERS)[:MEMORY_USERS]
+    raw += pagination_storm(first_id + MEMORY_USERS, MEMORY_USERS, 1, user_base=1_000_000)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    updates = [Update.model_validate(item, context={"bot": bot}) for item in raw]
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def feed(update: Update) -> None:
+        async with semaphore:
+            await dp.feed_update(bot, update)
+
+    await asyncio.gather(*(feed(update) for update in updates))
+    del updates, raw
+    bot.session.sent_to.clear()  # Счетчики заглушки Telegram - не память бота
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / (MEMORY_USERS / 1000) / 1024
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def render(results: List[Tuple[str, Dict[str, float]]], memory_kib: float) -> str:
+    lines = [
+        f"# bench_e2e format={FORMAT_VERSION} commit={git_revision()} python={platform.python_version()} "
+        f"aiogram={aiogram.__version__}",
+        f"# concurrency={CONCURRENCY} users={USERS} catalog={CATALOG_SIZE} per_page={PER_PAGE}",
+        f"{'scenario':<28}{'updates':>9}{'upd_per_s':>12}{'p50_ms':>10}{'p95_ms':>10}{'p99_ms':>10}{'max_ms':>10}",
+    ]
+    for name, r in results:
+        lines.append(f"{name:<28}{r['updates']:>9d}{r['rate']:>12.1f}{r['p50']:>10.3f}{r['p95']:>10.3f}"
+                     f"{r['p99']:>10.3f}{r['max']:>10.3f}")
+    lines.append(f"{'memory_per_1k_users_kib':<28}{memory_kib:>9.1f}")
+    return "\n".join(lines) + "\n"
+
+
+async def main(replay_paths: List[str]) -> None:
+    logging.disable(logging.WARNING)
+    load_translations()
+    options = {"cache": False}
+    dp = make_dispatcher(options)
+    bot = make_fake_bot()
+
+    # Прогрев: первые вызовы хэндлеров, фильтров и моделей не должны попадать в замеры.
+    await run_stream(dp, bot, start_flood(1, 100) + pagination_storm(1_000, 100, 2, user_base=5_000_000))
+
+    results = [("start_flood", await run_stream(dp, bot, start_flood(100_000, USERS)))]
+    results.append(("pagination_storm", await run_stream(dp, bot, pagination_storm(200_000, STORM_USERS, PAGE_FLIPS))))
+    options["cache"] = True
+    keyboard_cache.clear()
+    results.append(("pagination_cached", await run_stream(
+        dp, bot, pagination_storm(300_000, STORM_USERS, PAGE_FLIPS, user_base=2_500_000))))
+    results.append(("callback_burst", await run_stream(dp, bot, callback_burst(400_000))))
+    for path in replay_paths:
+        results.append((f"replay:{os.path.basename(path)}", await run_stream(dp, bot, read_replay(path))))
+    memory_kib = await memory_per_1k_users(dp, bot, 500_000)
+
+    requests = bot.session.requests
+    assert requests["sendMessage"] and requests["editMessageReplyMarkup"] and requests["answerCallbackQuery"], \
+        f"хэндлеры не ответили: {dict(requests)}"
+    await dp.emit_shutdown(bot=bot)
+    await bot.session.close()
+
+    report = render(results, memory_kib)
+    with open(OUTPUT, "w", encoding="utf-8") as f:
+        f.write(report)
+    print(report, end="")
+    print(f"Записано в {os.path.relpath(OUTPUT)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
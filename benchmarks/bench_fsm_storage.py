@@ -0,0 +1,140 @@
+"""
+Бенчмарк FSM-хранилищ на многошаговом диалоге: хэндлер на каждом шаге делает
+set_state + update_data, обновления идут через Dispatcher с UserLaneMiddleware.
+
+Сравниваются MemoryStorage (эталон, теряется при перезапуске), SQL (SQLite) и Redis
+(FakeRedis с задержкой сети) - каждый без объединения записей (каждая операция FSM -
+запрос к хранилищу) и с FSMWriteBehindMiddleware (одно чтение и одна запись на обновление).
+Затем проверяются переживание перезапуска и истечение брошенных диалогов по TTL.
+
+Запуск из корня репозитория: python -m benchmarks.bench_fsm_storage
+"""
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from aiogram import Dispatcher, F, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Message, Update
+from sqlalchemy import delete
+
+from app.common.middlewares import FSMWriteBehindMiddleware, UserLaneMiddleware
+from app.database.database import create_engine, create_session_factory, create_tables
+from app.database.models import FSMRecord
+from app.services.fsm_service import CoalescingStorage, RedisFSMBackend, SQLFSMBackend
+from tests.fake_redis import FakeRedis
+from tests.fake_telegram import make_fake_bot, make_message_update
+
+USERS = 200
+STEPS = 5
+REDIS_LATENCY = 0.0005
+
+
+class Checkout(StatesGroup):
+    step = State()
+    confirm = State()
+
+
+def make_dispatcher(storage: BaseStorage, coalesce: bool) -> Dispatcher:
+    router = Router(name="bench")
+
+    @router.message(F.text)
+    async def dialog_step(message: Message, state: FSMContext) -> None:
+        step = int(message.text)
+        await state.set_state(Checkout.confirm if step == STEPS - 1 else Checkout.step)
+        await state.update_data(step=step, **{f"answer_{step}": message.text})
+
+    dp = Dispatcher(storage=storage)
+    UserLaneMiddleware(64, 100).setup(dp)
+    if coalesce:
+        FSMWriteBehindMiddleware(storage).setup(dp)
+    dp.include_router(router)
+    return dp
+
+
+async def run_case(name: str, storage: BaseStorage, coalesce: bool, round_trips=None) -> float:
+    bot = make_fake_bot()
+    dp = make_dispatcher(storage, coalesce)
+    updates = [Update.model_validate(make_message_update(step * USERS + user_id, user_id, text=str(step)),
+                                     context={"bot": bot})
+               for step in range(STEPS) for user_id in range(1, USERS + 1)]
+
+    before = round_trips() if round_trips else 0
+    started = time.perf_counter()
+    await asyncio.gather(*(asyncio.create_task(dp.feed_update(bot, update)) for update in updates))
+    elapsed = time.perf_counter() - started
+    trips = (round_trips() - before) / len(updates) if round_trips else None
+
+    for user_id in (1, USERS):
+        key = StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)
+        assert await storage.get_state(key) == Checkout.confirm.state, f"{name}: неверное состояние"
+        data = await storage.get_data(key)
+        assert data["step"] == STEPS - 1 and len(data) == STEPS + 1, f"{name}: потеряны данные FSM"
+
+    rate = len(updates) / elapsed
+    trips_text = f", запросов к хранилищу на обновление {trips:.1f}" if trips is not None else ""
+    print(f"{name:34} {rate:8.0f} обновлений/с{trips_text}")
+    await dp.emit_shutdown(bot=bot)
+    await bot.session.close()
+    return rate
+
+
+async def check_restart_and_ttl(factory) -> None:
+    key = StorageKey(bot_id=1, chat_id=1, user_id=1)
+    first = CoalescingStorage(SQLFSMBackend(factory), ttl=0.2)
+    async with first.update_scope():
+        await first.set_state(key, Checkout.step)
+        await first.update_data(key, {"cart": [1, 2]})
+    restarted = CoalescingStorage(SQLFSMBackend(factory), ttl=0.2)
+    assert await restarted.get_state(key) == Checkout.step.state, "состояние не пережило перезапуск"
+    assert await restarted.get_data(key) == {"cart": [1, 2]}, "данные не пережили перезапуск"
+    await asyncio.sleep(0.3)
+    assert await restarted.get_state(key) is None, "истекший диалог все еще читается"
+    purged = await restarted.backend.purge_expired()
+    print(f"SQL: состояние пережило перезапуск, брошенный диалог истек по TTL, удалено строк {purged}")
+
+    redis = FakeRedis()
+    storage = CoalescingStorage(RedisFSMBackend(redis), ttl=1)
+    storage_key = StorageKey(bot_id=1, chat_id=1, user_id=1)
+    await storage.set_state(storage_key, Checkout.step)
+    assert redis.dbsize() == 1
+    await asyncio.sleep(1.1)
+    assert await storage.get_state(storage_key) is None and redis.dbsize() == 0, "ключ Redis не истек"
+    print("Redis: брошенный диалог истек по TTL")
+
+
+async def main() -> None:
+    logging.disable(logging.WARNING)
+    print(f"Пользователей {USERS}, шагов диалога {STEPS}, задержка Redis {REDIS_LATENCY * 1000:.1f} мс")
+    await run_case("MemoryStorage", MemoryStorage(), coalesce=False)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+        factory = create_session_factory(engine)
+        await create_tables(engine)
+        for coalesce in (False, True):
+            storage = CoalescingStorage(SQLFSMBackend(factory))
+            await run_case(f"SQL, {'одна запись на обновление' if coalesce else 'запись на каждую операцию'}",
+                           storage, coalesce, lambda storage=storage: storage.reads + storage.writes)
+            async with factory() as session:
+                await session.execute(delete(FSMRecord))
+                await session.commit()
+        await check_restart_and_ttl(factory)
+        await engine.dispose()
+
+    rates = {}
+    for coalesce in (False, True):
+        redis = FakeRedis(REDIS_LATENCY)
+        rates[coalesce] = await run_case(
+            f"Redis, {'одна запись на обновление' if coalesce else 'запись на каждую операцию'}",
+            CoalescingStorage(RedisFSMBackend(redis)), coalesce, lambda redis=redis: redis.commands)
+    print(f"Объединение записей для Redis: x{rates[True] / rates[False]:.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
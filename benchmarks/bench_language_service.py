@@ -0,0 +1,66 @@
+"""
+Микро-бенчмарк get_text: старый обход вложенных словарей против плоского каталога.
+
+Запуск из корня репозитория: python -m benchmarks.bench_language_service
+"""
+import logging
+import timeit
+
+from app import config
+from app.services import language_service
+from app.services.language_service import get_text, load_translations
+
+
+def legacy_get_text(key: str, lang: str = "ru", **kwargs) -> str:
+    """Реализация get_text до перехода на плоские каталоги (для сравнения)."""
+    keys = key.split('.')
+    text_template = language_service.translations.get(lang, language_service.translations.get(config.BASE_LOCAL))
+    try:
+        for k in keys:
+            if isinstance(text_template, dict):
+                text_template = text_template[k]
+            else:
+                return key
+        if not isinstance(text_template, str):
+            return key
+    except KeyError:
+        text_template_default = language_service.translations.get("ru", {})
+        try:
+            for k_default in keys:
+                if isinstance(text_template_default, dict):
+                    text_template_default = text_template_default[k_default]
+                else:
+                    return key
+            if isinstance(text_template_default, str):
+                return text_template_default.format_map(kwargs) if kwargs else text_template_default
+        except KeyError:
+            return key
+        return key
+    return text_template.format_map(kwargs) if kwargs else text_template
+
+
+CASES = {
+    "plain (buttons.pagination.next)": lambda fn: fn("buttons.pagination.next", lang="ru"),
+    "format (buttons.pagination.current_page)": lambda fn: fn(
+        "buttons.pagination.current_page", lang="ru", current_page=3, total_pages=10),
+    "fallback lang (welcome, lang=en)": lambda fn: fn("welcome", lang="en", name="bench"),
+}
+
+
+def run(number: int = 200_000) -> None:
+    logging.disable(logging.INFO)
+    load_translations()
+    # Убеждаемся, что обе реализации возвращают одно и то же.
+    for case in CASES.values():
+        assert case(legacy_get_text) == case(get_text)
+
+    print(f"get_text throughput, {number} calls per case, catalogs: {sorted(language_service._catalogs)}")
+    for name, case in CASES.items():
+        legacy = timeit.timeit(lambda: case(legacy_get_text), number=number)
+        current = timeit.timeit(lambda: case(get_text), number=number)
+        print(f"  {name:<42} legacy {number / legacy:>12,.0f}/s   "
+              f"compiled {number / current:>12,.0f}/s   x{legacy / current:.2f}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,107 @@
+"""
+Нагрузочный бенчмарк журнала баланса на SQLite: тысячи одновременных переводов между
+пользователями (каждый - своя транзакция из пула), затем повтор части переводов с теми же
+ключами идемпотентности (как повторно доставленные обновления), свертка журнала и сверка.
+
+Печатается число транзакций в секунду; сохранение суммы балансов, отсутствие отрицательных
+балансов и повторов под конкуренцией проверяет tests/test_ledger_service.py.
+
+Запуск из корня репозитория: python -m benchmarks.bench_ledger
+"""
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+
+from sqlalchemy import func, insert, select
+
+from app.database.database import create_engine, create_session_factory, create_tables
+from app.database.models import LedgerEntry, User
+from app.services.ledger_service import (
+    TOPUP, InsufficientFunds, audit_balances, compact_ledger, credit, transfer, update_key
+)
+
+USERS = 1_000
+START_BALANCE = Decimal("100.00")
+TRANSFERS = 5_000
+REPLAYED = 1_000
+
+
+async def seed(factory) -> None:
+    async with factory() as session:
+        await session.execute(insert(User), [{"id": user_id, "balance": Decimal("0")} for user_id in range(1, USERS + 1)])
+        for user_id in range(1, USERS + 1):
+            await credit(session, user_id, START_BALANCE, TOPUP, f"seed:{user_id}")
+        await session.commit()
+
+
+async def run_transfer(factory, update_id: int, sender_id: int, receiver_id: int, amount: Decimal) -> str:
+    async with factory() as session:
+        try:
+            applied = await transfer(session, sender_id, receiver_id, amount, update_key(update_id, "transfer"))
+        except InsufficientFunds:
+            await session.commit()
+            return "insufficient"
+        await session.commit()
+    return "applied" if applied else "duplicate"
+
+
+async def run_batch(factory, batch) -> dict:
+    results = await asyncio.gather(*(run_transfer(factory, *item) for item in batch))
+    counts = {"applied": 0, "insufficient": 0, "duplicate": 0}
+    for result in results:
+        counts[result] += 1
+    return counts
+
+
+async def totals(factory):
+    async with factory() as session:
+        total = await session.scalar(select(func.sum(User.balance)))
+        negative = await session.scalar(select(func.count()).where(User.balance < 0))
+        entries = await session.scalar(select(func.count()).select_from(LedgerEntry))
+    return total, negative, entries
+
+
+async def main() -> None:
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+        factory = create_session_factory(engine)
+        await create_tables(engine)
+        await seed(factory)
+        expected = START_BALANCE * USERS
+
+        rnd = random.Random(5)
+        batch = []
+        for update_id in range(1, TRANSFERS + 1):
+            sender_id, receiver_id = rnd.sample(range(1, USERS + 1), 2)
+            batch.append((update_id, sender_id, receiver_id, Decimal(rnd.randint(1, 8000)) / 100))
+
+        started = time.perf_counter()
+        counts = await run_batch(factory, batch)
+        elapsed = time.perf_counter() - started
+        total, negative, entries = await totals(factory)
+        print(f"Переводов {TRANSFERS} одновременно: {elapsed:.2f} с, {TRANSFERS / elapsed:.0f} транзакций/с "
+              f"(выполнено {counts['applied']}, отказ по балансу {counts['insufficient']})")
+        print(f"Сумма балансов {total} (ожидалось {expected}), отрицательных балансов {negative}, записей журнала {entries}")
+
+        replay = [item for item in rnd.sample(batch, REPLAYED)]
+        started = time.perf_counter()
+        replayed = await run_batch(factory, replay)
+        elapsed = time.perf_counter() - started
+        print(f"Повтор {REPLAYED} переводов с теми же update_id: {REPLAYED / elapsed:.0f} транзакций/с, "
+              f"пропущено как повтор {replayed['duplicate']}, заново выполнено {replayed['applied']}")
+
+        started = time.perf_counter()
+        compacted = await compact_ledger(factory, settle=0)
+        print(f"Свертка журнала: снимков {compacted} за {(time.perf_counter() - started) * 1000:.0f} мс")
+        checked, drifted, _ = await audit_balances(factory)
+        print(f"Сверка users.balance с журналом: проверено {checked}, расхождений {drifted}")
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+"""
+Бенчмарк консольного форматера логов: прежний ColorizingFormatter (re.sub без компиляции,
+подмена полей записи на время format) против текущего (скомпилированные шаблоны,
+запись не изменяется), а также JsonLinesFormatter для файла.
+
+Запуск из корня репозитория: python -m benchmarks.bench_log_formatter
+"""
+import logging
+import re
+import time
+
+from app.services.logger_service import (
+    HAS_COLORAMA, AiogramEventFilter, ColorizingFormatter, Fore, JsonLinesFormatter, Style
+)
+
+RECORDS = 50000
+CONSOLE_FORMAT = "%(asctime)s - %(levelname)s - [%(name)s] - %(message)s"
+DATEFMT = "%Y-%m-%d %H:%M:%S"
+
+
+class LegacyColorizingFormatter(logging.Formatter):
+    """Копия форматера до оптимизации (без обработки aiogram.event, она здесь не меряется отдельно)."""
+    LEVEL_COLORS = {
+        logging.DEBUG: Fore.BLUE,
+        logging.INFO: Fore.GREEN,
+        logging.WARNING: Fore.YELLOW,
+        logging.ERROR: Fore.RED,
+        logging.CRITICAL: Fore.MAGENTA,
+    } if HAS_COLORAMA else {}
+
+    def format(self, record):
+        original_levelname = record.levelname
+        text_message = record.getMessage()
+        original_msg, original_args = record.msg, record.args
+        if HAS_COLORAMA:
+            color = self.LEVEL_COLORS.get(record.levelno, Fore.RESET)
+            record.levelname = f"{color}{Style.BRIGHT}{original_levelname}{Style.RESET_ALL}"
+            record.msg = re.sub(r'(\b\d+\.?\d*\b)', f'{Fore.CYAN}\\1{Style.RESET_ALL}', text_message)
+            record.args = tuple()
+        formatted_log = super().format(record)
+        record.levelname = original_levelname
+        record.msg, record.args = original_msg, original_args
+        return formatted_log
+
+
+def make_records() -> list:
+    records = []
+    event_filter = AiogramEventFilter()
+    for i in range(RECORDS):
+        if i % 4 == 0:
+            record = logging.LogRecord(
+                "aiogram.event", logging.INFO, __file__, 1,
+                "Update id=%s is %s. Duration %d ms by bot id=%d", (i, "handled", 7, 123456), None)
+            event_filter.filter(record)
+        else:
+            record = logging.LogRecord(
+                "app.handlers", logging.DEBUG, __file__, 1,
+                "Пользователь %d открыл страницу %d за %.2f мс", (i % 977, i % 13, 1.25), None)
+        records.append(record)
+    return records
+
+
+def measure(formatter: logging.Formatter, records: list) -> float:
+    started = time.perf_counter()
+    for record in records:
+        formatter.format(record)
+    return len(records) / (time.perf_counter() - started)
+
+
+def main() -> None:
+    records = make_records()
+    cases = [
+        ("прежний ColorizingFormatter", LegacyColorizingFormatter(CONSOLE_FORMAT, datefmt=DATEFMT)),
+        ("ColorizingFormatter, цвета", ColorizingFormatter(CONSOLE_FORMAT, datefmt=DATEFMT, use_colors=True)),
+        ("ColorizingFormatter, без цветов", ColorizingFormatter(CONSOLE_FORMAT, datefmt=DATEFMT, use_colors=False)),
+        ("JsonLinesFormatter", JsonLinesFormatter()),
+    ]
+    print(f"Записей: {RECORDS} (четверть - aiogram.event), colorama: {HAS_COLORAMA}")
+    baseline = None
+    for name, formatter in cases:
+        measure(formatter, records[:1000])
+        rate = measure(formatter, records)
+        baseline = baseline or rate
+        print(f"{name:34} {rate:10.0f} записей/с  x{rate / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Бенчмарк задержки лог-вызовов внутри async-хэндлера при уровне DEBUG (как в main.init):
+прямые StreamHandler + TimedRotatingFileHandler против QueueHandler/QueueListener.
+
+Запуск из корня репозитория: python -m benchmarks.bench_logging
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from app.services.logger_service import setup_logging, shutdown_logging
+
+UPDATES = 5000
+LOGS_PER_UPDATE = 4
+
+
+async def fake_handler(logger: logging.Logger, update_id: int, latencies: list) -> None:
+    for i in range(LOGS_PER_UPDATE):
+        started = time.perf_counter()
+        logger.debug("Обработка обновления %d, шаг %d, пользователь %d", update_id, i, update_id % 977)
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0)
+
+
+async def run_case(use_queue: bool, log_dir: str) -> list:
+    setup_logging(log_dir=log_dir, console_level=logging.DEBUG, use_queue=use_queue)
+    logger = logging.getLogger("bench.handler")
+    latencies: list = []
+    await asyncio.gather(*(fake_handler(logger, i, latencies) for i in range(UPDATES)))
+    shutdown_logging()
+    return latencies
+
+
+def main() -> None:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        for use_queue in (False, True):
+            # Консольный обработчик пишет в sys.stdout, отправляем его в /dev/null, чтобы не мерить терминал.
+            with contextlib.redirect_stdout(devnull):
+                latencies = asyncio.run(run_case(use_queue, os.path.join(tmp, str(use_queue))))
+            results[use_queue] = latencies
+
+    print(f"Log call latency on the event loop, DEBUG level, {UPDATES * LOGS_PER_UPDATE} calls")
+    for use_queue, latencies in results.items():
+        latencies.sort()
+        print(f"  {'queue ' if use_queue else 'direct'}: mean {statistics.mean(latencies) * 1e6:7.1f} us, "
+              f"p50 {latencies[len(latencies) // 2] * 1e6:7.1f} us, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:8.1f} us, "
+              f"max {latencies[-1] * 1e6:9.1f} us")
+
+
+if __name__ == "__main__":
+    main()
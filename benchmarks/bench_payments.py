@@ -0,0 +1,131 @@
+"""
+Бенчмарк сверки счетов CryptoBot против локальной заглушки Crypto Pay API (tests/fake_cryptobot.py)
+с задержкой сети: сколько счетов в минуту сверяется при запросе getInvoices на каждый счет
+и при пачках invoice_ids по 100 и 1000.
+
+Затем скорость приема дублей подписанных вебхуков invoice_paid через HTTP-обработчик одновременно
+со сверкой. Зачисление ровно один раз (вебхуки, сверка, Telegram Stars) проверяет tests/test_payment_service.py.
+
+Запуск из корня репозитория: python -m benchmarks.bench_payments
+"""
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+
+from aiocryptopay import AioCryptoPay
+from aiohttp import ClientSession, web
+from sqlalchemy import insert
+
+from app.database.database import create_engine, create_session_factory, create_tables
+from app.database.models import TopUp, User
+from app.services.payment_service import CRYPTOBOT, PaymentService
+from tests.fake_cryptobot import FAKE_CRYPTOBOT_TOKEN, FakeCryptoBot
+
+USERS = 500
+INVOICES = 1_000
+API_LATENCY = 0.01
+WEBHOOK_PATH = "/cryptobot"
+
+
+async def seed_users(factory) -> None:
+    async with factory() as session:
+        await session.execute(insert(User), [
+            {"id": user_id, "balance": Decimal("0"), "referrer_id": user_id - 1 if user_id % 2 == 0 else None}
+            for user_id in range(1, USERS + 1)])
+        await session.commit()
+
+
+async def seed_invoices(factory, fake: FakeCryptoBot, rnd: random.Random, count: int) -> list:
+    """Счета создаются в заглушке без HTTP и регистрируются как ожидающие пополнения одной вставкой."""
+    invoices = []
+    for _ in range(count):
+        user_id = rnd.randint(1, USERS)
+        amount = Decimal(rnd.randint(100, 10_000)) / 100
+        invoices.append((fake.create(float(amount), str(user_id))["invoice_id"], user_id, amount))
+    async with factory() as session:
+        await session.execute(insert(TopUp), [
+            {"user_id": user_id, "provider": CRYPTOBOT, "external_id": str(invoice_id), "amount": amount,
+             "status": "pending"} for invoice_id, user_id, amount in invoices])
+        await session.commit()
+    return invoices
+
+
+async def reconcile_rate(factory, fake: FakeCryptoBot, crypto: AioCryptoPay, batch_size: int, rnd: random.Random) -> None:
+    invoices = await seed_invoices(factory, fake, rnd, INVOICES)
+    ids = [invoice_id for invoice_id, _, _ in invoices]
+    rnd.shuffle(ids)
+    paid, expired = ids[:int(len(ids) * 0.9)], ids[int(len(ids) * 0.9):int(len(ids) * 0.95)]
+    fake.pay(paid)
+    fake.expire(expired)
+
+    service = PaymentService(crypto, factory, batch_size=batch_size)
+    calls_before = fake.requests["/api/getInvoices"]
+    started = time.perf_counter()
+    checked = await service.reconcile()
+    elapsed = time.perf_counter() - started
+    calls = fake.requests["/api/getInvoices"] - calls_before
+    print(f"Пачка {batch_size:4d}: проверено {checked} счетов за {elapsed:6.2f} с, "
+          f"{checked / elapsed * 60:9.0f} счетов/мин; запросов getInvoices {calls}, "
+          f"зачислено {service.stats.credited}, истекло {service.stats.expired}")
+    fake.expire(ids[len(paid) + len(expired):])  # Неоплаченные истекают, чтобы не попасть в следующий прогон
+    await service.reconcile()
+
+
+async def webhook_rate(factory, fake: FakeCryptoBot, crypto: AioCryptoPay, rnd: random.Random) -> None:
+    invoices = await seed_invoices(factory, fake, rnd, INVOICES)
+    fake.pay(invoice_id for invoice_id, _, _ in invoices)
+    service = PaymentService(crypto, factory, batch_size=100)
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, service.handle_webhook)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}{WEBHOOK_PATH}"
+
+    async with ClientSession() as http:
+        limit = asyncio.Semaphore(50)
+
+        async def deliver(invoice_id: int) -> int:
+            async with limit:
+                return await fake.send_webhook(http, url, invoice_id)
+
+        deliveries = [invoice_id for invoice_id, _, _ in invoices] * 2  # Каждый вебхук доставлен дважды
+        rnd.shuffle(deliveries)
+        started = time.perf_counter()
+        await asyncio.gather(service.reconcile(), *(deliver(invoice_id) for invoice_id in deliveries))
+        elapsed = time.perf_counter() - started
+    await runner.cleanup()
+
+    print(f"Вебхуки: {len(deliveries)} доставок ({len(invoices)} счетов, каждый дважды) одновременно со сверкой "
+          f"за {elapsed:.2f} с ({len(deliveries) / elapsed:.0f}/с); зачислено {service.stats.credited}")
+
+
+async def main() -> None:
+    logging.disable(logging.WARNING)
+    fake = FakeCryptoBot(latency=API_LATENCY)
+    network = await fake.start()
+    crypto = AioCryptoPay(FAKE_CRYPTOBOT_TOKEN, network=network)
+    rnd = random.Random(7)
+    print(f"Счетов в прогоне {INVOICES}, пользователей {USERS}, задержка Crypto Pay API {API_LATENCY * 1000:.0f} мс")
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+        factory = create_session_factory(engine)
+        await create_tables(engine)
+        await seed_users(factory)
+
+        for batch_size in (1, 100, 1000):
+            await reconcile_rate(factory, fake, crypto, batch_size, rnd)
+        await webhook_rate(factory, fake, crypto, rnd)
+        await engine.dispose()
+    await crypto.close()
+    await fake.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
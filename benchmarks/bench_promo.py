@@ -0,0 +1,151 @@
+"""
+Пиковая нагрузка на промокод: 10k одновременных активаций одного кода с жестким лимитом
+(каждая - своя транзакция из пула). Лимит обязан соблюдаться точно: активаций, зачислений
+в журнал и занятых мест в счетчике ровно столько, сколько max_uses. Сравниваются счетчик
+в одной строке и счетчик, разбитый на шарды; отдельно - число запросов на отклоненную активацию.
+
+Затем расчет цены корзины со скидкой: множества целей промокода в памяти против запроса
+к promo_targets на каждый товар.
+
+Запуск из корня репозитория: python -m benchmarks.bench_promo
+"""
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from decimal import Decimal
+
+from sqlalchemy import func, insert, or_, select
+
+from app.database.database import count_queries, create_engine, create_session_factory, create_tables
+from app.database.models import Category, LedgerEntry, Product, PromoRedemption, PromoTarget, User
+from app.database.requests import get_promo_usage
+from app.services.promo_service import (
+    BALANCE, DISCOUNT, PromoIndex, PromoRejected, create_promo, deactivate_promo, redeem
+)
+
+USERS = 10_000
+MAX_USES = 1_000
+PRODUCTS = 2_000
+CATEGORIES = 50
+CARTS = 200
+CART_SIZE = 50
+
+
+async def seed(factory) -> None:
+    async with factory() as session:
+        await session.execute(insert(User), [{"id": user_id, "balance": Decimal("0")} for user_id in range(1, USERS + 1)])
+        await session.execute(insert(Category), [{"id": i, "name": f"cat{i}"} for i in range(1, CATEGORIES + 1)])
+        await session.execute(insert(Product), [{"id": i, "category_id": i % CATEGORIES + 1, "title": f"p{i}"}
+                                                for i in range(1, PRODUCTS + 1)])
+        await session.commit()
+
+
+async def attempt(factory, index: PromoIndex, code: str, user_id: int) -> str:
+    async with factory() as session:
+        try:
+            await redeem(session, code, user_id, index)
+        except PromoRejected as e:
+            await session.commit()
+            return e.reason
+        await session.commit()
+    return "ok"
+
+
+async def burst(engine, factory, index: PromoIndex, code: str, shards: int) -> None:
+    async with factory() as session:
+        promo = await create_promo(session, code, BALANCE, Decimal("1.00"), max_uses=MAX_USES, shards=shards, index=index)
+
+    users = list(range(1, USERS + 1))
+    random.Random(shards).shuffle(users)
+    with count_queries(engine) as counter:
+        started = time.perf_counter()
+        results = Counter(await asyncio.gather(*(attempt(factory, index, code, user_id) for user_id in users)))
+        elapsed = time.perf_counter() - started
+
+    async with factory() as session:
+        used, cap = await get_promo_usage(session, promo.id)
+        redemptions = await session.scalar(
+            select(func.count()).select_from(PromoRedemption).where(PromoRedemption.promo_id == promo.id))
+        credited = await session.scalar(
+            select(func.count()).select_from(LedgerEntry).where(LedgerEntry.idempotency_key.like(f"promo:{promo.id}:%")))
+    print(f"Шардов {shards:2d}: {USERS} активаций за {elapsed:.2f} с ({USERS / elapsed:.0f}/с), "
+          f"успешно {results['ok']}, исчерпан {results['exhausted']}; счетчик {used}/{cap}, "
+          f"активаций в БД {redemptions}, зачислений {credited}; SQL-запросов {counter.count}")
+    assert results["ok"] == used == redemptions == credited == MAX_USES, "лимит промокода нарушен"
+
+    async with factory() as session:
+        try:
+            await redeem(session, code, users[0], index)
+            raise AssertionError("повторная активация прошла")
+        except PromoRejected as e:
+            assert e.reason in ("already_used", "exhausted")
+    with count_queries(engine) as counter:
+        async with factory() as session:
+            try:
+                await redeem(session, code, USERS + 1, index)
+            except PromoRejected:
+                pass
+    print(f"          отклонение исчерпанного кода: SQL-запросов {counter.count}")
+    async with factory() as session:
+        await deactivate_promo(session, promo.id, index)
+
+
+async def checkout(factory, index: PromoIndex) -> None:
+    rnd = random.Random(3)
+    async with factory() as session:
+        promo = await create_promo(
+            session, "SALE20", DISCOUNT, Decimal("0.20"),
+            target_product_ids=rnd.sample(range(1, PRODUCTS + 1), 300),
+            target_category_ids=rnd.sample(range(1, CATEGORIES + 1), 5), index=index)
+    carts = [[(product_id, product_id % CATEGORIES + 1, Decimal(rnd.randint(100, 5000)) / 100)
+              for product_id in rnd.sample(range(1, PRODUCTS + 1), CART_SIZE)] for _ in range(CARTS)]
+
+    started = time.perf_counter()
+    indexed = [promo.prices(cart) for cart in carts]
+    indexed_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    queried = []
+    async with factory() as session:
+        for cart in carts:
+            prices = []
+            for product_id, category_id, price in cart:
+                applies = await session.scalar(
+                    select(func.count()).select_from(PromoTarget).where(
+                        PromoTarget.promo_id == promo.id,
+                        or_(PromoTarget.product_id == product_id, PromoTarget.category_id == category_id)))
+                prices.append(promo.price(price, product_id, category_id) if applies else price)
+            queried.append(prices)
+    queried_time = time.perf_counter() - started
+    assert indexed == queried, "расчет по индексу разошелся с запросами"
+    print(f"Цена корзины из {CART_SIZE} товаров: запрос на товар {queried_time / CARTS * 1000:.2f} мс, "
+          f"множества в памяти {indexed_time / CARTS * 1000:.3f} мс")
+
+
+async def main() -> None:
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+        factory = create_session_factory(engine)
+        await create_tables(engine)
+        await seed(factory)
+        index = PromoIndex()
+        print(f"Пользователей {USERS}, лимит промокода {MAX_USES}")
+        await burst(engine, factory, index, "BURST1", shards=1)
+        await burst(engine, factory, index, "BURST16", shards=16)
+
+        reloaded = PromoIndex()
+        await reloaded.reload(factory)
+        assert len(reloaded) == 0, "отключенные промокоды попали в индекс"
+        await checkout(factory, index)
+        await reloaded.reload(factory)
+        assert reloaded.get("sale20").product_ids == index.get("SALE20").product_ids
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
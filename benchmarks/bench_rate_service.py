@@ -0,0 +1,82 @@
+"""
+Бенчмарк RateService на заглушке ЦБ (httpx.MockTransport, без сети):
+- перевод сумм экрана истории списком против поштучного перевода со своим чтением курса;
+- stale-while-revalidate: устаревший курс отдается сразу, обновление идет в фоне одним запросом;
+- последний удачный курс при недоступном источнике.
+Корректность этих сценариев проверяет tests/test_rate_service.py.
+
+Запуск из корня репозитория: python -m benchmarks.bench_rate_service
+"""
+import asyncio
+import logging
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+import httpx
+
+from app.services.rate_service import CENT, RateService
+
+AMOUNTS = [Decimal(i % 5000) / 100 + Decimal("0.99") for i in range(10000)]
+ROUNDS = 50
+
+
+class StubCbr:
+    """Заглушка cbr-xml-daily.ru: отдает курс, умеет "падать" и считает запросы."""
+
+    def __init__(self, rate: float = 92.5, latency: float = 0.05):
+        self.rate = rate
+        self.latency = latency
+        self.down = False
+        self.requests = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if self.down:
+            return httpx.Response(503, text="unavailable")
+        return httpx.Response(200, json={"Valute": {"USD": {"Nominal": 1, "Value": self.rate}}})
+
+
+def convert_one_by_one(service: RateService, amounts) -> list:
+    # Так выглядел бы перевод без списочного API: курс и округление ищутся на каждую сумму.
+    return [(amount * service.current().rub_per_usd).quantize(CENT, rounding=ROUND_HALF_UP) for amount in amounts]
+
+
+async def main() -> None:
+    logging.disable(logging.WARNING)
+    stub = StubCbr()
+    service = RateService(refresh_interval=3600, transport=httpx.MockTransport(stub.handle))
+    await service.refresh_in_background()
+    print(f"Курс из заглушки: {service.quote.rub_per_usd}, запросов {stub.requests}")
+
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        convert_one_by_one(service, AMOUNTS)
+    one_by_one = ROUNDS * len(AMOUNTS) / (time.perf_counter() - started)
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        service.usd_to_rub(AMOUNTS)
+    vectorised = ROUNDS * len(AMOUNTS) / (time.perf_counter() - started)
+    print(f"Перевод сумм: поштучно {one_by_one:,.0f}/с, списком {vectorised:,.0f}/с (x{vectorised / one_by_one:.1f})")
+
+    service.refresh_interval = 0.01
+    await asyncio.sleep(0.02)
+    requests_before = stub.requests
+    started = time.perf_counter()
+    for _ in range(1000):
+        service.current()
+    read_ms = (time.perf_counter() - started) * 1000
+    await service._refreshing
+    print(f"Устаревший курс: 1000 чтений за {read_ms:.2f} мс без ожидания сети, "
+          f"фоновых запросов к источнику {stub.requests - requests_before}")
+
+    stub.down = True
+    last_good = service.quote.rub_per_usd
+    await service.refresh()
+    print(f"Источник недоступен: остался последний удачный курс {last_good}, ошибок {service.failures}")
+
+    await service.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,144 @@
+"""
+Бенчмарк реферальных уровней на SQLite со 100k синтетических пользователей:
+уровень через COUNT/SUM по рефералам на каждое событие против денормализованных
+агрегатов (record_referral_topup + evaluate_tier), затем пакетная сверка агрегатов
+с искусственно внесенными расхождениями.
+
+Запуск из корня репозитория: python -m benchmarks.bench_referrals
+"""
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+
+from sqlalchemy import func, insert, select, update
+
+from app.database.database import create_engine, create_session_factory, create_tables
+from app.database.models import TopUp, User
+from app.database.requests import credit_balance
+from app.services.referral_service import evaluate_tier, reconcile_referral_aggregates, record_referral_topup
+
+USERS = 100_000
+REFERRERS = 2_000
+TOPUPS = 100_000
+EVENTS = 2_000
+DRIFTED = 500
+
+
+async def seed(factory) -> None:
+    rnd = random.Random(7)
+    referrer_of = {user_id: rnd.randint(1, REFERRERS) if user_id > REFERRERS and rnd.random() < 0.8 else None
+                   for user_id in range(1, USERS + 1)}
+    topups = [{"user_id": rnd.randint(REFERRERS + 1, USERS), "provider": "bench", "external_id": str(i),
+               "amount": Decimal(rnd.randint(1, 2000)) / 100, "status": "paid"} for i in range(TOPUPS)]
+
+    counts, totals = {}, {}
+    for user_id, referrer_id in referrer_of.items():
+        if referrer_id is not None:
+            counts[referrer_id] = counts.get(referrer_id, 0) + 1
+    for topup in topups:
+        referrer_id = referrer_of[topup["user_id"]]
+        if referrer_id is not None:
+            totals[referrer_id] = totals.get(referrer_id, Decimal("0")) + topup["amount"]
+
+    async with factory() as session:
+        users = [{"id": user_id, "referrer_id": referrer_id, "referral_count": counts.get(user_id, 0),
+                  "referral_topup_total": totals.get(user_id, Decimal("0"))}
+                 for user_id, referrer_id in referrer_of.items()]
+        # Сначала пригласившие, потом остальные - внешний ключ referrer_id должен указывать на существующую строку.
+        await session.execute(insert(User), users[:REFERRERS])
+        for start in range(REFERRERS, USERS, 10_000):
+            await session.execute(insert(User), users[start:start + 10_000])
+        for start in range(0, TOPUPS, 10_000):
+            await session.execute(insert(TopUp), topups[start:start + 10_000])
+        await session.commit()
+    return referrer_of
+
+
+async def naive_tier(session, referrer_id: int):
+    count = await session.scalar(select(func.count()).where(User.referrer_id == referrer_id))
+    total = await session.scalar(
+        select(func.coalesce(func.sum(TopUp.amount), 0))
+        .join(User, TopUp.user_id == User.id)
+        .where(User.referrer_id == referrer_id, TopUp.status == "paid"))
+    return evaluate_tier(count, Decimal(total))
+
+
+async def main() -> None:
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+        factory = create_session_factory(engine)
+        await create_tables(engine)
+        started = time.perf_counter()
+        referrer_of = await seed(factory)
+        print(f"Заполнение: {USERS} пользователей, {TOPUPS} пополнений за {time.perf_counter() - started:.1f} с")
+
+        rnd = random.Random(11)
+        events = [(user_id, Decimal(rnd.randint(100, 5000)) / 100)
+                  for user_id in rnd.sample([u for u, r in referrer_of.items() if r is not None], EVENTS)]
+
+        async with factory() as session:
+            started = time.perf_counter()
+            for user_id, _ in events:
+                await naive_tier(session, referrer_of[user_id])
+            naive_view = time.perf_counter() - started
+            started = time.perf_counter()
+            for user_id, _ in events:
+                referrer = await session.get(User, referrer_of[user_id])
+                evaluate_tier(referrer.referral_count, referrer.referral_topup_total)
+            incremental_view = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for user_id, amount in events:
+            async with factory() as session:
+                tier = await naive_tier(session, referrer_of[user_id])
+                await credit_balance(session, referrer_of[user_id], amount * tier.percent)
+                await session.commit()
+        naive_topup = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for event_id, (user_id, amount) in enumerate(events):
+            async with factory() as session:
+                await record_referral_topup(session, referrer_of[user_id], amount, f"bench:{event_id}")
+                await session.commit()
+        incremental_topup = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(100):
+            for referrer_id in range(1, REFERRERS + 1):
+                evaluate_tier(referrer_id % 70, Decimal(referrer_id % 300))
+        evaluate_ns = (time.perf_counter() - started) / (100 * REFERRERS) * 1e9
+
+        print(f"Профиль (уровень):  COUNT/SUM {naive_view / EVENTS * 1000:6.3f} мс, "
+              f"агрегаты {incremental_view / EVENTS * 1000:6.3f} мс на просмотр")
+        print(f"Пополнение реферала: COUNT/SUM {naive_topup / EVENTS * 1000:6.3f} мс, "
+              f"агрегаты {incremental_topup / EVENTS * 1000:6.3f} мс на событие (с commit)")
+        print(f"evaluate_tier: {evaluate_ns:.0f} нс")
+
+        # Пополнения в событиях выше не записаны в top_ups - сверка должна найти ровно эти расхождения,
+        # плюс DRIFTED искусственно испорченных счетчиков.
+        async with factory() as session:
+            for referrer_id in random.Random(3).sample(range(1, REFERRERS + 1), DRIFTED):
+                await session.execute(
+                    update(User).where(User.id == referrer_id).values(referral_count=User.referral_count + 3))
+            await session.commit()
+        touched = len({referrer_of[user_id] for user_id, _ in events})
+
+        started = time.perf_counter()
+        report = await reconcile_referral_aggregates(factory, batch_size=2000)
+        elapsed = time.perf_counter() - started
+        print(f"Сверка: проверено {report.checked} за {elapsed:.2f} с, расхождений {report.drifted} "
+              f"(рефералов {report.count_drift}, сумма ${report.total_drift}; "
+              f"затронуто событиями {touched}, испорчено счетчиков {DRIFTED})")
+        report = await reconcile_referral_aggregates(factory, batch_size=2000, fix=False)
+        assert report.drifted == 0, "после исправления сверка должна сходиться"
+        print("Повторная сверка: расхождений 0")
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+"""
+Бенчмарк слоя app/database/requests.py на SQLite: пакетная запись и фиксированное число запросов
+для экранов профиля (история покупок, продаж, пополнений, лоты) при любом размере страницы.
+
+Запуск из корня репозитория: python -m benchmarks.bench_requests
+"""
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+
+from sqlalchemy import insert
+
+from app.database import requests
+from app.database.database import count_queries, create_engine, create_session_factory, create_tables
+from app.database.models import Category, Product, ProductVariant, Purchase, User
+
+USERS = 1000
+PRODUCTS = 2000
+PURCHASES = 20000
+PROFILE_USER_ID = 8
+
+# Экран -> функция страницы; число запросов на страницу проверяет tests/test_requests.py.
+HISTORY_SCREENS = {
+    "purchases": requests.list_purchase_history,
+    "sales": requests.list_sale_history,
+    "top-ups": requests.list_topup_history,
+    "lots": requests.list_user_lots,
+}
+
+
+async def seed(factory) -> None:
+    rnd = random.Random(1)
+    async with factory() as session:
+        await session.execute(insert(User), [{"id": i, "username": f"u{i}"} for i in range(1, USERS + 1)])
+        await session.execute(insert(Category), [{"id": i, "name": f"cat{i}"} for i in range(1, 21)])
+        await session.execute(insert(Product), [
+            {"id": i, "category_id": i % 20 + 1, "seller_id": i % USERS + 1 if i % 2 else None,
+             "title": f"product {i}", "description": ""} for i in range(1, PRODUCTS + 1)])
+        await session.execute(insert(ProductVariant), [
+            {"product_id": i, "name": "base", "price": Decimal("9.99")} for i in range(1, PRODUCTS + 1)])
+        await session.commit()
+
+    purchases = []
+    for _ in range(PURCHASES):
+        product_id = rnd.randint(1, PRODUCTS)
+        purchases.append({"user_id": rnd.randint(1, USERS), "product_id": product_id, "variant_id": product_id,
+                          "seller_id": product_id % USERS + 1 if product_id % 2 else None,
+                          "price": Decimal("9.99")})
+
+    async with factory() as session:
+        started = time.perf_counter()
+        for row in purchases[:1000]:
+            session.add(Purchase(**row))
+            await session.flush()
+        row_by_row = time.perf_counter() - started
+
+        started = time.perf_counter()
+        await requests.bulk_insert_purchases(session, purchases[1000:])
+        bulk = time.perf_counter() - started
+        await session.commit()
+    print(f"  purchases insert: row-by-row {1000 / row_by_row:>9,.0f} rows/s, "
+          f"bulk {(PURCHASES - 1000) / bulk:>9,.0f} rows/s")
+
+    topups = [{"user_id": rnd.randint(1, USERS), "provider": "cryptobot", "external_id": str(i),
+               "amount": Decimal("5"), "status": "pending"} for i in range(PURCHASES)]
+    async with factory() as session:
+        started = time.perf_counter()
+        await requests.bulk_upsert_topups(session, topups)
+        for row in topups[::2]:
+            row["status"] = "paid"
+        await requests.bulk_upsert_topups(session, topups[::2])
+        await session.commit()
+    print(f"  top-ups upsert: {len(topups) * 1.5 / (time.perf_counter() - started):>9,.0f} rows/s")
+
+
+async def main() -> None:
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+        factory = create_session_factory(engine)
+        await create_tables(engine)
+        print(f"Data-access benchmark: {USERS} users, {PRODUCTS} products, {PURCHASES} purchases")
+        await seed(factory)
+
+        for name, fetch_page in HISTORY_SCREENS.items():
+            for page_size in (5, 50):
+                async with factory() as session:
+                    started = time.perf_counter()
+                    with count_queries(engine) as counter:
+                        rows, has_next = await fetch_page(session, PROFILE_USER_ID, page_size)
+                    elapsed = time.perf_counter() - started
+                print(f"  {name:<9} page {page_size:>2}: {len(rows):>2} rows, has_next={has_next!s:<5} "
+                      f"{counter.count} queries, {elapsed * 1000:6.2f} ms")
+
+        async with factory() as session:
+            with count_queries(engine) as counter:
+                products = await requests.get_products_with_details(session, list(range(1, 201)))
+            print(f"  product details x{len(products)}: {counter.count} queries")
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""
+Бенчмарк поискового индекса каталога (app/services/search_service.py) на 10k и 100k
+синтетических товаров: время сборки, задержка запросов (точные слова, префикс, опечатка)
+против линейного поиска подстроки (аналог LIKE '%q%'), и сборка страницы клавиатуры
+из результатов через KeyboardBuilder.build_paginated.
+
+Запуск из корня репозитория: python -m benchmarks.bench_search
+"""
+import asyncio
+import logging
+import random
+import statistics
+import time
+
+from app.keyboards.keyboard_wrapper import ButtonData, KeyboardBuilder, PageCallbackData
+from app.services.language_service import get_text, load_translations
+from app.services.search_service import CatalogSearchIndex
+
+BRANDS = ["netflix", "spotify", "youtube", "chatgpt", "midjourney", "discord", "telegram", "steam",
+          "xbox", "playstation", "canva", "notion", "figma", "adobe", "office", "windows", "vpn", "nordvpn"]
+NOUNS = ["premium", "подписка", "аккаунт", "ключ", "лицензия", "семейный", "месяц", "год", "pro", "plus",
+         "nitro", "ultimate", "gift", "карта", "пополнение", "turbo", "business", "личный"]
+CATEGORIES = ["Стриминг", "Музыка", "Игры", "Нейросети", "Софт", "VPN", "Подарочные карты", "Соцсети"]
+QUERIES = {
+    "точные слова": ["netflix premium", "spotify семейный", "steam ключ", "подписка год"],
+    "префикс": ["netf", "spot", "midj", "подп"],
+    "опечатка": ["netflx", "spotfy", "midjorney", "подпска"],
+}
+
+
+def pseudo_word(rnd: random.Random) -> str:
+    return "".join(rnd.choice("абвгдежзиклмнопрстуфхцчшэюя") for _ in range(rnd.randint(4, 9)))
+
+
+def make_products(count: int):
+    rnd = random.Random(count)
+    # Словарь описаний ограничен, как у настоящего каталога: слова повторяются между товарами.
+    words = [pseudo_word(rnd) for _ in range(20_000)]
+    products = []
+    for product_id in range(1, count + 1):
+        title = f"{rnd.choice(BRANDS)} {rnd.choice(NOUNS)} {rnd.choice(NOUNS)} {rnd.choice(words)}"
+        description = " ".join(rnd.choice(words) for _ in range(8)) + f" {rnd.choice(NOUNS)}"
+        category_id = rnd.randrange(len(CATEGORIES))
+        seller_id = rnd.randint(1, 5000) if product_id % 3 else None
+        products.append((product_id, title, description, CATEGORIES[category_id], category_id + 1, seller_id))
+    return products
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def linear_scan(products, query: str):
+    needle = query.lower()
+    return [p[0] for p in products if needle in p[1].lower() or needle in p[2].lower() or needle in p[3].lower()]
+
+
+async def run_size(count: int) -> None:
+    products = make_products(count)
+    index = CatalogSearchIndex()
+    started = time.perf_counter()
+    for row in products:
+        index.add(*row)
+    build = time.perf_counter() - started
+    print(f"\n{count} товаров: сборка индекса {build:.2f} с ({count / build:,.0f} товаров/с), "
+          f"слов в словаре {len(index._postings)}")
+
+    for kind, queries in QUERIES.items():
+        latencies, found = [], 0
+        for _ in range(25):
+            for query in queries:
+                index._results.clear()
+                started = time.perf_counter()
+                found = len(index.search(query))
+                latencies.append(time.perf_counter() - started)
+        print(f"  {kind:14} p50 {statistics.median(latencies) * 1000:7.3f} мс, "
+              f"p95 {percentile(latencies, 0.95) * 1000:7.3f} мс, найдено (последний) {found}")
+
+    latencies = []
+    for query in QUERIES["точные слова"] * 3:
+        started = time.perf_counter()
+        linear_scan(products, query.split()[0])
+        latencies.append(time.perf_counter() - started)
+    print(f"  {'подстрока':14} p50 {statistics.median(latencies) * 1000:7.3f} мс (линейный просмотр, как LIKE '%q%')")
+
+    index._results.clear()
+    builder = KeyboardBuilder(lambda key, **kw: get_text(key, **kw))
+    source = index.page_source("netflix", lambda doc: ButtonData(doc.title, f"product:{doc.product_id}"))
+    provider = {"factory": PageCallbackData, "action": "search"}
+    timings = []
+    for page in range(1, 21):
+        started = time.perf_counter()
+        await builder.build_paginated(source, 8, current_page=page, page_callback_data_provider=provider)
+        timings.append(time.perf_counter() - started)
+    print(f"  страница клавиатуры: первая {timings[0] * 1000:.3f} мс (с поиском), "
+          f"следующие p50 {statistics.median(timings[1:]) * 1000:.3f} мс (из кэша результатов)")
+
+    started = time.perf_counter()
+    for product_id in range(1, 1001):
+        index.remove(product_id)
+    for row in products[:1000]:
+        index.add(*row)
+    print(f"  удаление + добавление 1000 товаров: {(time.perf_counter() - started) * 1000:.1f} мс")
+
+
+async def main() -> None:
+    logging.disable(logging.WARNING)
+    load_translations()
+    for count in (10_000, 100_000):
+        await run_size(count)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
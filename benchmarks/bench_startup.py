@@ -0,0 +1,159 @@
+"""
+Время запуска бота до первого обновления.
+
+1. Отчет в духе python -X importtime по "import main": собственное время импорта, сложенное
+   по пакетам верхнего уровня, и самые тяжелые модули app.*; проверка, что зависимости, нужные
+   только по требованию (httpx, aiocryptopay, aiohttp.web, SQLAlchemy без БД), при старте не импортируются.
+2. Запуск до первого обновления в отдельном процессе: импорт main, загрузка переводов,
+   подключение роутеров по config.ROUTERS и обработка /start через FakeTelegramSession -
+   по этапам StartupTimer, медиана нескольких перезапусков (кэш .pyc и локалей уже прогрет).
+3. Загрузка локалей: разбор JSON против кэша marshal в __pycache__ на реальных файлах
+   и на синтетическом большом каталоге.
+
+Запуск из корня репозитория: python -m benchmarks.bench_startup
+"""
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from app import config
+from app.services import language_service
+
+RESTARTS = 5
+DEFERRED = ("httpx", "aiocryptopay", "aiohttp.web", "app.server", "sqlalchemy")
+
+# Дочерний процесс: путь main до первого обновления без сети и БД.
+CHILD = """
+import asyncio, json, logging, sys
+logging.disable(logging.WARNING)
+import main
+from aiogram.types import Update
+from app.common.middlewares import LanguageMiddleware
+from tests.fake_telegram import make_fake_bot, make_message_update
+main.startup_timer.mark("импорт стенда")
+
+main.load_translations()
+main.startup_timer.mark("переводы")
+
+async def first_update():
+    main.dp.update.middleware(LanguageMiddleware())
+    main.include_routers(main.dp, main.ROUTERS)
+    main.startup_timer.mark("роутеры")
+    bot = make_fake_bot()
+    await main.dp.feed_update(bot, Update.model_validate(make_message_update(1, 1), context={"bot": bot}))
+    main.startup_timer.mark("первое обновление")
+    await bot.session.close()
+
+asyncio.run(first_update())
+print(json.dumps({"phases": main.startup_timer.phases, "total": main.startup_timer.total,
+                  "deferred": [name for name in %r if name in sys.modules]}))
+""" % (DEFERRED,)
+
+
+def import_report() -> None:
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            capture_output=True, text=True, check=True)
+    by_package = defaultdict(int)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        by_package[name.split(".")[0]] += int(self_us)
+        modules[name] = int(cumulative_us)
+    total = modules["main"]
+    print(f"import main: {total / 1000:.0f} мс; собственное время импорта по пакетам:")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:10]:
+        print(f"  {package:24} {self_us / 1000:8.1f} мс  {self_us / total * 100:5.1f}%")
+    heavy_app = sorted(((us, name) for name, us in modules.items() if name.startswith("app.")), reverse=True)[:5]
+    print("  самые тяжелые модули app.* (с зависимостями): "
+          + ", ".join(f"{name} {us / 1000:.0f} мс" for us, name in heavy_app))
+    loaded = [name for name in DEFERRED if name in modules]
+    print(f"  отложенные зависимости при старте: {', '.join(loaded) or 'не импортированы'}")
+    assert not loaded, f"при старте импортированы {loaded}"
+
+
+def first_update_report() -> None:
+    runs = []
+    for _ in range(RESTARTS + 1):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", CHILD], capture_output=True, text=True, check=True)
+        wall = time.perf_counter() - started
+        runs.append((wall, json.loads(result.stdout.strip().splitlines()[-1])))
+    runs = runs[1:]  # Первый запуск прогревает кэши .pyc и локалей
+    for _, report in runs:
+        assert not report["deferred"], f"при первом обновлении импортированы {report['deferred']}"
+    phases = defaultdict(list)
+    for _, report in runs:
+        for phase, elapsed in report["phases"]:
+            phases[phase].append(elapsed)
+    median_total = statistics.median(report["total"] for _, report in runs)
+    median_wall = statistics.median(wall for wall, _ in runs)
+    print(f"До первого обновления (медиана {RESTARTS} перезапусков): {median_total * 1000:.0f} мс от начала main, "
+          f"процесс целиком {median_wall * 1000:.0f} мс")
+    for phase, values in phases.items():
+        print(f"  {phase:20} {statistics.median(values) * 1000:8.1f} мс")
+
+
+def load_time(number: int, clear_cache: bool) -> float:
+    cache_dir = os.path.join(config.LOCALES_DIR, "__pycache__")
+    best = float("inf")
+    for _ in range(number):
+        if clear_cache:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        language_service._file_mtimes = {}
+        started = time.perf_counter()
+        language_service.load_translations()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def write_synthetic_locales(directory: str, languages: int = 4, sections: int = 200, keys: int = 25) -> int:
+    for index in range(languages):
+        tree = {f"section_{s}": {f"key_{k}": f"Текст {s}.{k} для {{name}} на странице {{page}}" if k % 3 else
+                                 f"Простой текст {s}.{k}" for k in range(keys)} for s in range(sections)}
+        with open(os.path.join(directory, f"l{index}.json" if index else f"{config.BASE_LOCAL}.json"), "w",
+                  encoding="utf-8") as f:
+            json.dump(tree, f, ensure_ascii=False)
+    return languages * sections * keys
+
+
+def locale_report() -> None:
+    original_dir = config.LOCALES_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        real_dir = os.path.join(tmp, "real")
+        shutil.copytree(original_dir, real_dir, ignore=shutil.ignore_patterns("__pycache__"))
+        synthetic_dir = os.path.join(tmp, "synthetic")
+        os.mkdir(synthetic_dir)
+        total_keys = write_synthetic_locales(synthetic_dir)
+        try:
+            for name, directory, number in (("реальные локали", real_dir, 50),
+                                            (f"синтетика, {total_keys} строк", synthetic_dir, 5)):
+                config.LOCALES_DIR = directory
+                parsed = load_time(number, clear_cache=True)
+                cached = load_time(number, clear_cache=False)
+                print(f"Переводы ({name}): разбор JSON и запись кэша {parsed * 1000:7.2f} мс, кэш marshal {cached * 1000:7.2f} мс "
+                      f"(x{parsed / cached:.1f})")
+            assert language_service.get_text("section_1.key_1", "l1", name="a", page=2) == "Текст 1.1 для a на странице 2"
+        finally:
+            config.LOCALES_DIR = original_dir
+            language_service._file_mtimes = {}
+            language_service.load_translations()
+
+
+def main() -> None:
+    logging.disable(logging.WARNING)
+    import_report()
+    first_update_report()
+    locale_report()
+
+
+if __name__ == "__main__":
+    main()
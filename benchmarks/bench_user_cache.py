@@ -0,0 +1,70 @@
+"""
+Бенчмарк определения языка в LanguageMiddleware: запрос в БД на каждое обновление против UserCache.
+
+Запуск из корня репозитория: python -m benchmarks.bench_user_cache
+"""
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+
+from aiogram.types import User as TelegramUser
+from sqlalchemy import insert
+
+from app.common.middlewares import LanguageMiddleware
+from app.database.database import count_queries, create_engine, create_session_factory, create_tables
+from app.database.models import User
+from app.services.user_service import MemoryCacheBackend, UserCache, make_db_loader, set_user_language, user_cache
+
+USERS = 2000
+UPDATES = 20000
+
+
+async def noop_handler(event, data):
+    return data['user_lang']
+
+
+async def run_case(name: str, middleware: LanguageMiddleware, engine, telegram_users) -> None:
+    rnd = random.Random(2)
+    with count_queries(engine) as counter:
+        started = time.perf_counter()
+        for _ in range(UPDATES):
+            await middleware(noop_handler, None, {"event_from_user": rnd.choice(telegram_users)})
+        elapsed = time.perf_counter() - started
+    print(f"  {name:<28} {UPDATES / elapsed:>9,.0f} updates/s, {counter.count:>6} DB queries")
+
+
+async def main() -> None:
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+        factory = create_session_factory(engine)
+        await create_tables(engine)
+        async with factory() as session:
+            await session.execute(insert(User), [{"id": i, "language": "ru"} for i in range(1, USERS + 1)])
+            await session.commit()
+        telegram_users = [TelegramUser(id=i, is_bot=False, first_name="u", language_code="en")
+                          for i in range(1, USERS + 1)]
+
+        print(f"Language resolution: {UPDATES} updates from {USERS} users")
+        no_cache = UserCache(max_size=0, ttl=0)
+        await run_case("DB on every update", LanguageMiddleware(factory, cache=no_cache), engine, telegram_users)
+        await run_case("local TTL+LRU cache", LanguageMiddleware(factory, cache=UserCache()), engine, telegram_users)
+        shared = UserCache(max_size=USERS // 4, backend=MemoryCacheBackend())
+        await run_case("small LRU + shared backend", LanguageMiddleware(factory, cache=shared), engine, telegram_users)
+
+        # Смена языка: после коммита пользователь сброшен из кэша, следующее чтение - один запрос в БД.
+        loader = make_db_loader(factory)
+        await user_cache.get(1, loader)
+        async with factory() as session:
+            await set_user_language(session, 1, "en")
+            await session.commit()
+        record = await user_cache.get(1, loader)
+        print(f"  after set_user_language + commit: language {record.language}, {user_cache.stats()}")
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""
+Бенчмарк UserLaneMiddleware: перемешанные обновления многих пользователей
+подаются в Dispatcher так же, как это делает polling (задача на обновление, в порядке прихода).
+Хэндлер "работает" случайное время, поэтому без полос порядок одного пользователя нарушается.
+
+Сравниваются: последовательная обработка (handle_as_tasks=False), параллельная без полос
+и параллельная с полосами. Порядок и минимальный выигрыш проверяет tests/test_user_lanes.py.
+
+Запуск из корня репозитория: python -m benchmarks.bench_user_lanes
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from aiogram import Dispatcher, F, Router
+from aiogram.types import Message, Update
+
+from app.common.middlewares import UserLaneMiddleware
+from tests.fake_telegram import make_fake_bot, make_message_update
+
+USERS = 50
+UPDATES_PER_USER = 40
+MAX_WORK = 0.02
+
+
+def make_dispatcher(seen: Dict[int, List[int]], lanes: Optional[UserLaneMiddleware]) -> Dispatcher:
+    router = Router(name="bench")
+    rng = random.Random(1)
+
+    @router.message(F.text)
+    async def record(message: Message) -> None:
+        # Имитация работы хэндлера (запрос к БД/API) переменной длительности.
+        await asyncio.sleep(rng.random() * MAX_WORK)
+        seen[message.from_user.id].append(int(message.text))
+
+    dp = Dispatcher()
+    if lanes is not None:
+        lanes.setup(dp)
+    dp.include_router(router)
+    return dp
+
+
+def make_updates(bot) -> List[Update]:
+    updates = []
+    for seq in range(UPDATES_PER_USER):
+        for user_id in range(1, USERS + 1):
+            raw = make_message_update(len(updates) + 1, user_id, text=str(seq))
+            updates.append(Update.model_validate(raw, context={"bot": bot}))
+    return updates
+
+
+def count_violations(seen: Dict[int, List[int]]) -> int:
+    return sum(
+        sum(1 for a, b in zip(order, order[1:]) if a > b)
+        for order in seen.values())
+
+
+async def run_case(name: str, lanes: Optional[UserLaneMiddleware], sequential: bool = False) -> float:
+    bot = make_fake_bot()
+    seen: Dict[int, List[int]] = defaultdict(list)
+    dp = make_dispatcher(seen, lanes)
+    updates = make_updates(bot)
+
+    started = time.perf_counter()
+    if sequential:
+        for update in updates:
+            await dp.feed_update(bot, update)
+    else:
+        await asyncio.gather(*(asyncio.create_task(dp.feed_update(bot, update)) for update in updates))
+    elapsed = time.perf_counter() - started
+    await dp.emit_shutdown(bot=bot)
+
+    processed = sum(len(order) for order in seen.values())
+    violations = count_violations(seen)
+    rate = processed / elapsed
+    extra = ""
+    if lanes is not None:
+        stats = lanes.stats()
+        extra = f", макс. глубина полосы {stats['max_depth']}, ожиданий места {stats['blocked']}"
+    print(f"{name:32} {rate:9.0f} обновлений/с, нарушений порядка {violations:5d}{extra}")
+    return rate
+
+
+async def main() -> None:
+    logging.disable(logging.WARNING)
+    print(f"Пользователей {USERS}, обновлений на пользователя {UPDATES_PER_USER}, "
+          f"работа хэндлера 0-{MAX_WORK * 1000:.0f} мс")
+    sequential = await run_case("последовательно", None, sequential=True)
+    await run_case("параллельно, без полос", None)
+    for lanes, queue_size in ((16, 100), (64, 100), (64, 4)):
+        rate = await run_case(f"полосы {lanes}, очередь {queue_size}", UserLaneMiddleware(lanes, queue_size))
+    print(f"Выигрыш полос над последовательной обработкой: x{rate / sequential:.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
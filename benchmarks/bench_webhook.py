@@ -0,0 +1,73 @@
+"""
+Нагрузочный стенд вебхук-сервера: шлет синтетические Update JSON в локальный WebhookServer.
+Telegram не нужен - бот работает через FakeTelegramSession.
+
+Запуск из корня репозитория: python -m benchmarks.bench_webhook [число_обновлений]
+"""
+import asyncio
+import logging
+import statistics
+import sys
+import time
+
+import aiohttp
+from aiogram import Dispatcher
+
+from app.common.middlewares import LanguageMiddleware
+from app.handlers.user_handler import user_handler
+from app.server import WebhookServer
+from app.services.language_service import load_translations
+from tests.fake_telegram import make_fake_bot, make_message_update
+
+HOST = "127.0.0.1"
+PORT = 18080
+
+
+async def run_case(dp: Dispatcher, total_updates: int, max_concurrency: int, api_latency: float) -> None:
+    bot = make_fake_bot(latency=api_latency)
+    server = WebhookServer(dp, bot, path="/webhook", max_concurrency=max_concurrency)
+    await server.start(HOST, PORT)
+
+    latencies = []
+    client_limit = asyncio.Semaphore(256)
+
+    async with aiohttp.ClientSession() as client:
+        async def post(update_id: int) -> None:
+            async with client_limit:
+                started = time.perf_counter()
+                async with client.post(f"http://{HOST}:{PORT}/webhook",
+                                       json=make_message_update(update_id, 1000 + update_id % 500)) as resp:
+                    assert resp.status == 200, resp.status
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(i) for i in range(1, total_updates + 1)))
+        await server.drain()
+        elapsed = time.perf_counter() - started
+
+        async with client.get(f"http://{HOST}:{PORT}/health") as resp:
+            health = await resp.json()
+
+    await server.stop()
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"  concurrency {max_concurrency:>4}: {total_updates / elapsed:>9,.0f} updates/s, "
+          f"HTTP p50 {statistics.median(latencies) * 1000:6.2f} ms, p95 {p95 * 1000:6.2f} ms, "
+          f"processed {health['processed']}, failed {health['failed']}")
+
+
+async def main(total_updates: int) -> None:
+    logging.disable(logging.WARNING)
+    load_translations()
+    dp = Dispatcher()
+    dp.update.middleware(LanguageMiddleware())
+    dp.include_router(user_handler)
+
+    api_latency = 0.02
+    print(f"Webhook load test: {total_updates} /start updates, simulated Bot API latency {api_latency * 1000:.0f} ms")
+    for max_concurrency in (1, 16, 128):
+        await run_case(dp, total_updates, max_concurrency, api_latency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
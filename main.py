@@ -1,31 +1,168 @@
+import time
+_process_started = time.perf_counter() # До тяжелых импортов: отсчет времени запуска
+
 import asyncio
+import importlib
 import logging
 import os
+import sys
+from typing import TYPE_CHECKING, Coroutine, Iterable, List, Set
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from app import config
-from app.common.middlewares import LanguageMiddleware
-from app.handlers.user_handler import user_handler
-from app.services.language_service import load_translations
+from app.common.middlewares import (
+    DatabaseMiddleware, FSMWriteBehindMiddleware, LanguageMiddleware, MetricsMiddleware, UserLaneMiddleware
+)
+from app.keyboards.keyboard_wrapper import keyboard_cache
+from app.services.fsm_service import CoalescingStorage, create_fsm_storage, purge_expired_fsm
+from app.services.language_service import load_translations, watch_translations
 from app.services.logger_service import setup_logging
+from app.services.metrics_service import SlowUpdateProfiler, StartupTimer, log_update_metrics, update_metrics
+from app.services.rate_service import rate_service
+from app.services.user_service import log_user_cache_stats
 from colorama import Fore, Style, init as colorama_init
 
+if TYPE_CHECKING:
+    from aiohttp import web
+
+# Роутеры в порядке подключения ("модуль:объект"); импортируются при запуске бота, список - config.ROUTERS.
+ROUTERS = (
+    "app.handlers.admin_handler:admin_handler",
+    "app.handlers.user_handler:user_handler",
+)
 
+printx = logging.getLogger(__name__)
+
+startup_timer = StartupTimer(_process_started)
 bot = Bot(token=config.TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
+dp = Dispatcher(storage=create_fsm_storage()) # Состояния FSM: память, SQL или Redis (config.FSM_STORAGE)
+startup_timer.mark("импорт")
+
+def include_routers(dp: Dispatcher, paths: Iterable[str]) -> None:
+    """Импортирует и подключает роутеры по путям "модуль:объект"."""
+    for path in paths:
+        module_name, _, name = path.partition(":")
+        dp.include_router(getattr(importlib.import_module(module_name), name))
+
+class BackgroundTasks:
+    """Фоновые задачи и HTTP-серверы бота: останавливаются shutdown-хэндлером диспетчера."""
+
+    def __init__(self):
+        self.tasks: Set[asyncio.Task] = set()
+        self.runners: List["web.AppRunner"] = []
+
+    def spawn(self, coro: Coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._finished)
+        return task
+
+    def _finished(self, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            printx.error(f"Фоновая задача {task.get_coro().__qualname__} завершилась с ошибкой",
+                         exc_info=task.exception())
+
+    async def close(self) -> None:
+        """Отменяет задачи, дожидается их и останавливает HTTP-серверы."""
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        runners, self.runners = self.runners, []
+        for runner in runners:
+            await runner.cleanup()
 
 def init() -> None:
     colorama_init()
-    print_ascii_art()
-    setup_logging(console_level=logging.DEBUG)
-    load_translations() # Загружаем переводы
+    if sys.stdout.isatty(): # Под systemd/docker арт не нужен и не тормозит перезапуск
+        print_ascii_art()
+    setup_logging(
+        console_level=logging.DEBUG,
+        console_colors=getattr(config, "LOG_COLORS", None),
+        file_format=getattr(config, "LOG_FILE_FORMAT", "text"))
+    load_translations() # Загружаем переводы (разобранные локали кэшируются в locales/__pycache__)
+    startup_timer.mark("переводы")
     asyncio.run(run_telebot()) # Запускаем бота
 
 async def run_telebot():
-    dp.update.middleware(LanguageMiddleware()) # Регистрируем middleware
-    dp.include_router(user_handler) # Регистрируем хэндлеры
-    await dp.start_polling(bot) # Запускаем бота
+    session_factory = None
+    payment_service = None
+    background = BackgroundTasks()
+    dp.shutdown.register(background.close) # Первым: задачи останавливаются до закрытия пула БД и сервисов
+    if getattr(config, "DATABASE_URL", None):
+        from app.database.database import dispose_database, init_database, log_pool_metrics
+        from app.services.broadcast_service import BroadcastEngine, resume_broadcasts
+        from app.services.ledger_service import run_ledger_compaction
+        from app.services.payment_service import create_payment_service
+        from app.services.promo_service import refresh_promo_index
+        from app.services.search_service import rebuild_index
+
+        session_factory = init_database() # Пул соединений с БД
+        dp.update.middleware(DatabaseMiddleware(session_factory))
+        background.spawn(log_pool_metrics(getattr(config, "DB_METRICS_INTERVAL", 60.0)))
+        background.spawn(log_user_cache_stats(getattr(config, "DB_METRICS_INTERVAL", 60.0)))
+        dp.shutdown.register(dispose_database)
+
+        dp["broadcast_engine"] = BroadcastEngine( # Рассылки - фоновыми задачами, останавливаются вместе с остальными
+            bot, session_factory, rate=getattr(config, "BROADCAST_RATE", 25.0), spawn=background.spawn)
+        dp.startup.register(resume_broadcasts) # Продолжаем прерванные рассылки
+        background.spawn(rebuild_index(session_factory)) # Поисковый индекс каталога
+        background.spawn(run_ledger_compaction( # Свертка журнала баланса в снимки
+            session_factory, getattr(config, "LEDGER_COMPACT_INTERVAL", 3600.0)))
+        background.spawn(refresh_promo_index( # Промокоды в памяти
+            session_factory, getattr(config, "PROMO_REFRESH_INTERVAL", 60.0)))
+        payment_service = create_payment_service(session_factory, config) # CryptoBot и Telegram Stars
+        dp["payment_service"] = payment_service
+        if payment_service.crypto is not None:
+            background.spawn(payment_service.run()) # Фоновая сверка счетов CryptoBot
+        dp.shutdown.register(payment_service.close)
+
+    dp.update.middleware(LanguageMiddleware(session_factory)) # Регистрируем middleware
+    lanes = UserLaneMiddleware(getattr(config, "UPDATE_LANES", 64), getattr(config, "UPDATE_LANE_QUEUE_SIZE", 100))
+    update_metrics.add_collector(lanes.setup(dp)) # Обновления одного пользователя - строго по порядку
+    if isinstance(dp.storage, CoalescingStorage):
+        FSMWriteBehindMiddleware(dp.storage).setup(dp) # Одна запись FSM на обновление
+        background.spawn(purge_expired_fsm(dp.storage, getattr(config, "FSM_PURGE_INTERVAL", 3600.0)))
+    slow_update_threshold = getattr(config, "SLOW_UPDATE_THRESHOLD", None)
+    profiler = SlowUpdateProfiler(
+        slow_update_threshold,
+        mode=getattr(config, "SLOW_UPDATE_PROFILER", "stack"),
+        sample_rate=getattr(config, "SLOW_UPDATE_SAMPLE_RATE", 1.0),
+    ) if slow_update_threshold else None
+    MetricsMiddleware(update_metrics, profiler).setup(dp) # Метрики задержек хэндлеров; после полос - без ожидания в очереди
+    update_metrics.add_collector(keyboard_cache) # Попадания кэша клавиатур - в /metrics и периодический лог
+    background.spawn(log_update_metrics(getattr(config, "METRICS_LOG_INTERVAL", 60.0)))
+    include_routers(dp, getattr(config, "ROUTERS", ROUTERS)) # Регистрируем хэндлеры
+    startup_timer.mark("сервисы и роутеры")
+
+    dp["rate_service"] = rate_service
+    dp.startup.register(rate_service.start) # Фоновое обновление курса RUB/USD
+    dp.shutdown.register(rate_service.close)
+
+    watch_interval = getattr(config, "LOCALES_WATCH_INTERVAL", 5.0)
+    if watch_interval:
+        background.spawn(watch_translations(watch_interval)) # Горячая перезагрузка переводов
+
+    dp.startup.register(startup_timer.log_report) # Сколько занял запуск и его этапы
+
+    if getattr(config, "BOT_MODE", "polling") == "webhook":
+        from app.server import run_webhook
+        await run_webhook(dp, bot, update_metrics, payment_service) # Вебхук; /metrics и вебхук CryptoBot на том же сервере
+    else:
+        metrics_port = getattr(config, "METRICS_PORT", None)
+        if metrics_port:
+            from app.server import start_metrics_server
+            background.runners.append(await start_metrics_server(
+                update_metrics, getattr(config, "METRICS_HOST", "0.0.0.0"), metrics_port))
+        payments_port = getattr(config, "CRYPTOBOT_WEBHOOK_PORT", None)
+        if payment_service is not None and payment_service.crypto is not None and payments_port:
+            from app.server import start_payment_server
+            background.runners.append(await start_payment_server(
+                payment_service, getattr(config, "CRYPTOBOT_WEBHOOK_HOST", "0.0.0.0"),
+                payments_port, getattr(config, "CRYPTOBOT_WEBHOOK_PATH", "/cryptobot")))
+        await dp.start_polling(bot) # Запускаем бота
 
 def print_ascii_art():
     print(rf"{Fore.CYAN}{Style.BRIGHT} ________   ________  ______{Fore.MAGENTA}___  ________  ___  ___  ________  ________   ")
@@ -45,5 +182,6 @@ def cls():
     os.system('cls' if os.name=='nt' else 'clear')
 
 if __name__ == "__main__":
-    cls()
+    if sys.stdout.isatty():
+        cls()
     init()
\ No newline at end of file
@@ -0,0 +1,46 @@
+"""
+Общие фикстуры тестов. Асинхронные сценарии запускаются через asyncio.run внутри обычных
+тестовых функций - без плагинов pytest; БД - временный SQLite на aiosqlite.
+"""
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Tuple
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+from app.database.database import create_engine, create_session_factory, create_tables
+
+
+@pytest.fixture(autouse=True)
+def quiet_logs():
+    logging.disable(logging.WARNING)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+@pytest.fixture
+def db_url(tmp_path) -> str:
+    return f"sqlite+aiosqlite:///{os.path.join(tmp_path, 'test.db')}"
+
+
+@pytest.fixture
+def database(db_url) -> Callable[..., Any]:
+    """
+    Временная БД со схемой: ``async with database() as (db_engine, factory)`` внутри сценария.
+    Движок создается в цикле событий сценария (asyncio.run) и закрывается на выходе из блока.
+
+    :param engine_kwargs: Параметры пула для create_engine (pool_size, max_overflow).
+    """
+
+    @asynccontextmanager
+    async def open_database(**engine_kwargs: Any) -> AsyncIterator[Tuple[AsyncEngine, async_sessionmaker]]:
+        db_engine = create_engine(db_url, **engine_kwargs)
+        try:
+            await create_tables(db_engine)
+            yield db_engine, create_session_factory(db_engine)
+        finally:
+            await db_engine.dispose()
+
+    return open_database
@@ -0,0 +1,110 @@
+"""
+Офлайн-заглушка Crypto Pay API для тестов и бенчмарков: локальный HTTP-сервер с createInvoice и getInvoices
+в формате настоящего API (клиент aiocryptopay ходит в него как в pay.crypt.bot), счетами в памяти,
+искусственной задержкой ответа, счетчиком запросов и подписанными вебхуками invoice_paid.
+"""
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
+
+from aiohttp import ClientSession, web
+
+FAKE_CRYPTOBOT_TOKEN = "1234:BENCHMARK-CRYPTOPAY"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+class FakeCryptoBot:
+    """
+    :param token: Токен приложения; запросы с другим Crypto-Pay-API-Token получают UNAUTHORIZED.
+    :param latency: Задержка ответа API в секундах (имитация сети до pay.crypt.bot).
+    """
+
+    def __init__(self, token: str = FAKE_CRYPTOBOT_TOKEN, latency: float = 0.0):
+        self.token = token
+        self.latency = latency
+        self.requests: Counter = Counter()
+        self.invoices: Dict[int, Dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+        self._updates = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    def create(self, amount: float, payload: Optional[str] = None) -> Dict[str, Any]:
+        """Создает счет без HTTP (быстрое наполнение для бенчмарка)."""
+        invoice_id = next(self._ids)
+        invoice = {
+            "invoice_id": invoice_id, "status": "active", "hash": f"IV{invoice_id}", "amount": str(amount),
+            "currency_type": "fiat", "fiat": "USD", "payload": payload, "created_at": _now(),
+            "allow_comments": True, "allow_anonymous": True,
+            "bot_invoice_url": f"https://t.me/CryptoBot?start=IV{invoice_id}",
+            "web_app_invoice_url": f"https://app.send.tg/invoices/IV{invoice_id}",
+            "mini_app_invoice_url": f"https://t.me/CryptoBot/app?startapp=invoice-IV{invoice_id}",
+        }
+        self.invoices[invoice_id] = invoice
+        return invoice
+
+    def pay(self, invoice_ids: Iterable[int]) -> None:
+        for invoice_id in invoice_ids:
+            self.invoices[invoice_id].update(status="paid", paid_at=_now())
+
+    def expire(self, invoice_ids: Iterable[int]) -> None:
+        for invoice_id in invoice_ids:
+            self.invoices[invoice_id]["status"] = "expired"
+
+    def sign(self, body: str, token: Optional[str] = None) -> str:
+        secret = hashlib.sha256((token or self.token).encode()).digest()
+        return hmac.new(secret, body.encode(), hashlib.sha256).hexdigest()
+
+    def webhook_body(self, invoice_id: int) -> str:
+        return json.dumps({"update_id": next(self._updates), "update_type": "invoice_paid",
+                           "request_date": _now(), "payload": self.invoices[invoice_id]})
+
+    async def send_webhook(self, session: ClientSession, url: str, invoice_id: int, token: Optional[str] = None) -> int:
+        """POST подписанного invoice_paid на url. :param token: Подписать чужим токеном. :return: HTTP-статус."""
+        body = self.webhook_body(invoice_id)
+        headers = {"Crypto-Pay-Api-Signature": self.sign(body, token), "Content-Type": "application/json"}
+        async with session.post(url, data=body, headers=headers) as response:
+            return response.status
+
+    async def _reply(self, request: web.Request, result: Any) -> web.Response:
+        self.requests[request.path] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if request.headers.get("Crypto-Pay-API-Token") != self.token:
+            return web.json_response({"ok": False, "error": {"code": 401, "name": "UNAUTHORIZED"}})
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_create_invoice(self, request: web.Request) -> web.Response:
+        query = request.query
+        return await self._reply(request, self.create(float(query["amount"]), query.get("payload")))
+
+    async def handle_get_invoices(self, request: web.Request) -> web.Response:
+        ids = [int(i) for i in request.query.get("invoice_ids", "").split(",") if i]
+        count = int(request.query.get("count", 100))
+        items = [self.invoices[i] for i in ids if i in self.invoices][:count]
+        return await self._reply(request, {"items": items})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер. :return: Базовый URL для AioCryptoPay(network=...)."""
+        app = web.Application()
+        app.router.add_get("/api/createInvoice", self.handle_create_invoice)
+        app.router.add_get("/api/getInvoices", self.handle_get_invoices)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.url = f"http://{host}:{site._server.sockets[0].getsockname()[1]}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
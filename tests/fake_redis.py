@@ -0,0 +1,55 @@
+"""
+Офлайн-заглушка Redis для тестов и бенчмарков: подмножество команд redis.asyncio.Redis (get, set с ex/px, delete, aclose)
+в памяти процесса, с истечением ключей, счетчиком команд и искусственной задержкой сети.
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+class FakeRedis:
+    """
+    :param latency: Задержка каждой команды в секундах (имитация round trip до сервера).
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.commands = 0
+        self._values: Dict[str, Tuple[bytes, Optional[float]]] = {}
+
+    async def _round_trip(self) -> None:
+        self.commands += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _alive(self, name: str) -> Optional[bytes]:
+        item = self._values.get(name)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[name]
+            return None
+        return value
+
+    async def get(self, name: str) -> Optional[bytes]:
+        await self._round_trip()
+        return self._alive(name)
+
+    async def set(self, name: str, value: Any, ex: Optional[int] = None, px: Optional[int] = None) -> bool:
+        await self._round_trip()
+        if isinstance(value, str):
+            value = value.encode()
+        ttl = ex if ex else px / 1000 if px else None
+        self._values[name] = (value, time.monotonic() + ttl if ttl else None)
+        return True
+
+    async def delete(self, *names: str) -> int:
+        await self._round_trip()
+        return sum(self._values.pop(name, None) is not None for name in names)
+
+    def dbsize(self) -> int:
+        return sum(self._alive(name) is not None for name in list(self._values))
+
+    async def aclose(self) -> None:
+        pass
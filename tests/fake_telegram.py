@@ -0,0 +1,121 @@
+"""
+Офлайн-заглушка Telegram Bot API для тестов и бенчмарков: сессия бота без сети и фабрики синтетических Update.
+"""
+import asyncio
+import datetime
+import itertools
+from collections import Counter
+from typing import Any, AsyncGenerator, Dict, Optional, Set
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.types import Chat, Message, User
+
+BENCH_BOT_TOKEN = "42:BENCHMARK-TOKEN"
+
+
+class FakeTelegramSession(BaseSession):
+    """
+    Сессия aiogram, которая отвечает на любые методы Bot API локально.
+    :param latency: Искусственная задержка ответа в секундах (имитация сети).
+    :param flood_every: Каждый N-й sendMessage отвечает RetryAfter (0 - никогда).
+    :param retry_after: Значение retry_after для имитации flood control, секунд.
+    :param blocked_chats: Чаты, заблокировавшие бота (sendMessage -> Forbidden).
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        flood_every: int = 0,
+        retry_after: int = 1,
+        blocked_chats: Optional[Set[int]] = None,
+        **kwargs: Any
+    ):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.blocked_chats = blocked_chats or set()
+        self.floods = 0
+        self.requests: Counter = Counter()
+        self.sent_to: Counter = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def close(self) -> None:
+        pass
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: Optional[int] = None) -> Any:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.requests[method.__api_method__] += 1
+        chat_id = getattr(method, "chat_id", None)
+        if method.__api_method__ == "sendMessage":
+            if self.flood_every and self.requests["sendMessage"] % self.flood_every == 0:
+                self.floods += 1
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=self.retry_after)
+            if chat_id in self.blocked_chats:
+                raise TelegramForbiddenError(method=method, message="Forbidden: bot was blocked by the user")
+        if chat_id is not None:
+            self.sent_to[chat_id] += 1
+        return self._fake_result(bot, method)
+
+    async def stream_content(self, url: str, *args: Any, **kwargs: Any) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    def _fake_result(self, bot: Bot, method: TelegramMethod[Any]) -> Any:
+        returning = method.__returning__
+        if returning is Message:
+            chat_id = getattr(method, "chat_id", 0)
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.datetime.now(datetime.timezone.utc),
+                chat=Chat(id=chat_id, type="private"),
+                text=getattr(method, "text", None),
+            )
+        if returning is User:
+            return User(id=bot.id, is_bot=True, first_name="bench", username="bench_bot")
+        return True
+
+
+def make_fake_bot(latency: float = 0.0, **session_kwargs: Any) -> Bot:
+    return Bot(token=BENCH_BOT_TOKEN, session=FakeTelegramSession(latency=latency, **session_kwargs))
+
+
+def make_message_update(update_id: int, user_id: int, text: str = "/start", language_code: str = "ru") -> Dict[str, Any]:
+    """Синтетическое обновление с текстовым сообщением в личный чат."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1_700_000_000,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}",
+                     "username": f"user{user_id}", "language_code": language_code},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+            if text.startswith("/") else None,
+        },
+    }
+
+
+def make_callback_update(update_id: int, user_id: int, data: str, language_code: str = "ru") -> Dict[str, Any]:
+    """Синтетическое обновление с нажатием инлайн-кнопки."""
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "language_code": language_code}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": 1_700_000_000,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 42, "is_bot": True, "first_name": "bench"},
+                "text": "menu",
+            },
+        },
+    }
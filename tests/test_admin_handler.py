@@ -0,0 +1,81 @@
+import asyncio
+from typing import Any, List, Optional
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import InlineKeyboardMarkup, Update
+
+from app import config
+from app.common.middlewares import LanguageMiddleware
+from app.database.database import SessionProvider
+from app.database.models import Category, Product
+from app.handlers.admin_handler import admin_handler
+from app.keyboards.keyboard_wrapper import CATALOG_MENU, keyboard_cache
+from app.services.language_service import get_text, load_translations
+from app.services.search_service import catalog_index, index_product
+from tests.fake_telegram import BENCH_BOT_TOKEN, FakeTelegramSession, make_message_update
+
+
+class RecordingSession(FakeTelegramSession):
+    """Запоминает тексты отправленных ботом сообщений."""
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.texts: List[str] = []
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: Optional[int] = None) -> Any:
+        if method.__api_method__ == "sendMessage":
+            self.texts.append(method.text)
+        return await super().make_request(bot, method, timeout)
+
+
+# Роутер подключается к диспетчеру один раз, поэтому диспетчер общий для модуля.
+# Как в main без DATABASE_URL: ни DatabaseMiddleware, ни broadcast_engine; тесты передают db сами.
+dp = Dispatcher()
+dp.update.middleware(LanguageMiddleware())
+dp.include_router(admin_handler)
+
+
+async def send(text: str, **data: Any) -> List[str]:
+    """Передает диспетчеру команду администратора. :return: Тексты ответов бота."""
+    session = RecordingSession()
+    bot = Bot(BENCH_BOT_TOKEN, session=session)
+    update = Update.model_validate(make_message_update(1, 1, text=text), context={"bot": bot})
+    await dp.feed_update(bot, update, **data)
+    return session.texts
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setattr(config, "ADMIN_IDS", (1,), raising=False)
+    load_translations()
+
+
+def test_broadcast_without_database_is_reported_unavailable(admin):
+    assert asyncio.run(send("/broadcast hello")) == [get_text("admin.broadcast.unavailable")]
+
+
+def test_remove_lot_unpublishes_the_lot(admin, database):
+    async def scenario():
+        async with database() as (_, factory):
+            async with factory() as session:
+                session.add(Category(id=1, name="VPN"))
+                session.add(product := Product(id=7, category_id=1, title="vpn lot"))
+                await session.commit()
+            index_product(product, "VPN")
+            keyboard_cache.put(("ru", CATALOG_MENU), InlineKeyboardMarkup(inline_keyboard=[]))
+
+            db = SessionProvider(factory)
+            replies = [*await send("/remove_lot", db=db), *await send("/remove_lot 7", db=db),
+                       *await send("/remove_lot 8", db=db), *await send("/remove_lot 7")]
+            await db.close()
+            async with factory() as session:
+                active = (await session.get(Product, 7)).is_active
+
+            assert replies == [get_text("admin.lots.usage"), get_text("admin.lots.removed", product_id=7),
+                               get_text("admin.lots.not_found", product_id=8), get_text("admin.lots.unavailable")]
+            assert not active and 7 not in catalog_index
+            assert keyboard_cache.get(("ru", CATALOG_MENU)) is None
+
+    asyncio.run(scenario())
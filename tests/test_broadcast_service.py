@@ -0,0 +1,174 @@
+import asyncio
+from typing import Any, Dict, Optional, Set
+
+import pytest
+from aiogram import Bot
+from aiogram.exceptions import TelegramNotFound, TelegramServerError
+from aiogram.methods import TelegramMethod
+from sqlalchemy import insert
+
+from app.database import requests
+from app.database.models import User
+from app.services.broadcast_service import BroadcastEngine, start_broadcast_task
+from tests.fake_telegram import BENCH_BOT_TOKEN, FakeTelegramSession
+
+USERS = 20
+
+
+class ScriptedSession(FakeTelegramSession):
+    """
+    Сессия, которой тест управляет по чатам: hold - отправка висит до отмены,
+    errors - исключения, которые по очереди получит чат до успешной отправки.
+    """
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.hold: Set[int] = set()
+        self.errors: Dict[int, list] = {}
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: Optional[int] = None) -> Any:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id in self.hold:
+            await asyncio.Event().wait()
+        if self.errors.get(chat_id):
+            raise self.errors[chat_id].pop(0)
+        return await super().make_request(bot, method, timeout)
+
+
+async def setup_broadcast(factory) -> int:
+    async with factory() as session:
+        await session.execute(insert(User), [{"id": i} for i in range(1, USERS + 1)])
+        broadcast = await requests.create_broadcast(session, 1, "Hello!")
+        await session.commit()
+    return broadcast.id
+
+
+async def interrupt(engine: BroadcastEngine, session: ScriptedSession, broadcast_id: int, sent_before: int) -> None:
+    """Запускает рассылку, ждет, пока будет обработано все, кроме зависших чатов, и прерывает ее."""
+    task = asyncio.create_task(engine.run(broadcast_id))
+    while sum(session.sent_to.values()) < sent_before:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def test_resume_after_two_restarts_does_not_resend(database):
+    async def scenario():
+        async with database() as (_, factory):
+            broadcast_id = await setup_broadcast(factory)
+            session = ScriptedSession()
+            engine = BroadcastEngine(Bot(BENCH_BOT_TOKEN, session=session), factory, rate=1000, workers=4,
+                                     per_chat_interval=0.01, checkpoint_interval=60)
+
+            # Первый запуск: чат 1 зависает, остальные обработаны не по порядку - контрольная точка стоит на 0.
+            session.hold = {1}
+            await interrupt(engine, session, broadcast_id, USERS - 1)
+            async with factory() as s:
+                first = await requests.get_broadcast(s, broadcast_id)
+            assert first.last_user_id == 0 and first.done_ahead == ",".join(str(i) for i in range(2, USERS + 1))
+
+            # Второй запуск снова прерван до того, как контрольная точка прошла унаследованные id.
+            await interrupt(engine, session, broadcast_id, USERS - 1)
+            async with factory() as s:
+                second = await requests.get_broadcast(s, broadcast_id)
+            assert second.last_user_id == 0 and second.done_ahead == first.done_ahead
+
+            session.hold = set()
+            progress = await engine.run(broadcast_id)
+            async with factory() as s:
+                final = await requests.get_broadcast(s, broadcast_id)
+
+            assert progress.finished and final.status == "done"
+            assert dict(session.sent_to) == {i: 1 for i in range(1, USERS + 1)}
+
+    asyncio.run(scenario())
+
+
+def test_telegram_api_errors_are_retried_or_skipped(database):
+    async def scenario():
+        async with database() as (_, factory):
+            broadcast_id = await setup_broadcast(factory)
+            session = ScriptedSession()
+            session.errors = {3: [TelegramServerError(method=None, message="Bad Gateway")],
+                              5: [TelegramNotFound(method=None, message="chat not found")]}
+            engine = BroadcastEngine(Bot(BENCH_BOT_TOKEN, session=session), factory, rate=1000, workers=4,
+                                     per_chat_interval=0.01)
+            progress = await asyncio.wait_for(engine.run(broadcast_id), 10)
+
+            assert progress.finished and progress.retries == 1
+            assert progress.sent == USERS - 1 and progress.failed == 1
+            assert 5 not in session.sent_to and session.sent_to[3] == 1
+
+    asyncio.run(scenario())
+
+
+def test_flood_control_and_blocked_chats(database):
+    async def scenario():
+        async with database() as (_, factory):
+            broadcast_id = await setup_broadcast(factory)
+            session = ScriptedSession(flood_every=7, retry_after=0, blocked_chats={4, 9})
+            engine = BroadcastEngine(Bot(BENCH_BOT_TOKEN, session=session), factory, rate=1000, workers=4,
+                                     per_chat_interval=0.01)
+            progress = await asyncio.wait_for(engine.run(broadcast_id), 10)
+
+            assert progress.finished and session.floods > 0
+            assert progress.sent == USERS - 2 and progress.failed == 2
+            assert dict(session.sent_to) == {i: 1 for i in range(1, USERS + 1) if i not in (4, 9)}
+
+    asyncio.run(scenario())
+
+
+def test_unexpected_error_stops_all_workers(database):
+    async def scenario():
+        async with database() as (_, factory):
+            broadcast_id = await setup_broadcast(factory)
+            session = ScriptedSession(latency=0.01)
+            session.errors = {10: [RuntimeError("boom")]}
+            engine = BroadcastEngine(Bot(BENCH_BOT_TOKEN, session=session), factory, rate=1000, workers=4,
+                                     per_chat_interval=0.01)
+            with pytest.raises(RuntimeError):
+                await engine.run(broadcast_id)
+            sent = sum(session.sent_to.values())
+            await asyncio.sleep(0.1)
+            async with factory() as s:
+                broadcast = await requests.get_broadcast(s, broadcast_id)
+
+            # После выхода из run никто не продолжает слать в фоне, а рассылка остается к возобновлению.
+            assert sum(session.sent_to.values()) == sent < USERS
+            assert broadcast.status == "running"
+
+    asyncio.run(scenario())
+
+
+def test_broadcast_task_is_started_through_engine_spawn(database):
+    async def scenario():
+        async with database() as (_, factory):
+            broadcast_id = await setup_broadcast(factory)
+            session = ScriptedSession()
+            session.hold = {USERS}
+            spawned = []
+
+            def spawn(coro):
+                # Как BackgroundTasks.spawn в main: задача попадает в общий набор для остановки.
+                task = asyncio.create_task(coro)
+                spawned.append(task)
+                return task
+
+            engine = BroadcastEngine(Bot(BENCH_BOT_TOKEN, session=session), factory, rate=1000, workers=4,
+                                     per_chat_interval=0.01, checkpoint_interval=0.01, spawn=spawn)
+            first = start_broadcast_task(engine, broadcast_id)
+            again = start_broadcast_task(engine, broadcast_id)
+            while sum(session.sent_to.values()) < USERS - 1:
+                await asyncio.sleep(0.01)
+            for task in spawned:
+                task.cancel()
+            await asyncio.gather(*spawned, return_exceptions=True)
+            async with factory() as s:
+                broadcast = await requests.get_broadcast(s, broadcast_id)
+
+            assert spawned == [first] and again is first and first.cancelled()
+            # Остановка при выключении бота оставляет рассылку к возобновлению.
+            assert broadcast.status == "running"
+
+    asyncio.run(scenario())
@@ -0,0 +1,26 @@
+import asyncio
+
+from app.database.database import PoolMetrics, SessionProvider
+
+
+def test_pool_wait_counts_only_waiting_for_a_free_connection(database):
+    async def scenario():
+        async with database(pool_size=1, max_overflow=0) as (db_engine, factory):
+            await db_engine.dispose()  # Соединение create_tables закрыто: пул пуст
+            metrics = PoolMetrics()
+
+            holder = SessionProvider(factory, metrics)
+            await holder.get()  # Новое подключение: это connect, а не ожидание пула
+            fresh_waits = metrics.waits
+
+            waiter = SessionProvider(factory, metrics)
+            waiting = asyncio.create_task(waiter.get())
+            await asyncio.sleep(0.2)
+            await holder.close()
+            await waiting
+            await waiter.close()
+
+            assert fresh_waits == 0
+            assert metrics.waits == 1 and metrics.max_wait >= 0.15
+
+    asyncio.run(scenario())
@@ -0,0 +1,112 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import select
+
+from app.database.models import FSMRecord
+from app.services.fsm_service import CoalescingStorage, FSMBackend, RedisFSMBackend, SQLFSMBackend
+from tests.fake_redis import FakeRedis
+
+KEY = StorageKey(bot_id=42, chat_id=1, user_id=1)
+
+
+class CountingBackend(FSMBackend):
+    """Обертка над backend, считающая его вызовы."""
+
+    def __init__(self, inner: FSMBackend):
+        self.inner = inner
+        self.reads = self.writes = self.deletes = 0
+
+    async def read(self, key: str):
+        self.reads += 1
+        return await self.inner.read(key)
+
+    async def write(self, key: str, state: Optional[str], data: Dict[str, Any], ttl: Optional[float]) -> None:
+        self.writes += 1
+        await self.inner.write(key, state, data, ttl)
+
+    async def delete(self, key: str) -> None:
+        self.deletes += 1
+        await self.inner.delete(key)
+
+
+@asynccontextmanager
+async def open_backend(kind: str, database):
+    if kind == "redis":
+        yield CountingBackend(RedisFSMBackend(FakeRedis()))
+        return
+    async with database() as (_, factory):
+        yield CountingBackend(SQLFSMBackend(factory))
+
+
+@pytest.mark.parametrize("kind", ["redis", "sql"])
+def test_changes_in_one_update_are_written_once(database, kind):
+    async def scenario():
+        async with open_backend(kind, database) as backend:
+            storage = CoalescingStorage(backend)
+            async with storage.update_scope():
+                await storage.set_state(KEY, "Checkout:amount")
+                await storage.update_data(KEY, {"amount": 5})
+                await storage.update_data(KEY, {"currency": "USD"})
+                assert backend.writes == 0
+            writes = backend.writes
+            state, data = await storage.get_state(KEY), await storage.get_data(KEY)
+
+            assert writes == 1 and backend.reads == 3
+            assert (state, data) == ("Checkout:amount", {"amount": 5, "currency": "USD"})
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("kind", ["redis", "sql"])
+def test_writes_outside_update_scope_go_straight_to_backend(database, kind):
+    async def scenario():
+        async with open_backend(kind, database) as backend:
+            storage = CoalescingStorage(backend)
+            await storage.set_state(KEY, "Menu:main")
+            after_state = backend.writes
+            await storage.set_data(KEY, {"page": 2})
+            after_data = backend.writes
+            await storage.set_state(KEY, None)
+            await storage.set_data(KEY, {})
+
+            assert (after_state, after_data) == (1, 2)
+            assert backend.deletes == 1 and await backend.read(storage.key_builder.build(KEY)) is None
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("kind", ["redis", "sql"])
+def test_expired_record_reads_as_empty(database, kind):
+    async def scenario():
+        async with open_backend(kind, database) as backend:
+            # Дробный TTL меньше секунды: запись не должна жить вечно или дольше ttl.
+            storage = CoalescingStorage(backend, ttl=0.2)
+            await storage.set_state(KEY, "Menu:main")
+            fresh = await storage.get_state(KEY)
+            await asyncio.sleep(0.3)
+
+            assert fresh == "Menu:main"
+            assert await storage.get_state(KEY) is None and await storage.get_data(KEY) == {}
+
+    asyncio.run(scenario())
+
+
+def test_purge_expired_deletes_rows(database):
+    async def scenario():
+        async with database() as (_, factory):
+            backend = SQLFSMBackend(factory)
+            await backend.write("expired", "Menu:main", {}, ttl=0.1)
+            await backend.write("alive", "Menu:main", {}, ttl=60)
+            await backend.write("forever", "Menu:main", {}, ttl=None)
+            await asyncio.sleep(0.2)
+            deleted = await backend.purge_expired()
+            async with factory() as session:
+                keys = (await session.execute(select(FSMRecord.key).order_by(FSMRecord.key))).scalars().all()
+
+            assert deleted == 1 and keys == ["alive", "forever"]
+
+    asyncio.run(scenario())
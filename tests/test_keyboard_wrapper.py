@@ -0,0 +1,113 @@
+import asyncio
+from typing import List, Optional
+
+import pytest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from app.keyboards.keyboard_wrapper import KeyboardBuilder, KeyboardCache, PageCallbackData, PageWindow, keyboard_cache
+from app.services.metrics_service import UpdateMetrics
+
+
+def build_menu():
+    return (KeyboardBuilder(lambda key, **kwargs: key)
+            .add_button("VPN", callback_data="cat:1")
+            .add_button("Netflix", callback_data="cat:2")
+            .build(cache_key=("ru", "test-menu")))
+
+
+def test_mutating_cached_keyboard_does_not_affect_other_callers():
+    keyboard_cache.invalidate(menu="test-menu")
+    built = build_menu()
+    built.inline_keyboard[0][0].text = "changed"
+    cached = build_menu()
+    cached.inline_keyboard.append([InlineKeyboardButton(text="extra", callback_data="x")])
+    cached.inline_keyboard[1][0].text = "changed"
+    again = build_menu()
+    keyboard_cache.invalidate(menu="test-menu")
+
+    assert keyboard_cache.stats()["hits"] >= 2
+    assert [[button.text for button in row] for row in again.inline_keyboard] == [["VPN"], ["Netflix"]]
+    assert again.model_dump(exclude_none=True) == {"inline_keyboard": [
+        [{"text": "VPN", "callback_data": "cat:1"}], [{"text": "Netflix", "callback_data": "cat:2"}]]}
+
+
+def test_cache_stats_are_exported_as_metrics():
+    cache = KeyboardCache()
+    cache.put(("ru", "test-menu"), build_menu())
+    cache.get(("ru", "test-menu"))
+    cache.get(("en", "test-menu"))
+    metrics = UpdateMetrics()
+    metrics.add_collector(cache)
+
+    text = metrics.render_prometheus()
+
+    assert "notshop_keyboard_cache_size 1\n" in text
+    assert "notshop_keyboard_cache_hits_total 1\n" in text
+    assert "notshop_keyboard_cache_misses_total 1\n" in text
+
+
+ITEMS = 12
+PER_PAGE = 5
+PROVIDER = {"factory": PageCallbackData, "action": "catalog"}
+
+
+def translate(key: str, **kwargs) -> str:
+    return " ".join([key.rsplit(".", 1)[-1], *map(str, kwargs.values())])
+
+
+def offset_source(count: int):
+    def fetch(page: int, per_page: int) -> PageWindow:
+        start = (page - 1) * per_page
+        return PageWindow([{"text": str(i)} for i in range(start + 1, min(start + per_page, count) + 1)], total=count)
+    return fetch
+
+
+def keyset_source(count: int):
+    def fetch(page: int, per_page: int) -> PageWindow:
+        start = (page - 1) * per_page
+        return PageWindow([{"text": str(i)} for i in range(start + 1, min(start + per_page, count) + 1)],
+                          has_next=start + per_page < count)
+    return fetch
+
+
+def build_page(source, page: int) -> InlineKeyboardMarkup:
+    return asyncio.run(KeyboardBuilder(translate).build_paginated(
+        source, PER_PAGE, current_page=page, default_row_width=PER_PAGE, page_callback_data_provider=PROVIDER))
+
+
+def texts(markup: InlineKeyboardMarkup) -> List[List[str]]:
+    return [[button.text for button in row] for row in markup.inline_keyboard]
+
+
+def next_page(markup: InlineKeyboardMarkup) -> Optional[int]:
+    for button in markup.inline_keyboard[-1]:
+        if button.text == "next":
+            return PageCallbackData.unpack(button.callback_data).page_num
+    return None
+
+
+def test_offset_pagination_shows_page_of_total():
+    source = offset_source(ITEMS)
+    first, middle, last, beyond = (build_page(source, page) for page in (1, 2, 3, 9))
+
+    assert texts(first) == [["1", "2", "3", "4", "5"], ["current_page 1 3", "next"]]
+    assert texts(middle) == [["6", "7", "8", "9", "10"], ["prev", "current_page 2 3", "next"]]
+    assert texts(last) == [["11", "12"], ["prev", "current_page 3 3"]]
+    # Страница за пределами каталога (товары удалили) - показывается последняя.
+    assert texts(beyond) == texts(last)
+    assert (next_page(first), next_page(middle)) == (2, 3)
+
+
+def test_keyset_pagination_does_not_invent_total():
+    source = keyset_source(ITEMS)
+    first, middle, last = (build_page(source, page) for page in (1, 2, 3))
+
+    assert texts(first) == [["1", "2", "3", "4", "5"], ["current_page_open 1", "next"]]
+    assert texts(middle) == [["6", "7", "8", "9", "10"], ["prev", "current_page_open 2", "next"]]
+    assert texts(last) == [["11", "12"], ["prev", "current_page_open 3"]]
+    assert (next_page(first), next_page(middle)) == (2, 3)
+
+
+@pytest.mark.parametrize("source", [offset_source(0), keyset_source(0)], ids=["offset", "keyset"])
+def test_empty_source_has_no_pagination(source):
+    assert texts(build_page(source, 1)) == []
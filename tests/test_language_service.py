@@ -0,0 +1,134 @@
+import json
+import os
+
+import pytest
+
+from app import config
+from app.services import language_service
+from app.services.language_service import get_text, load_translations, reload_translations
+
+RU = {
+    "welcome": "Привет, {name}!",
+    "buttons": {"pagination": {"next": "Далее", "page": "Стр. {page} из {total}"}},
+    "limits": {"max": 5},
+}
+EN = {
+    "welcome": "Hello, {name}!",
+    "buttons": {"pagination": {"next": "Next"}},
+}
+
+
+def write_locale(directory, lang: str, tree: dict, mtime_ns: int = None) -> str:
+    path = os.path.join(directory, f"{lang}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(tree, f, ensure_ascii=False)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+@pytest.fixture
+def locales(tmp_path, monkeypatch):
+    """Каталог локалей во временной папке; состояние модуля переводов восстанавливается после теста."""
+    monkeypatch.setattr(config, "LOCALES_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "BASE_LOCAL", "ru")
+    monkeypatch.delattr(config, "LOCALES_CACHE_DIR", raising=False)
+    for name, value in (("translations", {}), ("_catalogs", {}), ("_flat_translations", {}),
+                        ("_template_fields_by_lang", {}), ("_file_mtimes", {}), ("_reload_listeners", [])):
+        monkeypatch.setattr(language_service, name, value)
+    write_locale(tmp_path, "ru", RU)
+    write_locale(tmp_path, "en", EN)
+    return tmp_path
+
+
+def test_nested_keys_are_flattened(locales):
+    load_translations()
+
+    assert get_text("buttons.pagination.next", "ru") == "Далее"
+    assert get_text("buttons.pagination.page", "ru", page=2, total=5) == "Стр. 2 из 5"
+    assert get_text("welcome", "en", name="Ann") == "Hello, Ann!"
+    # Не строки пропускаются, а не ломают загрузку.
+    assert get_text("limits.max", "ru") == "limits.max"
+
+
+def test_missing_keys_and_languages_fall_back_to_base_locale(locales):
+    load_translations()
+
+    assert get_text("buttons.pagination.page", "en", page=1, total=3) == "Стр. 1 из 3"
+    assert get_text("buttons.pagination.next", "de") == "Далее"
+    assert get_text("no.such.key", "en") == "no.such.key"
+
+
+def test_parsed_locale_is_cached_until_the_file_changes(locales, monkeypatch):
+    parsed = []
+    json_load = json.load
+
+    def counting_load(f, *args, **kwargs):
+        parsed.append(os.path.basename(f.name))
+        return json_load(f, *args, **kwargs)
+
+    monkeypatch.setattr(language_service.json, "load", counting_load)
+    load_translations()
+    first = sorted(parsed)
+    parsed.clear()
+    load_translations()
+    cached = list(parsed)
+
+    stat = os.stat(os.path.join(locales, "en.json"))
+    write_locale(locales, "en", dict(EN, welcome="Hi, {name}!"), mtime_ns=stat.st_mtime_ns + 1_000_000_000)
+    reload_translations()
+
+    assert first == ["en.json", "ru.json"]
+    assert os.path.exists(os.path.join(locales, "__pycache__", "ru.marshal"))
+    assert cached == []
+    assert parsed == ["en.json"]
+    assert get_text("welcome", "en", name="Ann") == "Hi, Ann!"
+
+
+def test_reload_swaps_the_whole_catalog_at_once(locales):
+    load_translations()
+    old_catalogs = language_service._catalogs
+    seen = []
+    language_service.add_reload_listener(lambda: seen.append(get_text("buttons.pagination.next", "en")))
+
+    write_locale(locales, "en", dict(EN, buttons={"pagination": {"next": "Forward"}}),
+                 mtime_ns=os.stat(os.path.join(locales, "en.json")).st_mtime_ns + 1_000_000_000)
+    problems = reload_translations()
+
+    # Старый каталог не менялся на месте: читатель со ссылкой на него видит прежнюю версию целиком.
+    assert old_catalogs["en"]["buttons.pagination.next"][0] == "Next"
+    assert language_service._catalogs is not old_catalogs
+    assert seen == ["Forward"] and problems == ["[en] отсутствует ключ 'buttons.pagination.page'"]
+
+
+def test_broken_or_invalid_locale_keeps_previous_version(locales):
+    load_translations()
+    en_path = os.path.join(locales, "en.json")
+    mtime_ns = os.stat(en_path).st_mtime_ns
+    with open(en_path, "w", encoding="utf-8") as f:
+        f.write("{not json")
+    os.utime(en_path, ns=(mtime_ns + 1_000_000_000,) * 2)
+    reload_translations()
+    after_broken = get_text("welcome", "en", name="Ann")
+
+    catalogs = language_service._catalogs
+    write_locale(locales, "en", dict(EN, welcome="Hello, {user}!"), mtime_ns=mtime_ns + 2_000_000_000)
+    problems = reload_translations(strict=True)
+
+    assert after_broken == "Hello, Ann!"
+    assert language_service._catalogs is catalogs and get_text("welcome", "en", name="Ann") == "Hello, Ann!"
+    assert "[en] ключ 'welcome': плейсхолдеры ['user'] вместо ['name']" in problems
+
+
+def test_validate_reports_missing_keys_and_placeholder_mismatches(locales):
+    problems = language_service.validate_translations({
+        "ru": RU,
+        "en": {"welcome": "Hello, {user}!", "buttons": {"pagination": {"next": "Next {page}", "page": "{page}/{total}"}}},
+        "uk": {"welcome": "Привіт, {name}!", "buttons": {"pagination": {"next": "Далі"}}},
+    })
+
+    assert problems == [
+        "[en] ключ 'buttons.pagination.next': плейсхолдеры ['page'] вместо []",
+        "[en] ключ 'welcome': плейсхолдеры ['user'] вместо ['name']",
+        "[uk] отсутствует ключ 'buttons.pagination.page'",
+    ]
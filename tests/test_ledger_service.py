@@ -0,0 +1,148 @@
+import asyncio
+import random
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func, insert, select
+
+from app.database import requests
+from app.database.models import LedgerEntry, User
+from app.services.ledger_service import (
+    REFERRAL, TOPUP, InsufficientFunds, audit_balances, compact_ledger, credit, debit, transfer
+)
+
+
+async def setup_users(factory, users: int = 3, balance: Decimal = Decimal("10.00")) -> None:
+    async with factory() as session:
+        await session.execute(insert(User), [{"id": user_id, "balance": Decimal("0")} for user_id in range(1, users + 1)])
+        for user_id in range(1, users + 1):
+            await credit(session, user_id, balance, TOPUP, f"seed:{user_id}")
+        await session.commit()
+
+
+async def entries_for(factory, key: str):
+    async with factory() as session:
+        return (await session.execute(
+            select(LedgerEntry.user_id, LedgerEntry.amount).where(LedgerEntry.idempotency_key == key)
+            .order_by(LedgerEntry.user_id))).all()
+
+
+def test_transfer_with_half_used_key_changes_nothing(database):
+    async def scenario():
+        async with database() as (_, factory):
+            await setup_users(factory)
+            async with factory() as session:
+                await credit(session, 2, Decimal("1.00"), REFERRAL, "shared")
+                await session.commit()
+
+            async with factory() as session:
+                with pytest.raises(ValueError):
+                    await transfer(session, 1, 2, Decimal("5.00"), "shared")
+                await session.commit()
+                balances = [await requests.get_balance(session, user_id) for user_id in (1, 2)]
+
+            assert balances == [Decimal("10.00"), Decimal("11.00")]
+            assert await entries_for(factory, "shared") == [(2, Decimal("1.00"))]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_operation_keeps_committed_entries_with_same_key(database):
+    async def scenario():
+        async with database() as (_, factory):
+            await setup_users(factory)
+            async with factory() as session:
+                await credit(session, 2, Decimal("1.00"), REFERRAL, "shared")
+                await session.commit()
+
+            async with factory() as session:
+                with pytest.raises(InsufficientFunds):
+                    await debit(session, 1, Decimal("50.00"), TOPUP, "shared")
+                await session.commit()
+
+            assert await entries_for(factory, "shared") == [(2, Decimal("1.00"))]
+            assert (await audit_balances(factory))[1] == 0
+
+    asyncio.run(scenario())
+
+
+def test_repeated_transfer_is_applied_once(database):
+    async def scenario():
+        async with database() as (_, factory):
+            await setup_users(factory)
+            results = []
+            for _ in range(3):
+                async with factory() as session:
+                    results.append(await transfer(session, 1, 3, Decimal("2.50"), "tg:1:transfer"))
+                    await session.commit()
+            async with factory() as session:
+                balances = [await requests.get_balance(session, user_id) for user_id in (1, 3)]
+
+            assert results == [True, False, False]
+            assert balances == [Decimal("7.50"), Decimal("12.50")]
+
+    asyncio.run(scenario())
+
+
+def test_compaction_uses_database_clock(database):
+    async def scenario():
+        async with database() as (_, factory):
+            await setup_users(factory)
+            # Записи только что созданы: по часам БД они моложе часа и не сворачиваются.
+            assert await compact_ledger(factory, settle=3600) == 0
+            assert await compact_ledger(factory, settle=0) == 3
+            async with factory() as session:
+                await transfer(session, 1, 2, Decimal("1.00"), "after-snapshot")
+                await session.commit()
+            checked, drifted, _ = await audit_balances(factory)
+            assert (checked, drifted) == (3, 0)
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_transfers_and_replays_keep_balances_consistent(database):
+    users, transfers = 20, 300
+
+    async def run_transfer(factory, update_id: int, sender_id: int, receiver_id: int, amount: Decimal) -> str:
+        async with factory() as session:
+            try:
+                applied = await transfer(session, sender_id, receiver_id, amount, f"tg:{update_id}:transfer")
+            except InsufficientFunds:
+                await session.commit()
+                return "insufficient"
+            await session.commit()
+        return "applied" if applied else "duplicate"
+
+    async def totals(factory):
+        async with factory() as session:
+            return (await session.execute(select(
+                func.sum(User.balance),
+                select(func.count()).where(User.balance < 0).scalar_subquery(),
+                select(func.count()).select_from(LedgerEntry).scalar_subquery()))).one()
+
+    async def scenario():
+        async with database() as (_, factory):
+            await setup_users(factory, users)
+            rnd = random.Random(5)
+            batch = [(update_id, *rnd.sample(range(1, users + 1), 2), Decimal(rnd.randint(1, 800)) / 100)
+                     for update_id in range(1, transfers + 1)]
+
+            results = await asyncio.gather(*(run_transfer(factory, *item) for item in batch))
+            total, negative, entries = await totals(factory)
+            assert (total, negative) == (Decimal("10.00") * users, 0)
+            assert entries == users + 2 * results.count("applied")
+            assert results.count("applied") > transfers // 2
+
+            # Повтор (повторно доставленные обновления) одновременно со сверткой журнала.
+            replay = rnd.sample(batch, transfers // 3)
+            replayed, _ = await asyncio.gather(
+                asyncio.gather(*(run_transfer(factory, *item) for item in replay)), compact_ledger(factory, settle=0))
+            total, negative, entries_after = await totals(factory)
+            assert (total, negative) == (Decimal("10.00") * users, 0)
+            # Отклоненный по балансу перевод не оставил записей - его повтор честно пробуется еще раз.
+            assert entries_after == entries + 2 * replayed.count("applied")
+            assert replayed.count("duplicate") == sum(
+                1 for item, result in zip(batch, results) if result == "applied" and item in replay)
+            assert (await audit_balances(factory))[1] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,127 @@
+import io
+import json
+import logging
+import queue
+import re
+import sys
+from datetime import datetime
+
+import pytest
+
+from app.services.logger_service import (
+    AIOGRAM_UPDATE_TEMPLATE, HAS_COLORAMA, AiogramEventFilter, BoundedQueueHandler, ColorizingFormatter, Fore,
+    JsonLinesFormatter, Style
+)
+
+CONSOLE_FORMAT = "%(asctime)s - %(levelname)s - [%(name)s] - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def test_queued_record_is_rendered_at_log_time():
+    log_queue = queue.Queue()
+    logger = logging.getLogger("tests.logger_service")
+    logger.propagate = False
+    handler = BoundedQueueHandler(log_queue)
+    logger.addHandler(handler)
+    try:
+        cart = [1, 2]
+        logger.error("Корзина %s", cart)
+        cart.append(3)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("Ошибка оплаты")
+    finally:
+        logger.removeHandler(handler)
+
+    message, failure = log_queue.get_nowait(), log_queue.get_nowait()
+    assert message.getMessage() == "Корзина [1, 2]" and message.args is None
+    assert failure.exc_info is None and "ValueError: boom" in failure.exc_text
+    payload = json.loads(JsonLinesFormatter().format(failure))
+    assert payload["message"] == "Ошибка оплаты" and "ValueError: boom" in payload["exc_info"]
+
+
+class LegacyColorizingFormatter(logging.Formatter):
+    """Прежняя реализация ColorizingFormatter (подмена полей записи на время format) - эталон вывода."""
+
+    def format(self, record):
+        saved = record.levelname, record.msg, record.args
+        record.levelname = f"{ColorizingFormatter.LEVEL_COLORS[record.levelno]}{Style.BRIGHT}{record.levelname}{Style.RESET_ALL}"
+        if record.name == "aiogram.event" and hasattr(record, "session_update_count"):
+            record.msg = (f"Обработано обновление {Style.BRIGHT}[{Fore.CYAN}ID {record.parsed_update_id}{Style.RESET_ALL}]. "
+                          f"Длительность: {Fore.GREEN}{int(record.parsed_duration_ms)} мс{Style.RESET_ALL}.")
+        else:
+            record.msg = re.sub(r"(\b\d+\.?\d*\b)", f"{Fore.CYAN}\\1{Style.RESET_ALL}", record.getMessage())
+        record.args = ()
+        try:
+            return super().format(record)
+        finally:
+            record.levelname, record.msg, record.args = saved
+
+
+def make_records():
+    """Свежие записи для каждого форматтера: stdlib кэширует текст исключения в записи."""
+    try:
+        raise ValueError("boom 42")
+    except ValueError:
+        exc_info = sys.exc_info()
+    records = [
+        logging.LogRecord("app.shop", logging.INFO, __file__, 10, "Заказ %s на %d руб., скидка 1.5", ("A-17", 250), None),
+        logging.LogRecord("app.shop", logging.WARNING, __file__, 11, "Без чисел", None, None),
+        logging.LogRecord("app.shop", logging.ERROR, __file__, 12, "Оплата %d не прошла", (7,), exc_info),
+        logging.LogRecord("aiogram.event", logging.INFO, __file__, 13, AIOGRAM_UPDATE_TEMPLATE,
+                          (42, "handled", 17, 123), None),
+    ]
+    AiogramEventFilter().filter(records[-1])
+    for record in records:
+        record.created = datetime(2026, 1, 2, 3, 4, 5).timestamp()
+    return records
+
+
+def format_all(formatter):
+    records = make_records()
+    before = [dict(record.__dict__) for record in records]
+    output = [formatter.format(record) for record in records]
+    return output, records, before
+
+
+@pytest.mark.skipif(not HAS_COLORAMA, reason="без colorama цветов нет")
+def test_colored_output_matches_legacy_formatter_without_touching_records():
+    output, records, before = format_all(ColorizingFormatter(CONSOLE_FORMAT, DATE_FORMAT, use_colors=True))
+    expected, _, _ = format_all(LegacyColorizingFormatter(CONSOLE_FORMAT, DATE_FORMAT))
+
+    assert output == expected
+    assert f"{Fore.CYAN}250{Style.RESET_ALL}" in output[0] and "ValueError: boom 42" in output[2]
+    assert [record.__dict__ for record in records] == before
+
+
+def test_plain_output_matches_standard_formatter():
+    output, _, _ = format_all(ColorizingFormatter(CONSOLE_FORMAT, DATE_FORMAT, use_colors=False))
+    expected, _, _ = format_all(logging.Formatter(CONSOLE_FORMAT, DATE_FORMAT))
+
+    # Отличается только сообщение об обновлении aiogram - оно переписывается и без цветов.
+    assert output[:3] == expected[:3]
+    assert output[3] == "2026-01-02 03:04:05 - INFO - [aiogram.event] - Обработано обновление [ID 42]. Длительность: 17 мс."
+    assert "\x1b" not in "".join(output)
+
+
+def test_colors_are_enabled_only_for_terminal_by_default():
+    class Terminal(io.StringIO):
+        def isatty(self):
+            return True
+
+    assert not ColorizingFormatter(CONSOLE_FORMAT, stream=io.StringIO()).use_colors
+    assert ColorizingFormatter(CONSOLE_FORMAT, stream=Terminal()).use_colors == HAS_COLORAMA
+
+
+def test_json_lines_carry_record_fields_and_exception():
+    output, records, before = format_all(JsonLinesFormatter())
+    payloads = [json.loads(line) for line in output]
+
+    assert payloads[0] == {
+        "time": "2026-01-02T03:04:05.000", "level": "INFO", "logger": "app.shop", "module": "test_logger_service",
+        "func": None, "line": 10, "message": "Заказ A-17 на 250 руб., скидка 1.5"}
+    assert "exc_info" not in payloads[1]
+    assert payloads[2]["exc_info"] == logging.Formatter().formatException(records[2].exc_info)
+    assert (payloads[3]["update_id"], payloads[3]["duration_ms"]) == (42, 17) and "session_update_count" in payloads[3]
+    assert [record.__dict__ for record in records] == before
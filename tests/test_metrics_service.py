@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from contextlib import nullcontext
+
+import pytest
+from aiogram import Dispatcher, F, Router
+from aiogram.types import Message, Update
+
+from app.common.middlewares import MetricsMiddleware
+from app.services.metrics_service import LatencyHistogram, SlowUpdateProfiler, UpdateMetrics
+from tests.fake_telegram import make_fake_bot, make_message_update
+
+
+@pytest.fixture
+def warnings_log(caplog):
+    """Предупреждения профилировщика: conftest глушит логи до WARNING включительно."""
+    logging.disable(logging.NOTSET)
+    caplog.set_level(logging.WARNING, logger="app.services.metrics_service")
+    return caplog
+
+
+def test_histogram_buckets_are_cumulative_and_inclusive():
+    histogram = LatencyHistogram(bounds=(0.01, 0.1, 1.0), window=2)
+    for seconds in (0.005, 0.01, 0.05, 2.0):
+        histogram.observe(seconds)
+
+    # Граница входит в свою корзину (le - "меньше или равно"), выше последней - только +Inf.
+    assert histogram.cumulative() == [("0.01", 2), ("0.1", 3), ("1.0", 3), ("+Inf", 4)]
+    assert histogram.count == 4 and histogram.total == pytest.approx(2.065)
+    # Квантили считаются по окну последних window измерений.
+    assert histogram.quantiles((0.5, 0.99)) == {0.5: 2.0, 0.99: 2.0}
+    assert LatencyHistogram().quantiles() == {}
+
+
+def test_render_prometheus_exposes_histograms_errors_and_collectors():
+    class Collector:
+        def render_prometheus(self, prefix):
+            return [f"{prefix}_extra 1"]
+
+    metrics = UpdateMetrics(buckets=(0.1,))
+    metrics.add_collector(Collector())
+    metrics.in_flight = 2
+    metrics.updates.observe(0.05)
+    metrics.observe_handler("shop", "buy", 0.5, error='Bad"Error')
+
+    lines = metrics.render_prometheus("bot").splitlines()
+
+    assert "bot_updates_in_flight 2" in lines
+    assert lines[lines.index("# TYPE bot_update_duration_seconds histogram") + 1:][:4] == [
+        'bot_update_duration_seconds_bucket{le="0.1"} 1',
+        'bot_update_duration_seconds_bucket{le="+Inf"} 1',
+        "bot_update_duration_seconds_sum 0.050000",
+        "bot_update_duration_seconds_count 1",
+    ]
+    assert 'bot_router_duration_seconds_bucket{router="shop",le="0.1"} 0' in lines
+    assert 'bot_handler_duration_seconds_count{router="shop",handler="buy"} 1' in lines
+    assert 'bot_handler_errors_total{router="shop",handler="buy",error="Bad\\"Error"} 1' in lines
+    assert lines[-1] == "bot_extra 1"
+
+
+@pytest.mark.parametrize("mode", ["stack", "cprofile"])
+def test_profiler_reports_only_updates_slower_than_threshold(warnings_log, mode):
+    profiler = SlowUpdateProfiler(threshold=0.05, mode=mode)
+
+    async def update(update_id: int, seconds: float) -> None:
+        token = profiler.start(update_id)
+        await asyncio.sleep(seconds)
+        profiler.finish(token, update_id, seconds)
+
+    async def scenario():
+        await update(1, 0.0)
+        await update(2, 0.1)
+
+    asyncio.run(scenario())
+
+    reported = [record.getMessage() for record in warnings_log.records]
+    assert len(reported) == 1 and "обновление 2" in reported[0].lower()
+    assert ("текущий стек" if mode == "stack" else "профиль cProfile") in reported[0]
+
+
+def test_profiler_skips_unsampled_updates_and_rejects_unknown_mode():
+    async def scenario():
+        return SlowUpdateProfiler(mode="stack", sample_rate=0.0).start(1)
+
+    assert asyncio.run(scenario()) is None
+    with pytest.raises(ValueError):
+        SlowUpdateProfiler(mode="trace")
+
+
+def test_middleware_records_updates_handlers_and_errors():
+    metrics = UpdateMetrics()
+    seen_in_flight = []
+    router = Router(name="shop")
+
+    @router.message(F.text == "buy")
+    async def buy(message: Message) -> None:
+        seen_in_flight.append(metrics.in_flight)
+
+    @router.message(F.text == "fail")
+    async def fail(message: Message) -> None:
+        raise RuntimeError("payment")
+
+    async def scenario():
+        bot = make_fake_bot()
+        dp = Dispatcher()
+        MetricsMiddleware(metrics).setup(dp)
+        dp.include_router(router)
+        for update_id, text in enumerate(("buy", "fail"), start=1):
+            update = Update.model_validate(make_message_update(update_id, 1, text=text), context={"bot": bot})
+            with pytest.raises(RuntimeError) if text == "fail" else nullcontext():
+                await dp.feed_update(bot, update)
+
+    asyncio.run(scenario())
+
+    assert seen_in_flight == [1] and metrics.in_flight == 0
+    assert metrics.updates.count == 2 and metrics.routers["shop"].count == 2
+    assert {handler for _, handler in metrics.handlers} == {
+        "test_middleware_records_updates_handlers_and_errors.<locals>.buy",
+        "test_middleware_records_updates_handlers_and_errors.<locals>.fail",
+    }
+    assert list(metrics.errors.items()) == [
+        (("shop", "test_middleware_records_updates_handlers_and_errors.<locals>.fail", "RuntimeError"), 1)]
@@ -0,0 +1,183 @@
+import asyncio
+import random
+from contextlib import asynccontextmanager
+from decimal import Decimal
+
+import pytest
+from aiocryptopay import AioCryptoPay
+from aiogram.types import SuccessfulPayment
+from aiohttp import ClientSession, web
+from sqlalchemy import func, insert, select
+
+from app.database import requests
+from app.database.models import LedgerEntry, TopUp, User
+from app.services import ledger_service
+from app.services.ledger_service import audit_balances
+from app.services.payment_service import CRYPTOBOT, PaymentService
+from tests.fake_cryptobot import FAKE_CRYPTOBOT_TOKEN, FakeCryptoBot
+
+USERS = 10
+INVOICES = 40
+
+
+def stars_payment(service: PaymentService, charge_id: str, amount: str = "4.99") -> SuccessfulPayment:
+    return SuccessfulPayment(
+        currency="XTR", total_amount=service.stars_for(Decimal(amount)), invoice_payload=f"topup:{amount}",
+        telegram_payment_charge_id=charge_id, provider_payment_charge_id="")
+
+
+def test_stars_payment_from_unregistered_user_is_credited_once(database):
+    async def scenario():
+        async with database() as (_, factory):
+            service = PaymentService(None, factory, stars_per_usd=Decimal("50"))
+            payment = stars_payment(service, "charge-1")
+
+            # Строки users для пользователя нет: зачисление создает ее, а не падает на внешнем ключе.
+            results = []
+            for _ in range(2):
+                async with factory() as session:
+                    results.append(await service.credit_stars_payment(session, 777, payment))
+                    await session.commit()
+            async with factory() as session:
+                balance = await requests.get_balance(session, 777)
+
+            assert results == [Decimal("4.99"), None]
+            assert balance == Decimal("4.99")
+
+    asyncio.run(scenario())
+
+
+@asynccontextmanager
+async def cryptobot(factory):
+    """Пользователи в БД (четные приглашены предыдущим) и клиент Crypto Pay, направленный в локальную заглушку."""
+    async with factory() as session:
+        await session.execute(insert(User), [
+            {"id": user_id, "referrer_id": user_id - 1 if user_id % 2 == 0 else None}
+            for user_id in range(1, USERS + 1)])
+        await session.commit()
+    fake = FakeCryptoBot()
+    crypto = AioCryptoPay(FAKE_CRYPTOBOT_TOKEN, network=await fake.start())
+    try:
+        yield fake, crypto
+    finally:
+        await crypto.close()
+        await fake.stop()
+
+
+async def seed_invoices(factory, fake: FakeCryptoBot, count: int) -> list:
+    rnd = random.Random(7)
+    invoices = []
+    for _ in range(count):
+        user_id, amount = rnd.randint(1, USERS), Decimal(rnd.randint(100, 10_000)) / 100
+        invoices.append((fake.create(float(amount), str(user_id))["invoice_id"], user_id, amount))
+    async with factory() as session:
+        await session.execute(insert(TopUp), [
+            {"user_id": user_id, "provider": CRYPTOBOT, "external_id": str(invoice_id), "amount": amount,
+             "status": "pending"} for invoice_id, user_id, amount in invoices])
+        await session.commit()
+    return invoices
+
+
+def test_created_invoice_is_credited_by_reconcile(database):
+    async def scenario():
+        async with database() as (_, factory), cryptobot(factory) as (fake, crypto):
+            service = PaymentService(crypto, factory)
+            async with factory() as session:
+                invoice = await service.create_invoice(session, 1, Decimal("10.00"))
+                await session.commit()
+            fake.pay([invoice.invoice_id])
+            first, second = await service.reconcile(), await service.reconcile()
+            async with factory() as session:
+                balance = await requests.get_balance(session, 1)
+
+            assert fake.invoices[invoice.invoice_id]["payload"] == "1"
+            assert (first, second) == (1, 0)
+            assert balance == Decimal("10.00")
+
+    asyncio.run(scenario())
+
+
+def test_reconcile_applies_paid_and_expired_in_batches(database):
+    async def scenario():
+        async with database() as (_, factory), cryptobot(factory) as (fake, crypto):
+            ids = [invoice_id for invoice_id, _, _ in await seed_invoices(factory, fake, INVOICES)]
+            paid, expired, active = ids[:30], ids[30:35], ids[35:]
+            fake.pay(paid)
+            fake.expire(expired)
+            service = PaymentService(crypto, factory, batch_size=16)
+            checked = await service.reconcile()
+            rechecked = await service.reconcile()
+
+            assert checked == INVOICES
+            assert (service.stats.credited, service.stats.expired) == (len(paid), len(expired))
+            assert rechecked == len(active)
+            assert fake.requests["/api/getInvoices"] == 3 + 1 # Пачки по 16: 40 счетов, затем 5 оставшихся
+
+    asyncio.run(scenario())
+
+
+def test_reconcile_error_is_not_masked_by_failed_pending_write(database, monkeypatch):
+    async def scenario():
+        async with database() as (_, factory), cryptobot(factory) as (fake, crypto):
+            await seed_invoices(factory, fake, 20)
+            service = PaymentService(crypto, factory, batch_size=10)
+            fetch_invoices, written = service._fetch_invoices, []
+
+            async def fetch_then_fail(invoice_ids):
+                if written:
+                    raise ConnectionError("CryptoBot недоступен")
+                return await fetch_invoices(invoice_ids)
+
+            async def failing_write(invoices):
+                written.append(invoices)
+                await asyncio.sleep(0)
+                raise RuntimeError("БД недоступна")
+
+            monkeypatch.setattr(service, "_fetch_invoices", fetch_then_fail)
+            monkeypatch.setattr(service, "apply_invoices", failing_write)
+            # Запрос второй пачки падает, пока запись первой еще идет и тоже падает.
+            with pytest.raises(ConnectionError):
+                await service.reconcile()
+
+            assert len(written) == 1
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_webhooks_and_reconcile_credit_each_invoice_once(database):
+    async def scenario():
+        async with database() as (_, factory), cryptobot(factory) as (fake, crypto):
+            invoices = await seed_invoices(factory, fake, INVOICES)
+            fake.pay(invoice_id for invoice_id, _, _ in invoices)
+            service = PaymentService(crypto, factory, batch_size=16)
+
+            app = web.Application()
+            app.router.add_post("/cryptobot", service.handle_webhook)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/cryptobot"
+            async with ClientSession() as http:
+                deliveries = [invoice_id for invoice_id, _, _ in invoices] * 2
+                random.Random(1).shuffle(deliveries)
+                _, *statuses = await asyncio.gather(
+                    service.reconcile(), *(fake.send_webhook(http, url, invoice_id) for invoice_id in deliveries))
+                forged = await fake.send_webhook(http, url, invoices[0][0], token="1:FORGED")
+            await runner.cleanup()
+
+            async with factory() as session:
+                paid = dict((await session.execute(
+                    select(TopUp.user_id, func.sum(TopUp.amount)).where(TopUp.status == "paid")
+                    .group_by(TopUp.user_id))).all())
+                credited = dict((await session.execute(
+                    select(LedgerEntry.user_id, func.sum(LedgerEntry.amount))
+                    .where(LedgerEntry.kind == ledger_service.TOPUP).group_by(LedgerEntry.user_id))).all())
+            drifted = (await audit_balances(factory))[1]
+
+            assert all(status == 200 for status in statuses)
+            assert forged == 401 and service.stats.rejected_webhooks == 1
+            assert service.stats.credited == INVOICES
+            assert paid == credited and drifted == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,111 @@
+import asyncio
+from collections import Counter
+from decimal import Decimal
+
+from sqlalchemy import func, insert, select
+
+from app.database import requests
+from app.database.models import Category, LedgerEntry, Product, PromoRedemption, User
+from app.services.promo_service import (
+    ALREADY_USED, BALANCE, DISCOUNT, EXHAUSTED, TOPUP_BONUS, Promo, PromoIndex, PromoRejected, create_promo, redeem
+)
+
+USERS = 40
+
+
+async def seed(factory) -> None:
+    async with factory() as session:
+        await session.execute(insert(User), [{"id": user_id, "balance": Decimal("0")} for user_id in range(1, USERS + 1)])
+        await session.execute(insert(Category), [{"id": i, "name": f"cat{i}"} for i in (10, 11)])
+        await session.execute(insert(Product), [{"id": i, "category_id": 10 if i < 3 else 11, "title": f"p{i}"}
+                                                for i in range(1, 5)])
+        await session.commit()
+
+
+async def attempt(factory, index: PromoIndex, code: str, user_id: int) -> str:
+    async with factory() as session:
+        try:
+            await redeem(session, code, user_id, index)
+        except PromoRejected as e:
+            await session.commit()
+            return e.reason
+        await session.commit()
+    return "ok"
+
+
+async def redemptions(factory, promo_id: int):
+    async with factory() as session:
+        return (await session.execute(select(PromoRedemption.user_id).where(PromoRedemption.promo_id == promo_id)
+                                      .order_by(PromoRedemption.user_id))).scalars().all()
+
+
+def test_concurrent_redemptions_respect_the_limit(database):
+    async def scenario():
+        async with database() as (_, factory):
+            await seed(factory)
+            index = PromoIndex()
+            async with factory() as session:
+                promo = await create_promo(session, "spring", BALANCE, Decimal("1.00"), max_uses=7, shards=3,
+                                           index=index)
+            results = await asyncio.gather(*(attempt(factory, index, "SPRING", user_id)
+                                             for user_id in range(1, USERS + 1)))
+            async with factory() as session:
+                usage = await requests.get_promo_usage(session, promo.id)
+                credited = await session.scalar(select(func.count()).select_from(LedgerEntry)
+                                                .where(LedgerEntry.idempotency_key.like(f"promo:{promo.id}:%")))
+            redeemed = await redemptions(factory, promo.id)
+
+            async with factory() as session:
+                other = await create_promo(session, "again", BALANCE, Decimal("1.00"), max_uses=5, index=index)
+            repeated = [await attempt(factory, index, "again", 1) for _ in range(2)]
+
+            assert Counter(results) == {"ok": 7, EXHAUSTED: USERS - 7}
+            assert usage == (7, 7) and credited == 7
+            assert redeemed == sorted(user_id for user_id, result in zip(range(1, USERS + 1), results) if result == "ok")
+            assert repeated == ["ok", ALREADY_USED] and await redemptions(factory, other.id) == [1]
+
+    asyncio.run(scenario())
+
+
+def test_exhausted_redemption_removes_its_row(database):
+    async def scenario():
+        async with database() as (_, factory):
+            await seed(factory)
+            index = PromoIndex()
+            async with factory() as session:
+                promo = await create_promo(session, "last", BALANCE, Decimal("1.00"), max_uses=1, shards=1, index=index)
+            # Индекс другого процесса загружен до того, как код исчерпали, и считает шард свободным.
+            stale = PromoIndex()
+            await stale.reload(factory)
+
+            first = await attempt(factory, index, "last", 1)
+            second = await attempt(factory, stale, "last", 2)
+
+            assert (first, second) == ("ok", EXHAUSTED)
+            assert await redemptions(factory, promo.id) == [1]
+            assert stale.get("last").exhausted
+
+    asyncio.run(scenario())
+
+
+def test_discount_prices_apply_to_target_products_and_categories(database):
+    cart = [(1, 10, Decimal("10.00")), (3, 11, Decimal("4.00")), (4, 11, Decimal("2.00"))]
+
+    async def scenario():
+        async with database() as (_, factory):
+            await seed(factory)
+            async with factory() as session:
+                await create_promo(session, "sale", DISCOUNT, Decimal("0.25"), target_product_ids=[3],
+                                   target_category_ids=[10], index=PromoIndex())
+            index = PromoIndex()
+            await index.reload(factory)
+            return index.get("sale")
+
+    loaded = asyncio.run(scenario())
+    everything = Promo(2, "ALL", DISCOUNT, Decimal("0.1"), None, None, None, None)
+    bonus = Promo(3, "BONUS", TOPUP_BONUS, Decimal("0.1"), None, None, None, None, product_ids=frozenset({1}))
+
+    assert (loaded.product_ids, loaded.category_ids) == ({3}, {10})
+    assert loaded.prices(cart) == [Decimal("7.50"), Decimal("3.00"), Decimal("2.00")]
+    assert everything.prices(cart) == [Decimal("9.00"), Decimal("3.60"), Decimal("1.80")]
+    assert bonus.prices(cart) == [price for _, _, price in cart]
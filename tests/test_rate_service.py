@@ -0,0 +1,80 @@
+import asyncio
+from decimal import Decimal
+
+import httpx
+
+from app.services.rate_service import RateService
+
+
+class StubCbr:
+    """Локальная заглушка cbr-xml-daily.ru: отдает курс, умеет "падать" и считает запросы."""
+
+    def __init__(self, rate: float = 92.5, latency: float = 0.01):
+        self.rate = rate
+        self.latency = latency
+        self.down = False
+        self.requests = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if self.down:
+            return httpx.Response(503, text="unavailable")
+        return httpx.Response(200, json={"Valute": {"USD": {"Nominal": 1, "Value": self.rate}}})
+
+
+def make_service(stub: StubCbr, **kwargs) -> RateService:
+    return RateService(transport=httpx.MockTransport(stub.handle), **kwargs)
+
+
+def test_conversion_uses_one_quote_for_the_whole_list():
+    async def scenario():
+        stub = StubCbr()
+        service = make_service(stub)
+        before = service.usd_to_rub([Decimal("1")])
+        await service.refresh()
+        converted = service.usd_to_rub([Decimal("1"), Decimal("0.015"), Decimal("10.99")])
+        back = service.rub_to_usd([Decimal("92.5")])
+        await service.close()
+
+        assert before == [None]
+        assert converted == [Decimal("92.50"), Decimal("1.39"), Decimal("1016.58")]
+        assert back == [Decimal("1.00")]
+
+    asyncio.run(scenario())
+
+
+def test_stale_quote_is_served_while_one_background_refresh_runs():
+    async def scenario():
+        stub = StubCbr(latency=0.05)
+        service = make_service(stub, refresh_interval=0.01)
+        await service.refresh()
+        stale = service.quote
+        await asyncio.sleep(0.02)
+        stub.rate = 95.0
+
+        quotes = [service.current() for _ in range(100)]
+        await service._refreshing
+        fresh = service.current()
+        await service.close()
+
+        assert all(quote is stale for quote in quotes)
+        assert stub.requests == 2
+        assert fresh.rub_per_usd == Decimal("95")
+
+    asyncio.run(scenario())
+
+
+def test_source_failure_keeps_last_good_quote():
+    async def scenario():
+        stub = StubCbr()
+        service = make_service(stub)
+        await service.refresh()
+        stub.down = True
+        refreshed = await service.refresh()
+        await service.close()
+
+        assert not refreshed and service.failures == 1
+        assert service.quote.rub_per_usd == Decimal("92.5")
+
+    asyncio.run(scenario())
@@ -0,0 +1,42 @@
+import asyncio
+from decimal import Decimal
+
+from sqlalchemy import insert, select
+
+from app.database import requests
+from app.database.models import TopUp, User
+from app.services.referral_service import reconcile_referral_aggregates
+
+
+def test_reconcile_keeps_increments_committed_during_batch(database, monkeypatch):
+    async def scenario():
+        async with database() as (_, factory):
+            async with factory() as session:
+                # Агрегаты пригласившего испорчены: один реферал с оплаченным пополнением на $10 не учтен.
+                await session.execute(insert(User), [{"id": 1}, {"id": 2, "referrer_id": 1}])
+                await session.execute(insert(TopUp), [
+                    {"user_id": 2, "provider": "stars", "external_id": "a", "amount": Decimal("10"), "status": "paid"}])
+                await session.commit()
+
+            adjust = requests.adjust_referral_aggregates
+
+            async def topup_then_adjust(session, rows):
+                # Пополнение реферала фиксируется между чтением пачки и записью исправлений.
+                async with factory() as other:
+                    await other.execute(insert(TopUp), [
+                        {"user_id": 2, "provider": "stars", "external_id": "b", "amount": Decimal("5"), "status": "paid"}])
+                    await requests.add_referral_topup(other, 1, Decimal("5"))
+                    await other.commit()
+                await adjust(session, rows)
+
+            monkeypatch.setattr(requests, "adjust_referral_aggregates", topup_then_adjust)
+            report = await reconcile_referral_aggregates(factory, batch_size=10)
+
+            async with factory() as session:
+                stored = (await session.execute(
+                    select(User.referral_count, User.referral_topup_total).where(User.id == 1))).one()
+
+            assert report.drifted == 1
+            assert tuple(stored) == (1, Decimal("15"))
+
+    asyncio.run(scenario())
@@ -0,0 +1,89 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import insert, select
+
+from app.database import requests
+from app.database.database import assert_max_queries, create_engine
+from app.database.models import Category, Product, ProductVariant, TopUp, User
+
+USERS = 10
+PRODUCTS = 40
+PROFILE_USER_ID = 1
+
+# Экран -> (функция, допустимое число запросов на страницу при любом ее размере).
+HISTORY_SCREENS = {
+    "purchases": (requests.list_purchase_history, 3),
+    "sales": (requests.list_sale_history, 3),
+    "top-ups": (requests.list_topup_history, 1),
+    "lots": (requests.list_user_lots, 2),
+}
+
+
+async def seed(factory) -> None:
+    async with factory() as session:
+        await session.execute(insert(User), [{"id": i} for i in range(1, USERS + 1)])
+        await session.execute(insert(Category), [{"id": i, "name": f"cat{i}"} for i in range(1, 5)])
+        await session.execute(insert(Product), [
+            {"id": i, "category_id": i % 4 + 1, "seller_id": PROFILE_USER_ID if i % 2 else None, "title": f"product {i}"}
+            for i in range(1, PRODUCTS + 1)])
+        await session.execute(insert(ProductVariant), [
+            {"product_id": i, "name": "base", "price": Decimal("9.99")} for i in range(1, PRODUCTS + 1)])
+        await requests.bulk_insert_purchases(session, [
+            {"user_id": user_id, "product_id": i, "variant_id": i, "seller_id": PROFILE_USER_ID if i % 2 else None,
+             "price": Decimal("9.99")} for i in range(1, PRODUCTS + 1) for user_id in (PROFILE_USER_ID, 2)])
+        await requests.bulk_upsert_topups(session, [
+            {"user_id": PROFILE_USER_ID, "provider": "cryptobot", "external_id": str(i), "amount": Decimal("5"),
+             "status": "pending"} for i in range(PRODUCTS)])
+        await session.commit()
+
+
+@pytest.mark.parametrize("screen", HISTORY_SCREENS)
+def test_history_pages_use_fixed_number_of_queries(database, screen):
+    fetch_page, limit = HISTORY_SCREENS[screen]
+
+    async def scenario():
+        async with database() as (db_engine, factory):
+            await seed(factory)
+            for page_size in (2, 10):
+                async with factory() as session:
+                    with assert_max_queries(db_engine, limit):
+                        rows, has_next = await fetch_page(session, PROFILE_USER_ID, page_size)
+                    assert len(rows) == page_size and has_next
+
+    asyncio.run(scenario())
+
+
+def test_product_details_are_loaded_without_n_plus_one(database):
+    async def scenario():
+        async with database() as (db_engine, factory):
+            await seed(factory)
+            async with factory() as session:
+                with assert_max_queries(db_engine, 4):
+                    products = await requests.get_products_with_details(session, list(range(1, PRODUCTS + 1)))
+                    assert all(product.variants and product.category for product in products)
+            assert len(products) == PRODUCTS
+
+    asyncio.run(scenario())
+
+
+def test_bulk_upsert_topups_updates_existing_rows(database):
+    async def scenario():
+        async with database() as (_, factory):
+            await seed(factory)
+            async with factory() as session:
+                await requests.bulk_upsert_topups(session, [
+                    {"user_id": PROFILE_USER_ID, "provider": "cryptobot", "external_id": "0", "amount": Decimal("5"),
+                     "status": "paid"}])
+                await session.commit()
+                statuses = (await session.execute(select(TopUp.status).order_by(TopUp.id))).scalars().all()
+            assert len(statuses) == PRODUCTS
+            assert statuses.count("paid") == 1 and statuses[0] == "paid"
+
+    asyncio.run(scenario())
+
+
+def test_unsupported_database_is_rejected_at_engine_creation():
+    with pytest.raises(ValueError, match="postgresql"):
+        create_engine("postgresql+asyncpg://bot@localhost/shop")
@@ -0,0 +1,84 @@
+import asyncio
+
+from sqlalchemy import insert
+
+from app.database import requests
+from app.database.models import Category, Product
+from app.keyboards.keyboard_wrapper import CATALOG_MENU, KeyboardBuilder, PageWindow, keyboard_cache
+from app.services.search_service import CatalogSearchIndex, index_product, rebuild_index, remove_lot
+
+
+def test_lot_removed_during_rebuild_stays_removed(database, monkeypatch):
+    async def scenario():
+        async with database() as (_, factory):
+            async with factory() as session:
+                await session.execute(insert(Category), [{"id": 1, "name": "VPN"}])
+                await session.execute(insert(Product), [
+                    {"id": product_id, "category_id": 1, "title": f"vpn lot {product_id}"} for product_id in (1, 2, 3)])
+                await session.commit()
+
+            index = CatalogSearchIndex()
+            list_documents = requests.list_search_documents
+
+            async def list_then_moderate(session, after_id, limit):
+                rows = await list_documents(session, after_id, limit)
+                if after_id == 0:
+                    # Модерация снимает лот, уже прочитанный перестройкой, и публикует новый.
+                    async with factory() as other:
+                        await remove_lot(other, 2, index)
+                    index.add(4, "vpn lot 4", category="VPN", category_id=1)
+                return rows
+
+            monkeypatch.setattr(requests, "list_search_documents", list_then_moderate)
+            indexed = await rebuild_index(factory, batch_size=10, index=index)
+
+            assert indexed == 3
+            assert sorted(index.search("vpn")) == [1, 3, 4]
+            assert not index._rebuild_logs
+
+    asyncio.run(scenario())
+
+
+def test_prefix_expansion_keeps_most_frequent_tokens():
+    index = CatalogSearchIndex(max_prefix_expansions=2)
+    for product_id in range(1, 6):
+        index.add(product_id, "netflix premium")
+    for product_id, word in enumerate(("neta", "netb", "netc", "netd"), start=10):
+        index.add(product_id, word)
+
+    assert index._prefix_tokens("ne")[0] == "netflix"
+    assert set(range(1, 6)) <= set(index.search("ne"))
+
+
+def test_catalog_changes_drop_cached_catalog_keyboards(database):
+    pages = []
+
+    def catalog_page(page: int, per_page: int) -> PageWindow:
+        pages.append(page)
+        return PageWindow([{"text": "VPN", "callback_data": "product:1"}], total=1)
+
+    async def open_catalog():
+        await KeyboardBuilder(lambda key, **kwargs: key).build_paginated(catalog_page, 5, cache_key=("ru", CATALOG_MENU))
+
+    async def scenario():
+        async with database() as (_, factory):
+            async with factory() as session:
+                session.add(Category(id=1, name="VPN"))
+                session.add(product := Product(id=1, category_id=1, title="vpn lot"))
+                await session.commit()
+            index = CatalogSearchIndex()
+            keyboard_cache.invalidate(menu=CATALOG_MENU)
+
+            await open_catalog()
+            await open_catalog()
+            index_product(product, "VPN", index)
+            await open_catalog()
+            async with factory() as session:
+                await remove_lot(session, 1, index)
+            await open_catalog()
+            await open_catalog()
+
+            assert pages == [1, 1, 1]
+            assert 1 not in index
+
+    asyncio.run(scenario())
@@ -0,0 +1,57 @@
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+from aiogram import Dispatcher, F, Router
+from aiogram.types import Message
+
+from app import config
+from app.server import WebhookServer, run_webhook
+from tests.fake_telegram import make_fake_bot, make_message_update
+
+
+class FakeRequest:
+    """Минимум aiohttp.web.Request, который читает WebhookServer.handle_update."""
+
+    def __init__(self, payload: Dict[str, Any]):
+        self.headers: Dict[str, str] = {}
+        self._payload = payload
+
+    async def json(self) -> Dict[str, Any]:
+        return self._payload
+
+
+def test_update_waiting_for_a_slot_is_rejected_once_drain_starts():
+    async def scenario():
+        handled: List[str] = []
+        release = asyncio.Event()
+        router = Router()
+
+        @router.message(F.text)
+        async def record(message: Message) -> None:
+            await release.wait()
+            handled.append(message.text)
+
+        dp = Dispatcher()
+        dp.include_router(router)
+        server = WebhookServer(dp, make_fake_bot(), max_concurrency=1, drain_timeout=5)
+
+        first = await server.handle_update(FakeRequest(make_message_update(1, 1, text="first")))
+        waiting = asyncio.create_task(server.handle_update(FakeRequest(make_message_update(2, 2, text="second"))))
+        await asyncio.sleep(0.01)
+        draining = asyncio.create_task(server.drain())
+        await asyncio.sleep(0.01)
+        release.set()
+        second = await waiting
+        await draining
+
+        assert (first.status, second.status) == (200, 503)
+        assert handled == ["first"] and server.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_run_webhook_requires_base_url(monkeypatch):
+    monkeypatch.delattr(config, "WEBHOOK_BASE_URL", raising=False)
+    with pytest.raises(RuntimeError, match="WEBHOOK_BASE_URL"):
+        asyncio.run(run_webhook(Dispatcher(), make_fake_bot()))
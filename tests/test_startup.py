@@ -0,0 +1,19 @@
+import json
+import subprocess
+import sys
+
+# Зависимости, которые нужны только по требованию: без БД, платежей и вебхука их нет в sys.modules.
+DEFERRED = ("httpx", "aiocryptopay", "aiohttp.web", "app.server", "sqlalchemy")
+
+CHILD = """
+import json, sys
+import main
+main.include_routers(main.dp, main.ROUTERS)
+print(json.dumps([name for name in %r if name in sys.modules]))
+""" % (DEFERRED,)
+
+
+def test_startup_does_not_import_deferred_dependencies():
+    # Отдельный процесс: в процессе pytest эти модули уже загружены другими тестами.
+    result = subprocess.run([sys.executable, "-c", CHILD], capture_output=True, text=True, check=True)
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == []
@@ -0,0 +1,76 @@
+import asyncio
+import random
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+from aiogram import Dispatcher, F, Router
+from aiogram.types import Message, Update
+
+from app.common.middlewares import UserLaneMiddleware
+from tests.fake_telegram import make_fake_bot, make_message_update
+
+USERS = 20
+UPDATES_PER_USER = 10
+MAX_WORK = 0.01
+
+
+async def feed(lanes: UserLaneMiddleware, concurrent: int) -> Tuple[Dict[int, List[int]], int, int]:
+    """
+    Подает перемешанные обновления пользователей как polling. Хэндлеры ждут, пока одновременно
+    не запустятся concurrent из них: если полосы не дают такого параллелизма, тест упадет по таймауту.
+    :return: (порядок по пользователям, максимум хэндлеров одновременно, максимум хэндлеров одного пользователя).
+    """
+    bot = make_fake_bot()
+    seen: Dict[int, List[int]] = defaultdict(list)
+    running: Counter = Counter()
+    all_started = asyncio.Event()
+    peak = peak_per_user = 0
+    rng = random.Random(1)
+    router = Router()
+
+    @router.message(F.text)
+    async def record(message: Message) -> None:
+        nonlocal peak, peak_per_user
+        user_id = message.from_user.id
+        running[user_id] += 1
+        peak = max(peak, sum(running.values()))
+        peak_per_user = max(peak_per_user, running[user_id])
+        if peak >= concurrent:
+            all_started.set()
+        await asyncio.wait_for(all_started.wait(), timeout=5)
+        await asyncio.sleep(rng.random() * MAX_WORK)
+        seen[user_id].append(int(message.text))
+        running[user_id] -= 1
+
+    dp = Dispatcher()
+    lanes.setup(dp)
+    dp.include_router(router)
+    updates = [
+        Update.model_validate(make_message_update(seq * USERS + user_id, user_id, text=str(seq)), context={"bot": bot})
+        for seq in range(UPDATES_PER_USER) for user_id in range(1, USERS + 1)]
+
+    await asyncio.gather(*(asyncio.create_task(dp.feed_update(bot, update)) for update in updates))
+    await dp.emit_shutdown(bot=bot)
+    return seen, peak, peak_per_user
+
+
+def test_lanes_keep_per_user_order_and_run_users_concurrently():
+    async def scenario():
+        seen, peak, peak_per_user = await feed(UserLaneMiddleware(lanes=32, queue_size=4), concurrent=USERS)
+
+        assert sorted(seen) == list(range(1, USERS + 1))
+        for user_id, order in seen.items():
+            assert order == list(range(UPDATES_PER_USER)), f"порядок пользователя {user_id}: {order}"
+        # У каждого пользователя своя полоса: обновления разных пользователей идут одновременно,
+        # одного - никогда. Проверяем счетчиками, а не временем - не зависит от скорости машины.
+        assert peak == USERS and peak_per_user == 1
+
+    asyncio.run(scenario())
+
+
+def test_users_sharing_a_lane_are_processed_one_at_a_time():
+    async def scenario():
+        _, peak, peak_per_user = await feed(UserLaneMiddleware(lanes=4, queue_size=4), concurrent=4)
+        assert peak == 4 and peak_per_user == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,81 @@
+import asyncio
+
+from app.services import user_service
+from app.services.user_service import UserCache, make_db_loader, register_user, set_user_banned, set_user_language
+
+
+def test_missing_user_is_cached_until_registration(database, monkeypatch):
+    async def scenario():
+        async with database() as (_, factory):
+            cache = UserCache(missing_ttl=60.0)
+            monkeypatch.setattr(user_service, "user_cache", cache)
+            db_loader = make_db_loader(factory)
+            loads = []
+
+            async def loader(user_id):
+                loads.append(user_id)
+                return await db_loader(user_id)
+
+            # Пользователя нет в БД: в БД идет только первое обновление.
+            missing = [await cache.get(42, loader) for _ in range(5)]
+
+            async with factory() as session:
+                assert await register_user(session, 42, language="en")
+                await session.commit()
+            registered = await cache.get(42, loader)
+
+            assert missing == [None] * 5
+            assert registered is not None and registered.language == "en"
+            assert loads == [42, 42]
+
+    asyncio.run(scenario())
+
+
+def test_language_change_invalidates_cache_after_commit(database, monkeypatch):
+    async def scenario():
+        async with database() as (_, factory):
+            cache = UserCache()
+            monkeypatch.setattr(user_service, "user_cache", cache)
+            loader = make_db_loader(factory)
+            async with factory() as session:
+                await register_user(session, 7, language="ru")
+                await session.commit()
+
+            async with factory() as session:
+                assert await set_user_language(session, 7, "en")
+                # Промах до коммита читает старую строку и кладет ее в кэш.
+                before_commit = await cache.get(7, loader)
+                await session.commit()
+            after_commit = await cache.get(7, loader)
+
+            assert before_commit.language == "ru"
+            assert after_commit.language == "en"
+
+    asyncio.run(scenario())
+
+
+def test_ban_invalidates_cache_only_when_committed(database, monkeypatch):
+    async def scenario():
+        async with database() as (_, factory):
+            cache = UserCache()
+            monkeypatch.setattr(user_service, "user_cache", cache)
+            loader = make_db_loader(factory)
+            async with factory() as session:
+                await register_user(session, 7)
+                await session.commit()
+            cached = await cache.get(7, loader)
+
+            async with factory() as session:
+                assert await set_user_banned(session, 7)
+                await session.rollback()
+            after_rollback = await cache.get(7)
+
+            async with factory() as session:
+                assert await set_user_banned(session, 7)
+                await session.commit()
+            after_commit = await cache.get(7, loader)
+
+            assert after_rollback is cached and not cached.is_banned
+            assert after_commit.is_banned
+
+    asyncio.run(scenario())